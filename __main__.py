@@ -16,21 +16,30 @@
     You should have received a copy of the GNU General Public License
     along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
+import sys
 
+from src.config import Config
 from src.control import Downloader
-from src.utils import logger, sql_cursor, sql_connection
+from src.runtime import Runtime
+from src.utils import logger
 
 def main():
     try:
-        Downloader().download_companies(do_save_full_document=False)
+        runtime = Runtime(Config.from_command_line()).start()
+    except ValueError as e:
+        # e.g. --resume given a batch which cannot be resumed
+        sys.exit('Cannot start the batch: %s' % e)
+    try:
+        Downloader(runtime).download_companies(do_save_full_document=False)
     except Exception:
         # this makes sure that the full error message is recorded in
         # the logger text file for the process
         logger.exception("Fatal error in company downloading")
 
-    # tidy up database before closing
-    sql_cursor.execute("delete from metadata where sec_cik like 'dummy%'")
-    sql_connection.close()
+    # the dummy row reserving the batch number is kept: other batches may
+    # still be running, and the batch number of a batch which saved no
+    # sections must not be taken again (see Runtime.reserve_batch_number)
+    runtime.close()
 
 
 if __name__ == '__main__':
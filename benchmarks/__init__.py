@@ -0,0 +1,7 @@
+"""
+    secedgartext: extract text from SEC corporate filings
+    Copyright (C) 2017  Alexander Ions
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
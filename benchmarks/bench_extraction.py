@@ -0,0 +1,358 @@
+"""
+    secedgartext: extract text from SEC corporate filings
+    Copyright (C) 2017  Alexander Ions
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Micro-benchmarks of the CPU-bound extraction stages, on synthetic
+documents of increasing size (see synthetic.generate_document) and,
+optionally, on a folder of real submissions such as the slow_corpus
+folder saved in --profile mode. The parsers of EDGAR listing and filing
+index pages are timed on the saved pages in the fixtures folder (or
+--pages), with the BeautifulSoup parsers for comparison. Run from the
+project folder:
+
+    python -m benchmarks.bench_extraction --sizes 100K,1M,10M
+    python -m benchmarks.bench_extraction --save_baseline baseline.json
+    python -m benchmarks.bench_extraction --baseline baseline.json
+
+Each benchmark reports the best of --repeats runs at each size, and the
+exponent k of a fitted curve time ~ size^k: k well above 1 means that the
+stage scales worse than linearly with document size. When compared with
+a baseline, the exit status is 1 if any timing is slower than the baseline
+by more than --threshold.
+"""
+import argparse
+import gc
+import json
+import math
+import os
+import platform
+import sys
+import time
+
+from benchmarks import synthetic
+from src import download, edgar_pages, html_document, text_document, \
+    xbrl_document
+from src.config import load_search_terms
+
+FIXTURES_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               'fixtures')
+
+# exponent of the time ~ size^k curve above which a stage is reported as
+# scaling superlinearly
+SUPERLINEAR_EXPONENT = 1.3
+
+# listing and index pages parse in well under a millisecond: report the
+# best of at least this many runs
+PAGE_REPEATS = 50
+
+
+def parse_size(size_string):
+    """'100K', '1M', '200M' etc. as a number of characters
+    """
+    multipliers = {'K': 1000, 'M': 1000 ** 2, 'G': 1000 ** 3}
+    size_string = size_string.strip().upper()
+    if size_string[-1] in multipliers:
+        return int(float(size_string[:-1]) * multipliers[size_string[-1]])
+    return int(size_string)
+
+
+def format_size(size):
+    for unit, multiplier in [('G', 1000 ** 3), ('M', 1000 ** 2),
+                             ('K', 1000)]:
+        if size >= multiplier:
+            return '%g%s' % (size / multiplier, unit)
+    return str(size)
+
+
+def best_time(function, repeats):
+    """Best wall-clock time of repeats calls of function, in seconds
+    """
+    times = []
+    for _ in range(repeats):
+        gc.collect()
+        start_time = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start_time)
+    return min(times)
+
+
+def complexity_exponent(sizes, times):
+    """Least-squares slope of log(time) against log(size)
+    """
+    points = [(math.log(s), math.log(t)) for s, t in zip(sizes, times)
+              if t > 0]
+    if len(points) < 2:
+        return None
+    mean_x = sum(x for x, y in points) / len(points)
+    mean_y = sum(y for x, y in points) / len(points)
+    sxx = sum((x - mean_x) ** 2 for x, y in points)
+    if not sxx:
+        return None
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / sxx
+
+
+class ExtractionBenchmarks(object):
+    """Set up each benchmark for a document, excluding the setup from the
+    timed function
+    """
+
+    def __init__(self, form_type):
+        self.form_type = form_type
+        self.search_terms = load_search_terms()[form_type]
+
+    def html_prepare_text(self, html_text):
+        return lambda: html_document.HtmlDocument('bench', html_text,
+                                                  'html').prepare_text()
+
+    def xbrl_prepare_text(self, xbrl_text):
+        if not self.xbrl_sections_match(xbrl_text):
+            print('xbrl_prepare_text: sections do not match those of the '
+                  'HTML reader')
+        return lambda: xbrl_document.XbrlDocument('bench', xbrl_text,
+                                                  'xbrl').prepare_text()
+
+    def xbrl_sections_match(self, xbrl_text):
+        """Do the streaming XBRL reader and the HTML reader extract the same
+        sections from an inline XBRL document?
+        """
+        documents = [xbrl_document.XbrlDocument('bench', xbrl_text, 'xbrl'),
+                     html_document.HtmlDocument('bench', xbrl_text, 'xbrl')]
+        sections = []
+        for document in documents:
+            document.prepare_text()
+            sections.append([document.extract_section(s['html'])[0]
+                             for s in self.search_terms])
+        return sections[0] == sections[1]
+
+    def should_remove_table(self, html_text):
+        from bs4 import BeautifulSoup
+        document = html_document.HtmlDocument('bench', html_text, 'html')
+        tables = BeautifulSoup(html_text, 'lxml').find_all('table')
+        return lambda: [document.should_remove_table(t) for t in tables]
+
+    def html_extract_section(self, html_text):
+        document = html_document.HtmlDocument('bench', html_text, 'html')
+        document.prepare_text()
+        search_pairs = [s['html'] for s in self.search_terms]
+        return lambda: [document.extract_section(p) for p in search_pairs]
+
+    def text_extract_section(self, text):
+        document = text_document.TextDocument('bench', text, 'txt')
+        search_pairs = [s['txt'] for s in self.search_terms]
+        return lambda: [document.extract_section(p) for p in search_pairs]
+
+    def remove_table_lines(self, text):
+        return lambda: text_document.remove_table_lines(text)
+
+    def sgml_split(self, filing_text):
+        document_groups = list(load_search_terms())
+        return lambda: list(download.split_filing(filing_text,
+                                                  document_groups))
+
+    def synthetic_inputs(self, size, seed=0):
+        """Inputs for each benchmark: synthetic document of the given size
+        """
+        html_text = synthetic.generate_document(self.form_type, 'html',
+                                                size, seed)
+        text = synthetic.generate_document(self.form_type, 'txt', size, seed)
+        filing_text = synthetic.submission(
+            [(self.form_type, html_text),
+             ('EX-99', synthetic.generate_document('8-K', 'txt', 20000,
+                                                   seed))],
+            cik=1, accession='0000000001-00-000001',
+            company_name='SYNTHETIC CO', period='20001231',
+            filing_date='20010301', form_type=self.form_type)
+        # the same document as inline XBRL, read by each reader
+        xbrl_text = synthetic.inline_xbrl(html_text, self.form_type)
+        return [('html_prepare_text', self.html_prepare_text, html_text),
+                ('xbrl_prepare_text', self.xbrl_prepare_text, xbrl_text),
+                ('html_prepare_ixbrl', self.html_prepare_text,
+                 xbrl_text),
+                ('should_remove_table', self.should_remove_table, html_text),
+                ('html_extract_section', self.html_extract_section,
+                 html_text),
+                ('text_extract_section', self.text_extract_section, text),
+                ('remove_table_lines', self.remove_table_lines, text),
+                # submissions are split as the bytes downloaded
+                ('sgml_split', self.sgml_split, filing_text.encode('utf-8'))]
+
+    def corpus_inputs(self, filing_bytes):
+        """Inputs for each benchmark: a real submission file, as bytes.
+        The first document of each group found is used.
+        """
+        inputs = [('sgml_split', self.sgml_split, filing_bytes)]
+        for document_group, document_type, extraction_method, doc_text in \
+                download.split_filing(filing_bytes,
+                                      list(load_search_terms())):
+            if extraction_method == 'xbrl':
+                inputs += [('xbrl_prepare_text', self.xbrl_prepare_text,
+                            doc_text),
+                           ('html_prepare_ixbrl', self.html_prepare_text,
+                            doc_text)]
+            elif extraction_method == 'txt':
+                inputs += [('text_extract_section',
+                            self.text_extract_section, doc_text),
+                           ('remove_table_lines', self.remove_table_lines,
+                            doc_text)]
+            else:
+                inputs += [('html_prepare_text', self.html_prepare_text,
+                            doc_text),
+                           ('should_remove_table', self.should_remove_table,
+                            doc_text),
+                           ('html_extract_section',
+                            self.html_extract_section, doc_text)]
+            break
+        return inputs
+
+
+    def listing_parse(self, page):
+        return lambda: edgar_pages.parse_listing_page(page, 100)
+
+    def listing_parse_soup(self, page):
+        return lambda: edgar_pages.parse_listing_page_soup(page, 100)
+
+    def index_parse(self, page):
+        return lambda: edgar_pages.parse_index_page(page)
+
+    def index_parse_soup(self, page):
+        return lambda: edgar_pages.parse_index_page_soup(page)
+
+    def page_inputs(self, file_name, page):
+        """Inputs for each benchmark: a saved listing page (browse-edgar
+        results, 100 per page) or filing index page (file name ending
+        -index.htm)
+        """
+        if file_name.endswith('-index.htm'):
+            inputs = [('index_parse', self.index_parse, page),
+                      ('index_parse_soup', self.index_parse_soup, page)]
+        else:
+            inputs = [('listing_parse', self.listing_parse, page),
+                      ('listing_parse_soup', self.listing_parse_soup, page)]
+        # the fast parser must give the same result as BeautifulSoup
+        if inputs[0][1](page)() != inputs[1][1](page)():
+            print('%s: %s does not match %s' % (file_name, inputs[0][0],
+                                                 inputs[1][0]))
+        return inputs
+
+
+def run(inputs, key, repeats, only, results):
+    """Time each benchmark in inputs, saving results[name][key]
+    """
+    for name, setup, data in inputs:
+        if only and name not in only:
+            continue
+        seconds = best_time(setup(data), repeats)
+        results.setdefault(name, {})[key] = seconds
+        print('%-22s %10s %12.4f %10.2f' %
+              (name, key, seconds, len(data) / 1e6 / seconds
+               if seconds else 0))
+        sys.stdout.flush()
+
+
+def compare(results, baseline, threshold):
+    """Timings which are slower than baseline by more than threshold
+
+    :return: list of (benchmark, size or file, seconds, baseline seconds)
+    """
+    regressions = []
+    for name, timings in sorted(results.items()):
+        for key, seconds in timings.items():
+            baseline_seconds = baseline.get(name, {}).get(key)
+            if baseline_seconds and \
+                    seconds > baseline_seconds * (1 + threshold):
+                regressions.append((name, key, seconds, baseline_seconds))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Micro-benchmarks of the extraction stages')
+    parser.add_argument('--sizes', default='100K,1M,10M',
+                        help='comma-separated synthetic document sizes, '
+                             'in characters (K/M suffixes allowed)')
+    parser.add_argument('--form_type', default='10-K',
+                        choices=sorted(synthetic.FORM_ITEMS))
+    parser.add_argument('--repeats', type=int, default=3,
+                        help='report the best of this many runs')
+    parser.add_argument('--only',
+                        help='comma-separated benchmark names to run')
+    parser.add_argument('--corpus',
+                        help='folder of submission .txt files, e.g. the '
+                             'slow_corpus folder')
+    parser.add_argument('--pages', default=FIXTURES_FOLDER,
+                        help='folder of saved EDGAR listing (.html) and '
+                             'filing index (-index.htm) pages (default: '
+                             'benchmarks/fixtures)')
+    parser.add_argument('--baseline', help='JSON file of baseline timings '
+                                           'to compare against')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='fractional slowdown against the baseline '
+                             'reported as a regression (default: 0.25)')
+    parser.add_argument('--save_baseline',
+                        help='save the timings as a JSON baseline file')
+    options = parser.parse_args()
+    only = options.only.split(',') if options.only else None
+
+    benchmarks = ExtractionBenchmarks(options.form_type)
+    results = {}
+    print('%-22s %10s %12s %10s' % ('benchmark', 'size', 'best s', 'MB/s'))
+    sizes = sorted(parse_size(s) for s in options.sizes.split(','))
+    for size in sizes:
+        run(benchmarks.synthetic_inputs(size), format_size(size),
+            options.repeats, only, results)
+    if options.corpus:
+        for file_name in sorted(os.listdir(options.corpus)):
+            if not file_name.endswith('.txt'):
+                continue
+            with open(os.path.join(options.corpus, file_name), 'rb') as f:
+                filing_bytes = f.read()
+            run(benchmarks.corpus_inputs(filing_bytes), file_name,
+                options.repeats, only, results)
+    if options.pages:
+        for file_name in sorted(os.listdir(options.pages)):
+            if not file_name.endswith(('.htm', '.html')):
+                continue
+            with open(os.path.join(options.pages, file_name),
+                      encoding='utf-8') as f:
+                page = f.read()
+            run(benchmarks.page_inputs(file_name, page), file_name,
+                max(options.repeats, PAGE_REPEATS), only, results)
+
+    print('\n%-22s %10s' % ('benchmark', 'exponent'))
+    for name, timings in results.items():
+        size_timings = [(parse_size(k), v) for k, v in timings.items()
+                        if k in [format_size(s) for s in sizes]]
+        exponent = complexity_exponent(*zip(*size_timings)) \
+            if len(size_timings) > 1 else None
+        if exponent is None:
+            continue
+        print('%-22s %10.2f %s' % (name, exponent,
+                                   'SUPERLINEAR'
+                                   if exponent > SUPERLINEAR_EXPONENT
+                                   else ''))
+
+    if options.save_baseline:
+        with open(options.save_baseline, 'w') as f:
+            json.dump({'python': platform.python_version(),
+                       'machine': platform.machine(),
+                       'form_type': options.form_type,
+                       'results': results}, f, indent=4)
+        print('\nSaved baseline: ' + options.save_baseline)
+    if options.baseline:
+        with open(options.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, options.threshold)
+        print('\n%i regression(s) against %s (threshold %i%%)' %
+              (len(regressions), options.baseline, options.threshold * 100))
+        for name, key, seconds, baseline_seconds in regressions:
+            print('%-22s %10s %12.4f  baseline %.4f' %
+                  (name, key, seconds, baseline_seconds))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""
+    secedgartext: extract text from SEC corporate filings
+    Copyright (C) 2017  Alexander Ions
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Benchmark of the worker pool scheduling (see src/scheduler.py) on a skewed
+distribution of filing sizes. Each task sleeps for a time proportional to
+its size, so the result does not depend on the number of CPUs on the
+machine. Companies' filings arrive one after another, as the crawler finds
+them, and each company has a few large filings among many small ones, the
+largest last. Run from the project folder:
+
+    python -m benchmarks.bench_schedule --processes 4 --companies 10
+
+The schedules compared are:
+
+    per_company  listing order, waiting for each company's filings to
+                 finish before starting the next (the previous behaviour)
+    fifo         listing order, on a pool kept for the whole run
+    lpt          largest filing first, within the look-ahead --window
+    lpt_lane     as lpt, with filings of --oversized_mb or more in a
+                 lane of their own, on one of the processes
+
+and the lower bound for the makespan is the larger of the total work
+divided by the number of processes and the largest single task.
+"""
+import argparse
+import multiprocessing as mp
+import random
+import time
+
+from src.scheduler import SizeAwareScheduler
+
+
+def process_filing(seconds):
+    time.sleep(seconds)
+
+
+def filing_sizes(n_companies, filings_per_company, seed=0):
+    """Filing sizes (MB) for each company: mostly small, with a long tail
+    (Pareto distribution), in ascending order so the largest come last
+
+    :return: list of lists of sizes
+    """
+    rng = random.Random(seed)
+    return [sorted(min(200.0, 0.5 * rng.paretovariate(1.2))
+                   for _ in range(filings_per_company))
+            for _ in range(n_companies)]
+
+
+def run_schedule(companies, processes, seconds_per_mb, arrival_seconds,
+                 window=1, oversized_mb=None, per_company=False):
+    """Process all the companies' filings on a pool
+
+    :return: makespan, in seconds
+    """
+    lane_pool = None
+    pool_processes = processes
+    if oversized_mb:
+        pool_processes = max(1, processes - 1)
+        lane_pool = mp.Pool(processes=1)
+    pool = mp.Pool(processes=pool_processes)
+    scheduler = SizeAwareScheduler(
+        pool, pool_processes, window,
+        oversized_bytes=oversized_mb and int(oversized_mb * 1024 * 1024),
+        oversized_pool=lane_pool)
+    start_time = time.perf_counter()
+    for sizes in companies:
+        for size in sizes:
+            # the crawler fetches each filing's index page before the
+            # filing can be scheduled
+            time.sleep(arrival_seconds)
+            scheduler.submit(int(size * 1024 * 1024), process_filing,
+                             args=(size * seconds_per_mb,))
+        if per_company:
+            scheduler.wait()
+    scheduler.wait()
+    makespan = time.perf_counter() - start_time
+    for p in [pool, lane_pool]:
+        if p:
+            p.close()
+            p.join()
+    return makespan
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark of size-aware scheduling on the worker pool')
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--companies', type=int, default=10)
+    parser.add_argument('--filings_per_company', type=int, default=12)
+    parser.add_argument('--seconds_per_mb', type=float, default=0.01,
+                        help='processing time of each MB of a filing')
+    parser.add_argument('--arrival_ms', type=float, default=5,
+                        help='time to find each filing (index page fetch)')
+    parser.add_argument('--window', type=int, default=100,
+                        help='look-ahead window')
+    parser.add_argument('--oversized_mb', type=float, default=50)
+    parser.add_argument('--seed', type=int, default=0)
+    options = parser.parse_args()
+
+    companies = filing_sizes(options.companies, options.filings_per_company,
+                             options.seed)
+    all_seconds = [size * options.seconds_per_mb
+                   for sizes in companies for size in sizes]
+    lower_bound = max(sum(all_seconds) / options.processes, max(all_seconds))
+    print('%i filings, %.0f MB in total, largest %.0f MB; lower bound %.2fs'
+          % (len(all_seconds), sum(map(sum, companies)),
+             max(map(max, companies)), lower_bound))
+    schedules = [
+        ('per_company', dict(window=1, per_company=True)),
+        ('fifo', dict(window=1)),
+        ('lpt', dict(window=options.window)),
+        ('lpt_lane', dict(window=options.window,
+                          oversized_mb=options.oversized_mb)),
+    ]
+    print('%-12s %10s %12s' % ('schedule', 'makespan s', 'vs bound'))
+    for name, settings in schedules:
+        makespan = run_schedule(companies, options.processes,
+                                options.seconds_per_mb,
+                                options.arrival_ms / 1000, **settings)
+        print('%-12s %10.2f %11.2fx' % (name, makespan,
+                                        makespan / lower_bound))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""
+    secedgartext: extract text from SEC corporate filings
+    Copyright (C) 2017  Alexander Ions
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+End-to-end throughput benchmark: run the whole crawler
+(Downloader.download_companies) against a local mock EDGAR server, once
+for each --multiprocessing_cores setting, and report filings/s, MB/s,
+CPU utilisation and peak RSS. Run from the project folder:
+
+    python -m benchmarks.crawl_benchmark --cores 0,2,4 --companies 20
+"""
+import argparse
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.mock_edgar import MockEdgar
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_crawler(edgar_url, companies_list, storage, cores, extra_args=()):
+    """Run the crawler in a separate process
+
+    :return: dict of wall-clock seconds, CPU seconds (including pool workers)
+    and peak RSS (MB, of the largest single process)
+    """
+    command = [sys.executable, PROJECT_DIR,
+               '--storage', storage,
+               '--companies_list', companies_list,
+               '--filings', '10-K',
+               '--start', '19940101', '--end', '99991231',
+               '--report_period', 'all',
+               '--multiprocessing_cores', str(cores),
+               '--edgar_url', edgar_url] + list(extra_args)
+    env = dict(os.environ, NO_PROXY='127.0.0.1,localhost')
+    start_time = time.perf_counter()
+    process = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL)
+    # wait4 gives the resource usage of this run alone: the crawler plus
+    # the pool workers it has waited for
+    pid, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    wall_time = time.perf_counter() - start_time
+    if process.returncode:
+        raise RuntimeError('Crawler failed, see log files in ' + storage)
+    cpu_time = usage.ru_utime + usage.ru_stime
+    # ru_maxrss is in KB on Linux, bytes on macOS
+    rss_divisor = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return {'wall_time': wall_time, 'cpu_time': cpu_time,
+            'peak_rss_mb': usage.ru_maxrss / rss_divisor}
+
+
+def count_filings(storage):
+    """Number of distinct filings recorded in the metadata database
+    """
+    connection = sqlite3.connect(os.path.join(storage, 'metadata.sqlite3'))
+    n_filings = connection.execute(
+        "SELECT count(DISTINCT sec_url) FROM metadata "
+        "WHERE sec_cik NOT LIKE 'dummy%'").fetchone()[0]
+    connection.close()
+    return n_filings
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='End-to-end crawler benchmark against a mock EDGAR server')
+    parser.add_argument('--cores', default='0,2',
+                        help='comma-separated --multiprocessing_cores settings')
+    parser.add_argument('--companies', type=int, default=10)
+    parser.add_argument('--filings_per_company', type=int, default=5)
+    parser.add_argument('--document_size', type=int, default=500000,
+                        help='characters per synthetic document')
+    parser.add_argument('--latency_ms', type=float, default=20)
+    parser.add_argument('--error_rate', type=float, default=0)
+    parser.add_argument('--fixtures', help='folder of submission .txt files')
+    parser.add_argument('--crawler_args', default='',
+                        help='extra crawler arguments, e.g. "--compression=gzip"')
+    options = parser.parse_args()
+
+    ciks = range(1, options.companies + 1)
+    print('%-6s %9s %9s %9s %9s %9s %11s' %
+          ('cores', 'filings', 'wall s', 'filings/s', 'MB/s', 'CPU %',
+           'peak RSS MB'))
+    for cores in [int(c) for c in options.cores.split(',')]:
+        mock = MockEdgar(ciks, options.filings_per_company,
+                         options.document_size, options.latency_ms,
+                         options.error_rate, options.fixtures)
+        edgar_url = mock.start()
+        with tempfile.TemporaryDirectory() as storage:
+            companies_list = os.path.join(storage, 'companies_list.txt')
+            with open(companies_list, 'w') as f:
+                f.writelines('%i COMPANY%i\n' % (c, c) for c in ciks)
+            result = run_crawler(edgar_url, companies_list, storage, cores,
+                                 options.crawler_args.split())
+            n_filings = count_filings(storage)
+        mock.stop()
+        wall_time = result['wall_time']
+        print('%-6i %9i %9.2f %9.2f %9.2f %9.1f %11.1f' % (
+            cores, n_filings, wall_time, n_filings / wall_time,
+            mock.submission_bytes_served / 1e6 / wall_time,
+            100 * result['cpu_time'] / wall_time, result['peak_rss_mb']))
+
+
+if __name__ == '__main__':
+    main()
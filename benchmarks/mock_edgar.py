@@ -0,0 +1,398 @@
+"""
+    secedgartext: extract text from SEC corporate filings
+    Copyright (C) 2017  Alexander Ions
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Local stand-in for the parts of the EDGAR website used by the crawler:
+browse-edgar company listing pages (with 'Next 100' pagination), filing
+-index.htm pages and full submission .txt files. Content is synthetic,
+generated deterministically from a seed, or read from a fixtures folder.
+
+Run from the project folder, then point the crawler at it with --edgar_url:
+
+    python -m benchmarks.mock_edgar --port 8000
+    python SEC-EDGAR-text --edgar_url=http://127.0.0.1:8000/ ...
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import re
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+from benchmarks import synthetic
+
+LISTING_PAGE = """<html><head><title>EDGAR Search Results</title></head>
+<body>
+<div id="contentDiv">
+<div class="companyInfo">
+<span class="companyName">{company_name} <acronym title="Central Index Key">CIK</acronym>#: <a href="/cgi-bin/browse-edgar?action=getcompany&amp;CIK={cik}&amp;owner=exclude&amp;count={count}">{cik} (see all company filings)</a></span>
+</div>
+<div id="seriesDiv">
+<table class="tableFile2" summary="Results">
+<tr><th scope="col">Filings</th><th scope="col">Format</th><th scope="col">Description</th><th scope="col">Filing Date</th><th scope="col">File/Film Number</th></tr>
+{rows}
+</table>
+</div>
+{next_button}
+</div>
+</body></html>
+"""
+
+LISTING_ROW = """<tr>
+<td nowrap="nowrap">{form_type}</td>
+<td nowrap="nowrap"><a href="{index_path}" id="documentsbutton">&nbsp;Documents</a>&nbsp; <a href="/cgi-bin/viewer?action=view&amp;cik={cik_int}&amp;accession_number={accession}&amp;xbrl_type=v" id="interactiveDataBtn">&nbsp;Interactive Data</a></td>
+<td class="small" >Annual report <br />Acc-no: {accession}&nbsp;(34 Act)&nbsp; Size: {size_mb} MB</td>
+<td>{filing_date_dashed}</td>
+<td nowrap="nowrap"><a href="/cgi-bin/browse-edgar?action=getcompany&amp;filenum=001-08207&amp;owner=exclude&amp;count={count}">001-08207</a><br>0000000000</td>
+</tr>"""
+
+NEXT_BUTTON = """<table border="0" width="100%"><tr><td>
+<input type="button" value="Next {count}" onClick="parent.location='/cgi-bin/browse-edgar?action=getcompany&amp;CIK={cik}&amp;type={form_type}&amp;dateb=&amp;owner=exclude&amp;start={start}&amp;count={count}'">
+</td></tr></table>"""
+
+INDEX_PAGE = """<html><head><title>EDGAR Filing Documents for {accession}</title></head>
+<body>
+<div id="PageTitle">Filing Detail</div>
+<div id="formDiv">
+<div id="formHeader">
+<div id="formName">
+<strong>Form {form_type}</strong> - Annual report [Section 13 and 15(d), not S-K Item 405]:
+</div>
+<div id="secNum">
+<strong><acronym title="Securities and Exchange Commission">SEC</acronym> Accession <acronym title="Number">No.</acronym></strong> {accession}
+</div>
+</div>
+<div class="formContent">
+<div class="formGrouping">
+<div class="infoHead">Filing Date</div>
+<div class="info">{filing_date_dashed}</div>
+<div class="infoHead">Accepted</div>
+<div class="info">{filing_date_dashed} 08:00:00</div>
+<div class="infoHead">Documents</div>
+<div class="info">{n_documents}</div>
+</div>
+<div class="formGrouping">
+<div class="infoHead">Period of Report</div>
+<div class="info">{period_dashed}</div>
+</div>
+</div>
+</div>
+<div id="formDiv">
+<div style="padding: 0px 0px 4px 0px; font-size: 12px; margin: 0px 2px 0px 5px; width: 100%; overflow:hidden">
+<p>Document Format Files</p>
+<table class="tableFile" summary="Document Format Files">
+<tr><th scope="col" style="width: 5%;"><acronym title="Sequence Number">Seq</acronym></th><th scope="col" style="width: 40%;">Description</th><th scope="col" style="width: 20%;">Document</th><th scope="col" style="width: 10%;">Type</th><th scope="col">Size</th></tr>
+<tr class="blueRow"><td scope="row">1</td><td scope="row">{form_type}</td><td scope="row"><a href="{document_path}">d1.htm</a></td><td scope="row">{form_type}</td><td scope="row">{document_size}</td></tr>
+<tr><td scope="row">&nbsp;</td><td scope="row">Complete submission text file</td><td scope="row"><a href="{submission_path}">{accession}.txt</a></td><td scope="row">&nbsp;</td><td scope="row">{submission_size}</td></tr>
+</table>
+</div>
+</div>
+<div id="filerDiv">
+<div class="mailer">Business Address<span class="mailerAddress">1 MAIN STREET</span></div>
+<div class="companyInfo">
+<span class="companyName">{company_name} (Filer)
+<acronym title="Central Index Key">CIK</acronym>: <a href="/cgi-bin/browse-edgar?action=getcompany&amp;CIK={cik}&amp;owner=exclude&amp;count=40">{cik} (see all company filings)</a></span>
+<p class="identInfo"><acronym title="Standard Industrial Code">SIC</acronym>: <b>5211</b></p>
+</div>
+</div>
+</body></html>
+"""
+
+
+def dashed_date(ccyymmdd):
+    return '-'.join([ccyymmdd[0:4], ccyymmdd[4:6], ccyymmdd[6:8]])
+
+
+class MockEdgar(object):
+    """Synthetic EDGAR data, and the server which publishes it.
+
+    :param ciks: list of CIK codes (ints or strings) of the companies
+    :param filings_per_company: number of filings listed for each company
+    :param document_size: approximate size (characters) of each main
+    document, or a (min, max) tuple for random sizes
+    :param latency_ms: delay before each response, or a (min, max) tuple
+    :param error_rate: fraction of requests answered with HTTP 503
+    :param fixtures_folder: optional folder of real submission .txt files.
+    These are served (in rotation) instead of synthetic submissions.
+    :param seed: random seed; the same seed always gives the same content
+    """
+
+    def __init__(self, ciks, filings_per_company=5, document_size=200000,
+                 latency_ms=0, error_rate=0.0, fixtures_folder=None,
+                 form_type='10-K', seed=0):
+        self.ciks = [str(int(c)).zfill(10) for c in ciks]
+        self.filings_per_company = filings_per_company
+        self.document_size = document_size
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+        self.form_type = form_type
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.fixtures = []
+        if fixtures_folder:
+            self.fixtures = sorted(os.path.join(fixtures_folder, f)
+                                   for f in os.listdir(fixtures_folder)
+                                   if f.endswith('.txt'))
+        self.filings = {}
+        for cik in self.ciks:
+            for i in range(filings_per_company):
+                accession = '%s-%02i-%06i' % (cik, (20 - i) % 100, i + 1)
+                year = 2020 - i
+                self.filings[accession] = {
+                    'cik': cik, 'accession': accession,
+                    'company_name': 'SYNTHETIC COMPANY %s INC' % cik[-4:],
+                    'period': '%i1231' % (year - 1),
+                    'filing_date': '%i0301' % year,
+                    'fixture': self.fixtures[len(self.filings) %
+                                             len(self.fixtures)]
+                    if self.fixtures else None}
+        self._submissions = {}
+        self._lock = threading.Lock()
+        self.n_requests = 0
+        self.n_errors = 0
+        self.bytes_served = 0
+        self.submission_bytes_served = 0
+        self.server = None
+
+    def _value(self, setting):
+        if isinstance(setting, tuple):
+            return self.rng.uniform(*setting)
+        return setting
+
+    def index_path(self, filing):
+        return '/Archives/edgar/data/%i/%s/%s-index.htm' % (
+            int(filing['cik']), filing['accession'].replace('-', ''),
+            filing['accession'])
+
+    def submission_path(self, filing):
+        return '/Archives/edgar/data/%i/%s/%s.txt' % (
+            int(filing['cik']), filing['accession'].replace('-', ''),
+            filing['accession'])
+
+    def submission_text(self, accession):
+        """Full submission text of a filing, generated on first request
+        """
+        with self._lock:
+            if accession not in self._submissions:
+                filing = self.filings[accession]
+                if filing['fixture']:
+                    with open(filing['fixture'], encoding='utf-8',
+                              errors='replace') as f:
+                        text = f.read()
+                else:
+                    seed = int(accession.replace('-', '')) + self.seed
+                    size = int(random.Random(seed).uniform(
+                        *self.document_size)) \
+                        if isinstance(self.document_size, tuple) \
+                        else self.document_size
+                    document = synthetic.html_10k(size, seed)
+                    text = synthetic.submission(
+                        [(self.form_type, document)], filing['cik'],
+                        accession, filing['company_name'], filing['period'],
+                        filing['filing_date'], self.form_type)
+                self._submissions[accession] = text.encode('utf-8')
+            return self._submissions[accession]
+
+    def listing_page(self, cik, start, count):
+        cik = str(int(cik)).zfill(10) if cik.isdigit() else cik
+        company_filings = [f for f in self.filings.values()
+                           if f['cik'] == cik]
+        rows = []
+        for filing in company_filings[start:start + count]:
+            rows.append(LISTING_ROW.format(
+                form_type=self.form_type, index_path=self.index_path(filing),
+                cik_int=int(filing['cik']), accession=filing['accession'],
+                size_mb=1, count=count,
+                filing_date_dashed=dashed_date(filing['filing_date'])))
+        next_button = ''
+        if start + count < len(company_filings):
+            next_button = NEXT_BUTTON.format(count=count, cik=cik,
+                                             form_type=self.form_type,
+                                             start=start + count)
+        company_name = company_filings[0]['company_name'] \
+            if company_filings else 'UNKNOWN'
+        return LISTING_PAGE.format(company_name=company_name, cik=cik,
+                                   count=count, rows='\n'.join(rows),
+                                   next_button=next_button)
+
+    def index_page(self, accession):
+        filing = self.filings[accession]
+        submission_size = len(self.submission_text(accession))
+        return INDEX_PAGE.format(
+            accession=accession, form_type=self.form_type,
+            filing_date_dashed=dashed_date(filing['filing_date']),
+            period_dashed=dashed_date(filing['period']), n_documents=1,
+            document_path=self.submission_path(filing).replace('.txt',
+                                                               '/d1.htm'),
+            document_size=submission_size,
+            submission_path=self.submission_path(filing),
+            submission_size=submission_size,
+            company_name=filing['company_name'], cik=filing['cik'])
+
+    def master_index(self, date=None):
+        """master.idx file of all the filings, or (daily-index) of the
+        filings of date, ccyymmdd
+        """
+        lines = ['Description:           Master Index of EDGAR '
+                 'Dissemination Feed', '', 'CIK|Company Name|Form Type|'
+                 'Date Filed|Filename', '-' * 80]
+        for filing in self.filings.values():
+            if date and filing['filing_date'] != date:
+                continue
+            lines.append('%i|%s|%s|%s|%s' % (
+                int(filing['cik']), filing['company_name'], self.form_type,
+                filing['filing_date'] if date
+                else dashed_date(filing['filing_date']),
+                self.submission_path(filing).replace(
+                    '/Archives/', '').replace(
+                    filing['accession'].replace('-', '') + '/', '')))
+        return '\n'.join(lines) + '\n'
+
+    def form_index(self):
+        """form.idx file of all the filings"""
+        lines = ['Description:           Form Index of EDGAR '
+                 'Dissemination Feed', '',
+                 '%-12s%-62s%-12s%-12s%s' % ('Form Type', 'Company Name',
+                                             'CIK', 'Date Filed',
+                                             'File Name'), '-' * 120]
+        for filing in self.filings.values():
+            lines.append('%-12s%-62s%-12i%-12s%s' % (
+                self.form_type, filing['company_name'], int(filing['cik']),
+                dashed_date(filing['filing_date']),
+                'edgar/data/%i/%s.txt' % (int(filing['cik']),
+                                          filing['accession'])))
+        return '\n'.join(lines) + '\n'
+
+    def company_tickers(self):
+        """company_tickers.json: ticker SYNn for the company with CIK n"""
+        companies = {}
+        for cik in self.ciks:
+            filing = next(f for f in self.filings.values() if f['cik'] == cik)
+            companies[str(len(companies))] = {
+                'cik_str': int(cik), 'ticker': 'SYN%i' % int(cik),
+                'title': filing['company_name']}
+        return json.dumps(companies)
+
+    def respond(self, path):
+        """Response for a request path
+
+        :return: (HTTP status, content type, body bytes)
+        """
+        # the crawler joins the base URL and root-relative links, which can
+        # give a path starting with '//'
+        url = urlparse('/' + path.lstrip('/'))
+        if url.path.endswith('/cgi-bin/browse-edgar'):
+            query = parse_qs(url.query)
+            page = self.listing_page(query.get('CIK', [''])[0],
+                                     int(query.get('start', ['0'])[0]),
+                                     int(query.get('count', ['100'])[0]))
+            return 200, 'text/html', page.encode('utf-8')
+        if url.path.endswith('/files/company_tickers.json'):
+            return 200, 'application/json', \
+                self.company_tickers().encode('utf-8')
+        srch = re.search(r'/daily-index/.*/master\.(\d{8})\.idx$', url.path)
+        if srch:
+            if datetime.datetime.strptime(srch.group(1),
+                                          '%Y%m%d').weekday() >= 5:
+                return 404, 'text/html', b'<html>Not Found</html>'
+            return 200, 'text/plain', \
+                self.master_index(srch.group(1)).encode('latin-1')
+        srch = re.search(r'/full-index/.*/(master|form)\.idx$', url.path)
+        if srch:
+            index = self.master_index() if srch.group(1) == 'master' \
+                else self.form_index()
+            return 200, 'text/plain', index.encode('latin-1')
+        srch = re.search(r'/(\d{10}-\d{2}-\d{6})(-index\.htm|\.txt)$',
+                         url.path)
+        if srch and srch.group(1) in self.filings:
+            if srch.group(2) == '.txt':
+                body = self.submission_text(srch.group(1))
+                with self._lock:
+                    self.submission_bytes_served += len(body)
+                return 200, 'text/plain', body
+            return 200, 'text/html', \
+                self.index_page(srch.group(1)).encode('utf-8')
+        return 404, 'text/html', b'<html><body>Not Found</body></html>'
+
+    def start(self, host='127.0.0.1', port=0):
+        """Start serving on a background thread
+
+        :return: base URL of the server, e.g. http://127.0.0.1:54321/
+        """
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                latency = mock._value(mock.latency_ms)
+                if latency:
+                    time.sleep(latency / 1000)
+                with mock._lock:
+                    mock.n_requests += 1
+                    is_error = mock.rng.random() < mock.error_rate
+                    if is_error:
+                        mock.n_errors += 1
+                if is_error:
+                    status, content_type, body = \
+                        503, 'text/html', b'<html>Service Unavailable</html>'
+                else:
+                    status, content_type, body = mock.respond(self.path)
+                with mock._lock:
+                    mock.bytes_served += len(body)
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        thread = threading.Thread(target=self.server.serve_forever,
+                                  daemon=True)
+        thread.start()
+        return 'http://%s:%i/' % self.server.server_address[:2]
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local mock EDGAR server')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--companies', type=int, default=10,
+                        help='number of synthetic companies (CIK 1, 2, ...)')
+    parser.add_argument('--filings_per_company', type=int, default=5)
+    parser.add_argument('--document_size', type=int, default=200000,
+                        help='characters per synthetic document')
+    parser.add_argument('--latency_ms', type=float, default=0)
+    parser.add_argument('--error_rate', type=float, default=0)
+    parser.add_argument('--fixtures', help='folder of submission .txt files')
+    parser.add_argument('--seed', type=int, default=0)
+    options = parser.parse_args()
+    mock = MockEdgar(range(1, options.companies + 1),
+                     options.filings_per_company, options.document_size,
+                     options.latency_ms, options.error_rate,
+                     options.fixtures, seed=options.seed)
+    url = mock.start(port=options.port)
+    print('Mock EDGAR server running at %s (Ctrl-C to stop)' % url)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        mock.stop()
+
+
+if __name__ == '__main__':
+    main()
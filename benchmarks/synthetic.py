@@ -0,0 +1,290 @@
+"""
+    secedgartext: extract text from SEC corporate filings
+    Copyright (C) 2017  Alexander Ions
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import random
+import re
+
+WORDS = ('company revenue customers market risk operations products '
+         'services results financial period growth increase decrease '
+         'competition regulation management business costs stores sales '
+         'interest rates supply chain employees net income fiscal year '
+         'we our the of and to in for may could would significant').split()
+
+FORM_10K_ITEMS = [('PART I', 'Item 1. Business'),
+                  ('', 'Item 1A. Risk Factors'),
+                  ('', 'Item 1B. Unresolved Staff Comments'),
+                  ('', 'Item 2. Properties'),
+                  ('', 'Item 3. Legal Proceedings'),
+                  ('PART II', "Item 7. Management's Discussion and Analysis "
+                              "of Financial Condition and Results of "
+                              "Operations"),
+                  ('', 'Item 7A. Quantitative and Qualitative Disclosures '
+                       'About Market Risk'),
+                  ('', 'Item 8. Financial Statements and Supplementary '
+                       'Data'),
+                  ('', 'Item 9. Changes in and Disagreements with '
+                       'Accountants')]
+
+
+def sentence(rng, n_words=None):
+    words = [rng.choice(WORDS) for _ in range(n_words or rng.randint(8, 25))]
+    return ' '.join(words).capitalize() + '.'
+
+
+def paragraph(rng, n_sentences=None):
+    return ' '.join(sentence(rng)
+                    for _ in range(n_sentences or rng.randint(3, 8)))
+
+
+def html_numeric_table(rng, n_rows=8, n_columns=4):
+    rows = []
+    for r in range(n_rows):
+        cells = ['<td>%s</td>' % rng.choice(WORDS).title()] + \
+                ['<td align="right">$ %s</td>' %
+                 format(rng.randint(100, 999999), ',')
+                 for _ in range(n_columns - 1)]
+        rows.append('<tr>' + ''.join(cells) + '</tr>')
+    return '<table>' + '\n'.join(rows) + '</table>'
+
+
+FORM_10Q_ITEMS = [('PART I', 'Item 1. Financial Statements'),
+                  ('', "Item 2. Management's Discussion and Analysis of "
+                       "Financial Condition and Results of Operations"),
+                  ('', 'Item 3. Quantitative and Qualitative Disclosures '
+                       'About Market Risk'),
+                  ('', 'Item 4. Controls and Procedures'),
+                  ('PART II', 'Item 1. Legal Proceedings'),
+                  ('', 'Item 1A. Risk Factors'),
+                  ('', 'Item 2. Unregistered Sales of Equity Securities '
+                       'and Use of Proceeds'),
+                  ('', 'Item 6. Exhibits')]
+
+FORM_8K_ITEMS = [('', 'Item 2.02 Results of Operations and Financial '
+                      'Condition'),
+                 ('', 'Item 7.01 Regulation FD Disclosure'),
+                 ('', 'Item 9.01 Financial Statements and Exhibits')]
+
+FORM_ITEMS = {'10-K': FORM_10K_ITEMS, '10-Q': FORM_10Q_ITEMS,
+              '8-K': FORM_8K_ITEMS}
+
+# number of distinct blocks of each kind generated for a document. Larger
+# documents repeat blocks from this pool, so that even 200 MB documents
+# are generated in a few seconds
+POOL_SIZE = 200
+
+
+def html_text_table(rng, n_rows=4):
+    """Table of long text cells, which should survive table removal
+    """
+    rows = ['<tr><td>%s</td><td>%s</td></tr>' % (sentence(rng),
+                                                   paragraph(rng, 2))
+            for _ in range(n_rows)]
+    return '<table>' + '\n'.join(rows) + '</table>'
+
+
+def html_nested_table(rng, n_rows=6):
+    """Layout table, with <p> blocks and a further table nested in <td>
+    """
+    rows = []
+    for r in range(n_rows):
+        if r == n_rows // 2:
+            cell = html_numeric_table(rng, 3, 3)
+        else:
+            cell = '<p>%s</p><p>%s</p>' % (sentence(rng), sentence(rng))
+        rows.append('<tr><td valign="top">%i.</td><td>%s</td></tr>' %
+                    (r + 1, cell))
+    return '<table>' + '\n'.join(rows) + '</table>'
+
+
+def html_styled_div(rng):
+    return ('<div style="margin-top:%ipt; margin-bottom:0pt; '
+            'text-indent:4%%"><font style="font-family:Times New Roman" '
+            'size="2">%s</font></div>' % (rng.choice([0, 6, 12]),
+                                          paragraph(rng)))
+
+
+def text_paragraph(rng, width=72):
+    """Paragraph of plain text, wrapped at width characters
+    """
+    lines = []
+    line = ''
+    for word in paragraph(rng).split():
+        if len(line) + len(word) >= width:
+            lines.append(line)
+            line = ''
+        line = (line + ' ' + word) if line else word
+    lines.append(line)
+    return '\n'.join(lines) + '\n'
+
+
+def text_table(rng, n_rows=8, n_columns=4):
+    """Plain-text numeric table: columns separated by 3 or more spaces,
+    '====' gridlines and (as in many older filings) <TABLE> tags
+    """
+    gridline = '    ' + '=' * 20 + ('   ' + '=' * 12) * (n_columns - 1)
+    lines = ['<TABLE>', '<CAPTION>',
+             '%-24s' % '' + ''.join('%15s' % (2000 + c)
+                                    for c in range(n_columns - 1)),
+             gridline]
+    for r in range(n_rows):
+        lines.append('    %-20s' % rng.choice(WORDS).title() +
+                     ''.join('%15s' % format(rng.randint(100, 999999), ',')
+                             for _ in range(n_columns - 1)))
+    lines += [gridline, '</TABLE>']
+    return '\n'.join(lines) + '\n'
+
+
+def html_blocks(rng):
+    """Pool of HTML blocks and the relative frequency of each kind
+    """
+    kinds = [(0.55, lambda: '<p>%s</p>' % paragraph(rng)),
+             (0.2, lambda: html_styled_div(rng)),
+             (0.1, lambda: html_numeric_table(rng)),
+             (0.1, lambda: html_nested_table(rng)),
+             (0.05, lambda: html_text_table(rng))]
+    return [(weight, [make() for _ in range(POOL_SIZE)])
+            for weight, make in kinds]
+
+
+def text_blocks(rng):
+    kinds = [(0.85, lambda: text_paragraph(rng)),
+             (0.15, lambda: text_table(rng))]
+    return [(weight, [make() for _ in range(POOL_SIZE)])
+            for weight, make in kinds]
+
+
+def generate_document(form_type='10-K', document_format='html',
+                      target_size=200000, seed=0):
+    """Synthetic 10-K, 10-Q or 8-K document of roughly target_size characters
+
+    Each item of the form gets a heading (matching the patterns in
+    document_group_section_search.json) followed by blocks of text and
+    tables, in equal shares of target_size.
+    :param form_type: '10-K', '10-Q' or '8-K'
+    :param document_format: 'html' (paragraphs, styled divs, numeric, text
+    and nested tables) or 'txt' (wrapped text, column tables with gridlines)
+    :param target_size: approximate document size, in characters
+    :param seed: random seed; the same arguments always give the same
+    document
+    :return: document text
+    """
+    rng = random.Random(seed)
+    if document_format == 'html':
+        pool = html_blocks(rng)
+        parts = ['<html><head><title>%s</title></head><body>' % form_type]
+    else:
+        pool = text_blocks(rng)
+        parts = []
+    weights = [weight for weight, blocks in pool]
+    items = FORM_ITEMS[form_type]
+    item_size = max(1, target_size // len(items))
+    for part, heading in items:
+        if document_format == 'html':
+            if part:
+                parts.append('<p align="center"><b>%s</b></p>' % part)
+            parts.append('<p><b>%s</b></p>' % heading)
+        else:
+            if part:
+                parts.append('\n%s%s\n' % (' ' * 30, part))
+            parts.append('\n%s\n' % heading.upper())
+        size = 0
+        while size < item_size:
+            blocks = rng.choices(pool, weights)[0][1]
+            block = rng.choice(blocks)
+            parts.append(block)
+            size += len(block) + 1
+    if document_format == 'html':
+        parts.append('</body></html>')
+    return '\n'.join(parts)
+
+
+def html_10k(target_size=200000, seed=0):
+    """Synthetic HTML 10-K document of roughly target_size characters
+    """
+    return generate_document('10-K', 'html', target_size, seed)
+
+
+IXBRL_HEADER = '\n'.join([
+    '<div style="display:none"><ix:header><ix:hidden>',
+    '<ix:nonNumeric name="dei:DocumentType" contextRef="FY">%s'
+    '</ix:nonNumeric>',
+    '</ix:hidden><ix:resources>',
+    '<xbrli:context id="FY"><xbrli:entity><xbrli:identifier '
+    'scheme="http://www.sec.gov/CIK">0000000001</xbrli:identifier>'
+    '</xbrli:entity><xbrli:period><xbrli:startDate>2000-01-01'
+    '</xbrli:startDate><xbrli:endDate>2000-12-31</xbrli:endDate>'
+    '</xbrli:period></xbrli:context>',
+    '</ix:resources></ix:header></div>'])
+
+
+def inline_xbrl(html_text, form_type='10-K', text_block_every=10):
+    """Inline XBRL version of a synthetic HTML document, as found in the
+    <XBRL> block of a submission: XHTML with a hidden ix:header, and every
+    text_block_every'th paragraph tagged as an ix:nonNumeric text block
+
+    :param html_text: document from generate_document(..., 'html', ...)
+    :return: document text, including the <XBRL> tags
+    """
+    from lxml import etree, html
+    body = html.document_fromstring(html_text).find('body')
+    xhtml = etree.tostring(body, method='xml', encoding='unicode')
+    xhtml = xhtml[len('<body>'):-len('</body>')]
+    count = [0]
+
+    def tag_text_block(match):
+        count[0] += 1
+        if count[0] % text_block_every:
+            return match.group()
+        return ('<ix:nonNumeric name="us-gaap:Note%iTextBlock" '
+                'contextRef="FY" escape="true">%s</ix:nonNumeric>'
+                % (count[0], match.group()))
+    xhtml = re.sub(r'<p>.*?</p>', tag_text_block, xhtml, flags=re.DOTALL)
+    return '\n'.join([
+        '<XBRL>', '<?xml version="1.0" encoding="utf-8"?>',
+        '<html xmlns="http://www.w3.org/1999/xhtml" '
+        'xmlns:ix="http://www.xbrl.org/2013/inlineXBRL" '
+        'xmlns:xbrli="http://www.xbrl.org/2003/instance" '
+        'xmlns:us-gaap="http://fasb.org/us-gaap/2020" '
+        'xmlns:dei="http://xbrl.sec.gov/dei/2020">',
+        '<head><title>%s</title></head><body>' % form_type,
+        IXBRL_HEADER % form_type, xhtml, '</body></html>', '</XBRL>'])
+
+
+def submission(documents, cik, accession, company_name, period,
+               filing_date, form_type='10-K'):
+    """Full EDGAR submission text file (SGML) containing documents
+
+    :param documents: list of (document type, document text) tuples.
+    HTML documents are placed inside <TEXT> as they are
+    :return: submission text
+    """
+    header = '\n'.join([
+        '<SEC-DOCUMENT>%s.txt : %s' % (accession, filing_date),
+        '<SEC-HEADER>%s.hdr.sgml : %s' % (accession, filing_date),
+        '<ACCEPTANCE-DATETIME>%s080000' % filing_date,
+        'ACCESSION NUMBER:\t\t%s' % accession,
+        'CONFORMED SUBMISSION TYPE:\t%s' % form_type,
+        'PUBLIC DOCUMENT COUNT:\t\t%i' % len(documents),
+        'CONFORMED PERIOD OF REPORT:\t%s' % period,
+        'FILED AS OF DATE:\t\t%s' % filing_date,
+        'DATE AS OF CHANGE:\t\t%s' % filing_date,
+        '',
+        'FILER:',
+        '',
+        '\tCOMPANY DATA:',
+        '\t\tCOMPANY CONFORMED NAME:\t\t\t%s' % company_name,
+        '\t\tCENTRAL INDEX KEY:\t\t\t%s' % cik,
+        '</SEC-HEADER>'])
+    parts = [header]
+    for sequence, (document_type, text) in enumerate(documents, 1):
+        parts.append('\n'.join([
+            '<DOCUMENT>', '<TYPE>%s' % document_type,
+            '<SEQUENCE>%i' % sequence,
+            '<FILENAME>d%i.htm' % sequence,
+            '<TEXT>', text, '</TEXT>', '</DOCUMENT>']))
+    parts.append('</SEC-DOCUMENT>\n')
+    return '\n'.join(parts)
@@ -0,0 +1,137 @@
+"""
+    secedgartext: extract text from SEC corporate filings
+    Copyright (C) 2017  Alexander Ions
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+In-memory extraction of sections from filings that the caller already has,
+with no downloads and no files or database rows written. For example:
+
+    from src.api import extract_sections
+    for section in extract_sections([submission_text], '10-K'):
+        print(section['section_name'], section['excerpt'])
+"""
+import multiprocessing as mp
+import re
+from functools import partial
+
+from .config import load_search_terms
+from .decoding import decode_bytes
+from .download import READER_CLASSES, split_filing
+from .timing import start_filing_timings, stop_filing_timings
+
+
+def to_text(document):
+    """Document as str: bytes are decoded by decoding.decode_bytes()
+    """
+    return decode_bytes(document)
+
+
+def document_format(doc_text):
+    """Extraction method for a single document: 'xbrl', 'html' or 'txt'
+    """
+    if re.search(r'<xbrl>', doc_text[:10000], re.IGNORECASE):
+        return 'xbrl'
+    if re.search(r'<html', doc_text[:10000], re.IGNORECASE):
+        return 'html'
+    return 'txt'
+
+
+def split_documents(document, form_type=None):
+    """The documents to extract from document, a full submission or a
+    single document, as str or bytes. Only the documents extracted from a
+    submission are decoded.
+
+    :return: list of (document_group, document_type, extraction_method,
+    doc_text) tuples
+    """
+    marker = b'<DOCUMENT>' if isinstance(document, bytes) else '<DOCUMENT>'
+    if re.search(marker, document[:100000], re.IGNORECASE):
+        search_terms = load_search_terms()
+        document_groups = [form_type] if form_type else list(search_terms)
+        return list(split_filing(document, document_groups))
+    if not form_type:
+        raise ValueError('form_type is required for a document which is not '
+                         'a full EDGAR submission')
+    text = to_text(document)
+    return [(form_type, form_type, document_format(text), text)]
+
+
+def extract_document(document, form_type=None, document_index=0):
+    """Extract the sections from one submission or document
+
+    :return: list of section results, see extract_sections()
+    """
+    results = []
+    for document_group, document_type, extraction_method, doc_text in \
+            split_documents(document, form_type):
+        timings = start_filing_timings()
+        try:
+            reader = READER_CLASSES[extraction_method](
+                None, doc_text, extraction_method)
+            sections = list(reader.extract_sections(document_group))
+        finally:
+            stop_filing_timings()
+        for section in sections:
+            section.update({'document_index': document_index,
+                            'document_group': document_group,
+                            'document_type': document_type,
+                            'extraction_method': extraction_method,
+                            'timings': timings})
+            results.append(section)
+    return results
+
+
+def _extract_indexed_document(indexed_document, form_type):
+    document_index, document = indexed_document
+    return extract_document(document, form_type, document_index)
+
+
+def extract_sections(documents, form_type=None):
+    """Extract the sections of each of documents, in memory.
+
+    :param documents: iterable of texts (str or bytes). Each is either a
+    full EDGAR submission, from which the <DOCUMENT>s of each document
+    group (e.g. 10-K, EX-13) are extracted, or a single HTML or plain text
+    document of type form_type
+    :param form_type: document group to extract, e.g. '10-K'. Required for
+    single documents; for submissions, the default is all the groups in
+    document_group_section_search.json
+    :return: iterator of dicts, one for each section of each document found,
+    with document_index (position in documents), document_group,
+    document_type, extraction_method, section_name, excerpt (None if the
+    section was not found), endpoints, warnings, extraction_summary,
+    time_elapsed (CPU seconds) and timings (the document's stage timings:
+    list of dicts with stage, wall_time, cpu_time and n_bytes)
+    """
+    for document_index, document in enumerate(documents):
+        for section in extract_document(document, form_type, document_index):
+            yield section
+
+
+def extract_sections_batch(documents, form_type=None, processes=None,
+                           chunksize=1, pool=None):
+    """Like extract_sections(), spreading the documents across a pool of
+    worker processes. Results are returned in the order of documents.
+
+    :param processes: number of worker processes (default: the number of
+    CPUs). Ignored if pool is given
+    :param chunksize: number of documents sent to a worker at a time
+    :param pool: an existing multiprocessing Pool to use, which is left open
+    """
+    extract = partial(_extract_indexed_document, form_type=form_type)
+    own_pool = pool is None
+    if own_pool:
+        pool = mp.Pool(processes)
+    try:
+        for sections in pool.imap(extract, enumerate(documents), chunksize):
+            for section in sections:
+                yield section
+    except BaseException:
+        if own_pool:
+            pool.terminate()
+        raise
+    if own_pool:
+        pool.close()
+        pool.join()
@@ -0,0 +1,144 @@
+"""
+    secedgartext: extract text from SEC corporate filings
+    Copyright (C) 2017  Alexander Ions
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import gzip
+import os
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.util import Finalize
+
+from .runtime import get_runtime
+
+COMPRESSION_EXTENSIONS = {'none': '', 'gzip': '.gz', 'zstd': '.zst'}
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+# one background writer per process (threads do not survive a fork)
+_writers = {}
+
+
+def compress_bytes(data, compression=None, level=None):
+    """Compress data with the chosen compression method ('none', 'gzip'
+    or 'zstd'); defaults to the --compression command line settings
+    """
+    config = get_runtime().config
+    compression = compression or config.compression
+    level = level if level is not None else config.compression_level
+    if compression == 'gzip':
+        return gzip.compress(data, compresslevel=9 if level is None else level)
+    elif compression == 'zstd':
+        import zstandard
+        return zstandard.ZstdCompressor(level=3 if level is None else level).\
+            compress(data)
+    return data
+
+
+def decompress_bytes(data):
+    """Decompress gzip or zstd data, identified by its magic number.
+
+    Uncompressed data is returned unchanged. Concatenated gzip members and
+    zstd frames are decompressed in full.
+    """
+    if data[:2] == GZIP_MAGIC:
+        return gzip.decompress(data)
+    elif data[:4] == ZSTD_MAGIC:
+        import io
+        import zstandard
+        reader = zstandard.ZstdDecompressor().stream_reader(
+            io.BytesIO(data), read_across_frames=True)
+        return reader.read()
+    return data
+
+
+def compressed_path(file_path):
+    """Add the file extension for the current compression method
+    """
+    return file_path + \
+        COMPRESSION_EXTENSIONS[get_runtime().config.compression]
+
+
+def read_text(file_path):
+    """Read a text file written by this program, compressed or not.
+
+    :param file_path: path of the file. If it does not exist, the same path
+    with a compression extension (.gz, .zst) is tried
+    :return: the decoded UTF-8 text
+    """
+    if not os.path.exists(file_path):
+        for extension in ['.gz', '.zst']:
+            if os.path.exists(file_path + extension):
+                file_path = file_path + extension
+                break
+    with open(file_path, 'rb') as f:
+        return decompress_bytes(f.read()).decode('utf-8')
+
+
+class BackgroundWriter(object):
+    """Compress and write files on a background thread.
+
+    Extraction carries on while earlier output is compressed and written:
+    zlib and zstd release the GIL while they work, so the two overlap.
+    Call wait() before relying on the files being on disk, or record them
+    with when_written().
+    """
+
+    def __init__(self, compression='none', level=None):
+        self.compression = compression
+        self.level = level
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.pending = []
+        # calls deferred by when_written() until the queued files are written
+        self.pending_calls = []
+
+    def write_text(self, file_path, text):
+        """Queue text to be written (UTF-8, '\\n' line endings) to file_path
+        """
+        self.pending.append(self.executor.submit(self._write, file_path,
+                                                 text))
+
+    def _write(self, file_path, text):
+        data = compress_bytes(text.encode('utf-8'), self.compression,
+                              self.level)
+        with open(file_path, 'wb') as f:
+            f.write(data)
+
+    def when_written(self, function, *args):
+        """Run function(*args), which records files queued by write_text(),
+        once they are on disk: at once if nothing is queued, otherwise
+        (in the calling thread) when wait() has seen them written. If a
+        write fails, the calls deferred with it are dropped.
+        """
+        if self.pending:
+            self.pending_calls.append((function, args))
+        else:
+            function(*args)
+
+    def wait(self):
+        """Block until all queued files are written; re-raise any error
+        """
+        pending, self.pending = self.pending, []
+        calls, self.pending_calls = self.pending_calls, []
+        for future in pending:
+            future.result()
+        for function, args in calls:
+            function(*args)
+
+    def close(self):
+        self.wait()
+        self.executor.shutdown()
+
+
+def get_background_writer():
+    """Return the background writer for the current process
+    """
+    pid = os.getpid()
+    if pid not in _writers:
+        config = get_runtime().config
+        writer = BackgroundWriter(config.compression,
+                                  config.compression_level)
+        Finalize(writer, writer.close, exitpriority=10)
+        _writers[pid] = writer
+    return _writers[pid]
@@ -0,0 +1,330 @@
+"""
+    secedgartext: extract text from SEC corporate filings
+    Copyright (C) 2017  Alexander Ions
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import argparse
+import datetime
+import json
+import logging
+import multiprocessing as mp
+import re
+from functools import lru_cache
+from os import path
+
+project_dir = path.dirname(path.dirname(path.abspath(__file__)))
+
+# the first filings in EDGAR
+EDGAR_START = '19930101'
+
+
+def build_parser():
+    """Parser for the command line arguments
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--storage', help='Specify path to storage location')
+    parser.add_argument('--write_sql', default=True, help='Save metadata to sqlite database? (Boolean)')
+    parser.add_argument('--company', help='CIK code specifying company for single-company download')
+    parser.add_argument('--companies_list', help='path of text file with all company CIK codes to download')
+    parser.add_argument('--filings', help='comma-separated list of SEC filings of interest (10-Q,10-K...)')
+    parser.add_argument('--documents')
+    parser.add_argument('--start', help='document start date passed to EDGAR web interface')
+    parser.add_argument('--end', help='document end date passed to EDGAR web interface')
+    parser.add_argument('--report_period', help='search pattern for company report dates, e.g. 2012, 201206 etc.')
+    parser.add_argument('--batch_signature')
+    parser.add_argument('--start_company', help='index number of first company to download from the companies_list file')
+    parser.add_argument('--end_company', help='index number of last company to download from the companies_list file')
+    parser.add_argument('--traffic_limit_pause_ms', help='time to pause between download attempts, to avoid overloading EDGAR server')
+    parser.add_argument('--multiprocessing_cores', help='number of processor cores to use')
+    parser.add_argument('--edgar_url', help='base URL of the EDGAR website (default: https://www.sec.gov/), e.g. a local mock server for testing')
+    parser.add_argument('--output_format', help='files (default): separate excerpt and metadata files for each section; jsonl or parquet: append sections to rolling shard files')
+    parser.add_argument('--shard_size', help='number of sections stored in each shard file (default: 10000)')
+    parser.add_argument('--storage_levels', help='number of levels of hashed sub-directories for output files in each batch (default: 2)')
+    parser.add_argument('--metrics_file', help='path of a Prometheus textfile to rewrite with per-stage timing metrics (default: none)')
+    parser.add_argument('--metrics_interval', help='seconds between rewrites of the metrics file (default: 15)')
+    parser.add_argument('--profile', action='store_true', help='profile the processing of each filing with cProfile, saving .prof files in the profiles folder')
+    parser.add_argument('--profile_sample', help='fraction of filings to profile in --profile mode (default: 1, i.e. all)')
+    parser.add_argument('--slow_filing_seconds', help='save the source and timings of any filing taking longer than this (wall-clock seconds) in the slow_corpus folder (default: 60 in --profile mode, otherwise off)')
+    parser.add_argument('--compression', help='compress excerpts and saved documents: none (default), gzip or zstd')
+    parser.add_argument('--compression_level', help='compression level (default: 9 for gzip, 3 for zstd)')
+    parser.add_argument('--resume', nargs='?', const='latest', metavar='BATCH', help='continue a batch instead of starting a new one: the given batch number, or by default the latest batch started on this machine. Filings already completed (in any batch) are skipped before downloading, and only failed filings and sections not yet saved are retried')
+    parser.add_argument('--work_queue', help='name of a work queue shared with other nodes, in the metadata database of the (shared) storage location: each node takes companies from the queue until it is empty')
+    parser.add_argument('--lease_seconds', help='work queue lease time: a company is handed to another node if its node stops renewing the lease for this long (default: 600)')
+    parser.add_argument('--feed', help='find new filings in the EDGAR index files, instead of searching EDGAR for each company: "daily" for the daily-index files since the last run, or the URL or path of a master.idx or form.idx file')
+    parser.add_argument('--tickers_file', help='path or URL of SEC\'s company_tickers.json, used to resolve tickers and company names in the companies list to CIK codes (default: company_tickers.json in the storage folder, downloaded from EDGAR if missing)')
+    parser.add_argument('--transport', help='with --multiprocessing_cores: worker (default), each worker downloads its own filings; shm, the main process downloads the submissions and hands them to the workers in shared memory')
+    parser.add_argument('--schedule_window', help='with --multiprocessing_cores: number of filings held waiting for a free worker, which is given the largest of them first (default: 100, or 2 per core with --transport shm; 1 sends filings in listing order)')
+    parser.add_argument('--oversized_mb', help='with --multiprocessing_cores: process submissions of at least this many MB (as given on the index page) in a lane of their own, one at a time, on one of the cores (default: no separate lane)')
+    parser.add_argument('--memory_budget_mb', help='with --multiprocessing_cores: memory shared by the filings in progress, each estimated from its documents\' sizes; a filing is held until its estimate fits (default: 75%% of the available memory, less the workers\' own; 0 for no limit)')
+    parser.add_argument('--task_timeout', help='with --multiprocessing_cores: wall-clock seconds after which a filing still in progress is abandoned, and its worker replaced (default: 1800; 0 for no limit)')
+    parser.add_argument('--max_tasks_per_child', help='with --multiprocessing_cores: number of filings after which a worker is replaced by a new one (default: no limit)')
+    parser.add_argument('--max_worker_rss_mb', help='with --multiprocessing_cores: resident memory (MB) over which a worker is replaced by a new one, after its filing (default: no limit)')
+    parser.add_argument('--dedup', action='store_true', help='skip documents whose text (or prepared plaintext) has been processed before, in any batch: their sections are saved as duplicates, pointing to the original excerpts, without parsing the document again')
+    parser.add_argument('--fulltext_index', action='store_true', help='at the end of the batch, add its sections to the full-text (SQLite FTS5) index in the metadata database, searched with: python -m src.fulltext search')
+    return parser
+
+
+@lru_cache(maxsize=None)
+def load_search_terms(file_path=None):
+    """Load the patterns that we use for identifying sections in each of
+    the EDGAR document types, converted to regular expressions
+
+    :param file_path: JSON file of search terms (default:
+    document_group_section_search.json in the project folder)
+    :return: dict: for each document type, a list of sections, each with
+    an 'itemname' and lists of 'txt' and 'html' start/end regex pairs.
+    Cached: do not modify it.
+    """
+    file_path = file_path or path.join(project_dir,
+                                       'document_group_section_search.json')
+    with open(file_path, 'r') as f:
+        search_terms = json.loads(f.read())
+    if not search_terms:
+        logging.getLogger('text_analysis').error(
+            'Search terms file is missing or corrupted: ' + file_path)
+    for filing in search_terms:
+        for section in search_terms[filing]:
+            for format in ['txt', 'html']:
+                for pattern in section[format]:
+                    for startend in ['start', 'end']:
+                        regex_string = pattern[startend]
+                        regex_string = regex_string.replace('_', '\\s{,5}')
+                        regex_string = regex_string.replace('\n', '\\n')
+                        pattern[startend] = regex_string
+    return search_terms
+
+
+def search_window_days(filings):
+    if '10-K' in filings:
+        return 365
+    else:
+        return 91
+
+
+def default_start(filings):
+    """Default start date for the filings search, ccyymmdd
+    """
+    return (datetime.datetime.now() -
+            datetime.timedelta(days=search_window_days(filings))).\
+        strftime('%Y%m%d')
+
+
+def default_end(start, filings):
+    """Default end date for the filings search, ccyymmdd
+    """
+    return (datetime.datetime.strptime(str(start), '%Y%m%d') +
+            datetime.timedelta(days=search_window_days(filings))).\
+        strftime('%Y%m%d')
+
+
+class Config(object):
+    """Settings for a batch run.
+
+    Options have the same names and meanings as the command line arguments;
+    any not given take their command line defaults. Creating a Config has
+    no side effects (no prompts, files or database), and it only holds
+    plain values, so it can be pickled for pool workers.
+    """
+
+    def __init__(self, **options):
+        values = vars(build_parser().parse_args([]))
+        unknown = set(options) - set(values)
+        if unknown:
+            raise TypeError('Unknown options: ' + ', '.join(sorted(unknown)))
+        values.update(options)
+        self.__dict__.update(values)
+        self.normalise()
+
+    @classmethod
+    def from_command_line(cls, argv=None):
+        """Config from the command line arguments (default: sys.argv),
+        prompting for any filings search settings that are not given.
+        Exits with a usage message if an argument is invalid.
+        """
+        parser = build_parser()
+        options = parser.parse_args(argv)
+        # feed mode is unattended: it does not prompt for search settings
+        if not options.feed:
+            options.filings = options.filings or \
+                input('Enter filings search text '
+                      '(default: 10-K,10-Q): ') or '10-K,10-Q'
+            filings = re.split(',', options.filings)
+            ccyymmdd_default_start = default_start(filings)
+            options.start = options.start or \
+                input('Enter start date for filings search (default: ' +
+                      ccyymmdd_default_start + '): ') or \
+                ccyymmdd_default_start
+            ccyymmdd_default_end = default_end(options.start, filings)
+            options.end = options.end or \
+                input('Enter end date for filings search (default: ' +
+                      ccyymmdd_default_end + '): ') or \
+                ccyymmdd_default_end
+            options.report_period = options.report_period or \
+                input('Enter filing report period ccyy, ccyymm etc. '
+                      '(default: all periods): ') or 'all'
+        try:
+            return cls(**vars(options))
+        except ValueError as e:
+            parser.error(str(e))
+
+    def normalise(self):
+        """Fill in defaults and convert the (string) option values, as
+        given on the command line, to their working types
+
+        :raises ValueError: for an invalid option value
+        """
+        if self.storage:
+            if not path.isabs(self.storage):
+                self.storage = path.join(project_dir, self.storage)
+        else:
+            self.storage = path.join(project_dir, 'output_files_examples')
+
+        self.write_sql = self.write_sql or True
+        self.edgar_url = self.edgar_url or 'https://www.sec.gov/'
+        if not self.edgar_url.endswith('/'):
+            self.edgar_url = self.edgar_url + '/'
+        self.single_company = ''
+        self.companies_file_location = ''
+        if self.company:
+            self.single_company = self.company
+        elif self.companies_list:
+            self.companies_file_location = path.join(project_dir,
+                                                     self.companies_list)
+        else:
+            self.companies_file_location = path.join(project_dir,
+                                                     'companies_list.txt')
+
+        self.filings = self.filings or '10-K,10-Q'
+        if isinstance(self.filings, str):
+            self.filings = re.split(',', self.filings)   # ['10-K','10-Q']
+        if self.feed:
+            # a daily feed with no watermark yet starts with today's
+            # filings, while an index file is read in full; by default,
+            # everything up to today is read
+            today = datetime.date.today().strftime('%Y%m%d')
+            self.start = self.start or \
+                (today if self.feed == 'daily' else EDGAR_START)
+            self.end = self.end or today
+        self.start = int(self.start or default_start(self.filings))
+        self.end = int(self.end or default_end(self.start, self.filings))
+        if self.report_period is None or \
+                str(self.report_period).lower() == 'all':
+            self.date_search_string = '.*'
+        else:
+            self.date_search_string = str(self.report_period)
+
+        # identify which 'document' types are to be downloaded. If none
+        # given, then default to all of the document types listed in the
+        # JSON file
+        self.documents = self.documents or \
+            ','.join(list(load_search_terms().keys()))
+        if isinstance(self.documents, str):
+            self.documents = re.split(',', self.documents)  # ['10-K','10-Q']
+
+        # default pause after HTTP request: zero milliseconds
+        self.traffic_limit_pause_ms = int(self.traffic_limit_pause_ms or 0)
+        if self.multiprocessing_cores:
+            self.multiprocessing_cores = min(mp.cpu_count() - 1,
+                                             int(self.multiprocessing_cores))
+        else:
+            self.multiprocessing_cores = 0
+
+        self.output_format = (self.output_format or 'files').lower()
+        if self.output_format not in ['files', 'jsonl', 'parquet']:
+            raise ValueError('Unknown output format: %s' % self.output_format)
+        if self.output_format == 'parquet':
+            try:
+                import pyarrow
+            except ImportError:
+                raise ValueError('pyarrow must be installed for parquet '
+                                 'output')
+        self.transport = (self.transport or 'worker').lower()
+        if self.transport not in ['worker', 'shm']:
+            raise ValueError('Unknown transport: %s' % self.transport)
+        # a waiting filing is only its metadata, except with the shm
+        # transport, where its whole submission is held in shared memory
+        self.schedule_window = int(
+            self.schedule_window or
+            (2 * max(1, self.multiprocessing_cores)
+             if self.transport == 'shm' else 100))
+        if self.schedule_window < 1:
+            raise ValueError('--schedule_window must be at least 1')
+        if self.memory_budget_mb is not None:
+            self.memory_budget_mb = float(self.memory_budget_mb)
+            if self.memory_budget_mb < 0:
+                raise ValueError('--memory_budget_mb cannot be negative')
+        self.task_timeout = float(1800 if self.task_timeout is None
+                                  else self.task_timeout) or None
+        if self.max_tasks_per_child:
+            self.max_tasks_per_child = int(self.max_tasks_per_child)
+        if self.max_worker_rss_mb:
+            self.max_worker_rss_mb = float(self.max_worker_rss_mb)
+        for option in ['task_timeout', 'max_tasks_per_child',
+                       'max_worker_rss_mb']:
+            if (getattr(self, option) or 0) < 0:
+                raise ValueError('--%s cannot be negative' % option)
+        if self.oversized_mb:
+            self.oversized_mb = float(self.oversized_mb)
+            if self.oversized_mb <= 0:
+                raise ValueError('--oversized_mb must be positive')
+        self.shard_size = int(self.shard_size or 10000)
+        self.storage_levels = int(self.storage_levels or 2)
+
+        if self.metrics_file and not path.isabs(self.metrics_file):
+            self.metrics_file = path.join(self.storage, self.metrics_file)
+        self.metrics_interval = int(self.metrics_interval or 15)
+
+        self.profile_sample = float(self.profile_sample or 1)
+        if self.slow_filing_seconds:
+            self.slow_filing_seconds = float(self.slow_filing_seconds)
+        elif self.profile:
+            self.slow_filing_seconds = 60.0
+
+        self.compression = (self.compression or 'none').lower()
+        if self.compression not in ['none', 'gzip', 'zstd']:
+            raise ValueError('Unknown compression method: %s' %
+                             self.compression)
+        if self.compression == 'zstd':
+            try:
+                import zstandard
+            except ImportError:
+                raise ValueError('zstandard must be installed for zstd '
+                                 'compression')
+        if self.compression_level is not None:
+            self.compression_level = int(self.compression_level)
+
+        # --resume: 'latest' (this machine's latest batch) or a batch number
+        if self.resume is True or self.resume == 'latest':
+            self.resume = 'latest'
+        elif self.resume:
+            try:
+                self.resume = int(self.resume)
+            except ValueError:
+                raise ValueError('--resume takes a batch number: %s' %
+                                 self.resume)
+            if self.resume < 1:
+                raise ValueError('--resume takes a batch number: %s' %
+                                 self.resume)
+        else:
+            self.resume = False
+        if self.resume and not self.write_sql:
+            raise ValueError('--resume requires the metadata database')
+
+        self.lease_seconds = float(self.lease_seconds or 600)
+        if self.work_queue and not self.write_sql:
+            raise ValueError('--work_queue requires the metadata database '
+                             '(--write_sql)')
+        if self.dedup and not self.write_sql:
+            raise ValueError('--dedup requires the metadata database '
+                             '(--write_sql)')
+        if self.fulltext_index and not self.write_sql:
+            raise ValueError('--fulltext_index requires the metadata '
+                             'database (--write_sql)')
+        if self.feed and self.work_queue:
+            raise ValueError('--feed cannot be combined with --work_queue')
+
+    @property
+    def search_terms(self):
+        return load_search_terms()
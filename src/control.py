@@ -5,19 +5,27 @@
     You should have received a copy of the GNU General Public License
     along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
-import re
 import os
+import re
+import time
 
+from .compression import get_background_writer
 from .download import EdgarCrawler
-from .utils import logger, args
-from .utils import companies_file_location, single_company, date_search_string
-from .utils import batch_number, storage_toplevel_directory
-
-MAX_FILES_IN_SUBDIRECTORY = 1000
+from .feed import Feed
+from .fulltext import index_sections
+from .shards import get_shard_writer
+from .ticker_index import validate_companies
+from .timing import timed_stage
+from .utils import logger
+from .work_queue import WorkQueue
 
 class Downloader(object):
-    def __init__(self):
-        self.storage_path = args.storage
+    def __init__(self, runtime):
+        """
+        :param runtime: the started Runtime of the batch run
+        """
+        self.runtime = runtime
+        self.storage_path = runtime.config.storage
 
     def download_companies (self, do_save_full_document=False):
         """Iterate through a list of companies and download documents.
@@ -27,10 +35,13 @@ class Downloader(object):
         document
         :return:
         """
+        config = self.runtime.config
+        single_company = config.single_company
+        companies_file_location = config.companies_file_location
         companies = list()
         if single_company:
             companies.append([str(single_company), str(single_company)])
-            logger.info("Downloading single company: %s", args.company)
+            logger.info("Downloading single company: %s", config.company)
         if not companies:
             try:
                 companies = company_list(companies_file_location)
@@ -45,27 +56,30 @@ class Downloader(object):
                 else:
                     # default company: Dow Chemical
                     company_default = 'DOW'
-                    companies.append([company_default, company_default.title()])
+                    companies.append([company_default,
+                                      company_default.title()])
                     logger.info("Downloading default company: %s",
                                 next(iter(companies)))
-        start_date =  args.start    # TODO:this may be ignored by EDGAR web interface, consider removing this argument
-        end_date = args.end
-        filings = args.filings
+        # resolve any tickers and names to CIK codes before crawling
+        companies = validate_companies(companies)
+        start_date =  config.start    # TODO:this may be ignored by EDGAR web interface, consider removing this argument
+        end_date = config.end
+        filings = config.filings
 
         logger.info('-' * 65)
         logger.info("Downloading %i companies: %s", len(companies),
                     single_company or companies_file_location)
-        logger.info("Filings period: %i - %i", args.start, args.end)
+        logger.info("Filings period: %i - %i", config.start, config.end)
         logger.info("Filings search: %s", filings)
         logger.info("Storage location: %s", self.storage_path)
         logger.info('-' * 65)
 
-        start_company = max(1, int(args.start_company or 1))
+        start_company = max(1, int(config.start_company or 1))
         end_company = min(len(companies),
-                          int(args.end_company or len(companies)))
+                          int(config.end_company or len(companies)))
 
         download_companies = companies[start_company-1:end_company]
-        seccrawler = EdgarCrawler()
+        seccrawler = EdgarCrawler(self.runtime)
 
 
         if do_save_full_document:
@@ -75,36 +89,172 @@ class Downloader(object):
             logger.info("Saving extracts (if successful) only. "
                         "Not saving source documents locally.")
         logger.info("SEC filing date range: %i to %i", start_date, end_date)
-        storage_subdirectory_number = 1
-
-        for c, company_keys in enumerate(download_companies):
-            edgar_search_string = str(company_keys[0])
-            company_description = str(company_keys[1]).strip()
-            company_description = re.sub('/','', company_description)
-
-            logger.info('Batch number: ' + str(batch_number) +
-                        ', begin downloading company: ' +
-                        str(c + 1) + ' / ' +
-                        str(len(download_companies)))
-            storage_subdirectory = os.path.join(storage_toplevel_directory,
-                                               format(storage_subdirectory_number,
-                                                      '03d'))
-            if not os.path.exists(storage_subdirectory):
-                os.makedirs(storage_subdirectory)
-            seccrawler.storage_folder = storage_subdirectory
-            for filing_search_string in args.filings:
-                seccrawler.download_filings(company_description,
-                                            edgar_search_string,
-                                            filing_search_string,
-                                            date_search_string,
-                                            str(start_date),
-                                            str(end_date), do_save_full_document)
-            if len(os.listdir(storage_subdirectory)) > MAX_FILES_IN_SUBDIRECTORY:
-                storage_subdirectory_number += 1
-        logger.warning("SUCCESS: Finished attempted download of " +
-                       str(len(download_companies) or 0) +
-                       " companies from an overall list of " +
-                       str(len(companies) or 0) + " companies." )
+
+        try:
+            if config.feed:
+                n_filings = self.download_feed(seccrawler, download_companies,
+                                               do_save_full_document)
+                logger.warning("SUCCESS: Finished attempted download of %i "
+                               "new filings from feed %s", n_filings,
+                               config.feed)
+            elif config.work_queue:
+                n_units = self.download_from_queue(seccrawler,
+                                                   download_companies,
+                                                   do_save_full_document)
+                logger.warning("SUCCESS: Finished %i work units from queue "
+                               "%s", n_units, config.work_queue)
+            else:
+                for c, company_keys in enumerate(download_companies):
+                    logger.info('Batch number: ' +
+                                str(self.runtime.batch_number) +
+                                ', begin downloading company: ' +
+                                str(c + 1) + ' / ' +
+                                str(len(download_companies)))
+                    for filing_search_string in config.filings:
+                        # the next company's filings can start while this
+                        # company's last ones are still in progress
+                        self.download_company(seccrawler, company_keys,
+                                              filing_search_string,
+                                              do_save_full_document,
+                                              wait=False)
+                seccrawler.wait()
+                logger.warning("SUCCESS: Finished attempted download of " +
+                               str(len(download_companies) or 0) +
+                               " companies from an overall list of " +
+                               str(len(companies) or 0) + " companies." )
+        finally:
+            seccrawler.close()
+        if config.fulltext_index:
+            update_fulltext_index(self.runtime)
+        log_stage_timings_summary(self.runtime)
+
+    def download_company(self, seccrawler, company_keys, filing_search_string,
+                         do_save_full_document, wait=True):
+        """Download one type of filing for one company
+
+        :param company_keys: [EDGAR search string (CIK or ticker),
+        company description]
+        :param wait: wait until the company's filings have been processed
+        """
+        config = self.runtime.config
+        edgar_search_string = str(company_keys[0])
+        company_description = str(company_keys[1]).strip()
+        company_description = re.sub('/','', company_description)
+        seccrawler.download_filings(company_description,
+                                    edgar_search_string,
+                                    filing_search_string,
+                                    config.date_search_string,
+                                    str(config.start),
+                                    str(config.end), do_save_full_document,
+                                    wait=wait)
+
+    def download_feed(self, seccrawler, companies, do_save_full_document):
+        """Download the companies' new filings listed in the EDGAR index
+        feed, then move the feed's watermark on
+
+        :return: number of new filings found
+        """
+        config = self.runtime.config
+        feed = Feed(self.runtime, config.feed)
+        filings_links = feed.filings(companies, config.filings)
+        processed_urls = seccrawler.download_index_links(
+            filings_links, config.date_search_string, do_save_full_document)
+        # a filing is only complete once its sections are on disk: stop the
+        # pool, so that its workers write out their shards (and record the
+        # sections) as they exit, then write out this process's shard
+        seccrawler.close()
+        if config.output_format == 'parquet':
+            get_shard_writer().close()
+        feed.commit(processed_urls)
+        return len(filings_links)
+
+    def download_from_queue(self, seccrawler, companies,
+                            do_save_full_document):
+        """Download companies taken from the shared work queue, until no
+        node has any work left.
+
+        Each work unit is one company and filing type. Every node adds all
+        of its companies (units already queued are ignored), then leases
+        units one at a time, so nodes can be added or removed at any time.
+        :return: number of work units completed by this node
+        """
+        config = self.runtime.config
+        node_id = '%s:%i:%i' % (self.runtime.batch_machine_id, os.getpid(),
+                                self.runtime.batch_number)
+        queue = WorkQueue(self.runtime.db_location, config.work_queue,
+                          node_id, config.lease_seconds,
+                          batch_number=self.runtime.batch_number)
+        n_added = queue.add(
+            ('%s:%s' % (company_keys[0], filing_search_string),
+             {'company_keys': company_keys,
+              'filing_search_string': filing_search_string})
+            for company_keys in companies
+            for filing_search_string in config.filings)
+        logger.info('Work queue %s: added %i work units, node %s',
+                    config.work_queue, n_added, node_id)
+        n_completed = 0
+        while True:
+            unit = queue.lease()
+            if unit is None:
+                if not queue.counts().get('leased'):
+                    break
+                # other nodes are still working: wait, in case one of them
+                # stops and its units are handed out again
+                time.sleep(min(30.0, config.lease_seconds / 3))
+                continue
+            logger.info('Batch number: %i, work unit %s (attempt %i)',
+                        self.runtime.batch_number, unit['unit_key'],
+                        unit['attempts'])
+            with queue.keep_alive(unit):
+                try:
+                    self.download_company(
+                        seccrawler, unit['payload']['company_keys'],
+                        unit['payload']['filing_search_string'],
+                        do_save_full_document)
+                except Exception as e:
+                    logger.exception('Work unit %s failed', unit['unit_key'])
+                    queue.fail(unit, repr(e))
+                    continue
+            if queue.complete(unit):
+                n_completed += 1
+        logger.info('Work queue %s: %s', config.work_queue,
+                    ', '.join('%s %i' % (status, n) for status, n in
+                              sorted(queue.counts().items())))
+        queue.close()
+        return n_completed
+
+
+def update_fulltext_index(runtime):
+    """Add the sections saved by the batch to the full-text index
+    """
+    # without a worker pool, excerpts saved by this process may still be
+    # queued or buffered
+    get_background_writer().wait()
+    if runtime.config.output_format == 'parquet':
+        get_shard_writer().close()
+    with timed_stage('fulltext_index'):
+        n_indexed, n_missing = index_sections(runtime.sql_connection,
+                                              runtime.batch_number)
+    logger.info('Full-text index: added %i sections of batch %i', n_indexed,
+                runtime.batch_number)
+    if n_missing:
+        logger.warning('Full-text index: %i excerpts could not be read',
+                       n_missing)
+
+
+def log_stage_timings_summary(runtime):
+    """Log the batch's per-stage timing percentiles and throughput
+    """
+    # make sure the timings from all the workers have been collected
+    runtime.flush_log_queue()
+    runtime.metrics_handler.flush()
+    logger.info('Stage timings (wall-clock seconds) for batch %i:',
+                runtime.batch_number)
+    for line in runtime.metrics_handler.summary():
+        logger.info(line)
+    dedup_summary = runtime.metrics_handler.dedup_summary()
+    if dedup_summary:
+        logger.info(dedup_summary)
 
 
 def company_list(text_file_location):
@@ -121,7 +271,9 @@ def company_list(text_file_location):
             if r[0] != '#' and len(r) > 1:
                 r = re.sub('\n', '', r)
                 text_items = re.split('[ ,\t]', r)  # various delimiters allowed
-                edgar_search_text = text_items[0].zfill(10)
+                edgar_search_text = text_items[0]
+                if edgar_search_text.isdigit():
+                    edgar_search_text = edgar_search_text.zfill(10)
                 company_description = '_'.join(
                     text_items[1:2])
                 company_list.append([edgar_search_text, company_description])
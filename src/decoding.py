@@ -0,0 +1,93 @@
+"""
+    secedgartext: extract text from SEC corporate filings
+    Copyright (C) 2017  Alexander Ions
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Decoding of downloaded bytes to text, by a fixed sequence of rules instead
+of requests' charset detection (which runs chardet over the whole body
+when the server does not declare a charset):
+
+1. the charset declared in the HTTP Content-Type header
+2. the charset declared in the text itself: an HTML <meta> tag or an XML
+   declaration near its start
+3. UTF-8, if the bytes are valid UTF-8
+4. Windows-1252, or Latin-1 for the few bytes which that leaves undefined
+
+Each of these is a single pass (at most) over the bytes, and the result
+does not depend on guesswork. Submissions are kept as bytes, and only the
+documents which are extracted are decoded, see download.split_filing().
+"""
+import codecs
+import re
+
+# how far into a document to look for a declared charset
+CHARSET_SEARCH_BYTES = 4096
+
+CHARSET_DECLARATION = re.compile(
+    rb'<meta[^>]+charset\s*=\s*["\']?\s*([\w.:-]+)'
+    rb'|<\?xml[^>]+encoding\s*=\s*["\']([\w.:-]+)', re.IGNORECASE)
+
+
+def charset_name(charset):
+    """Python codec name for a charset label, or None if there is no such
+    codec
+    """
+    if isinstance(charset, bytes):
+        charset = charset.decode('ascii', 'ignore')
+    try:
+        return codecs.lookup(charset.strip()).name if charset else None
+    except LookupError:
+        return None
+
+
+def response_charset(response):
+    """Charset declared in the Content-Type header of a requests response,
+    or None
+    """
+    content_type = response.headers.get('content-type', '')
+    srch = re.search(r'charset\s*=\s*["\']?([\w.:-]+)', content_type,
+                     re.IGNORECASE)
+    return charset_name(srch.group(1)) if srch else None
+
+
+def declared_charset(data):
+    """Charset declared by an HTML <meta> tag or XML declaration near the
+    start of data (bytes), or None
+    """
+    srch = CHARSET_DECLARATION.search(data[:CHARSET_SEARCH_BYTES])
+    if not srch:
+        return None
+    return charset_name(srch.group(1) or srch.group(2))
+
+
+def decode_bytes(data, charset=None):
+    """Decode data to str, see the rules above
+
+    :param data: bytes (a str is returned as it is)
+    :param charset: charset declared for data by the server, if any
+    """
+    if isinstance(data, str):
+        return data
+    for encoding in (charset, declared_charset(data)):
+        if encoding:
+            try:
+                return data.decode(encoding)
+            except UnicodeDecodeError:
+                # the declaration is wrong: carry on with the next rule
+                pass
+    try:
+        return data.decode('utf-8')
+    except UnicodeDecodeError:
+        pass
+    try:
+        return data.decode('cp1252')
+    except UnicodeDecodeError:
+        return data.decode('latin-1')
+
+
+def response_text(response):
+    """Text of a requests response, decoded by decode_bytes()
+    """
+    return decode_bytes(response.content, response_charset(response))
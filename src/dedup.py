@@ -0,0 +1,142 @@
+"""
+    secedgartext: extract text from SEC corporate filings
+    Copyright (C) 2017  Alexander Ions
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Content-hash deduplication (--dedup). The same document text is often
+found more than once: amendments re-filing unchanged items, exhibits
+copied between filings, and filings found again by batches with
+overlapping dates. The result of each section extracted from a document is
+recorded in the content_hashes table, keyed by a hash of the document's
+text and, for documents whose text is prepared before the sections are
+searched (HTML and XBRL), a hash of the prepared plaintext.
+
+A document whose text has been seen before is not parsed again, and one
+whose plaintext has been seen before is not searched again: each of its
+sections is saved as a duplicate, with the endpoints of the original and
+an output file pointing to the original's excerpt.
+"""
+import hashlib
+import os
+import time
+
+from .runtime import get_runtime
+from .utils import logger
+
+# the text matched by a content hash
+DOCUMENT = 'document'
+PLAINTEXT = 'plaintext'
+
+RESULT_FIELDS = ('section_name', 'status', 'sec_accession_number',
+                 'output_file', 'section_n_characters', 'start_line',
+                 'end_line')
+
+
+def content_hash(text):
+    """Hash of a document's text (or prepared plaintext)
+    """
+    return hashlib.blake2b(text.encode('utf-8', 'surrogatepass'),
+                           digest_size=16).hexdigest()
+
+
+def find_results(text_hash, document_group, section_names=None):
+    """Results recorded for the sections of a text, in any batch
+
+    A successful result whose excerpt file is no longer there is ignored,
+    so the section is extracted again.
+    :param text_hash: content_hash() of the document or plaintext
+    :param document_group: e.g. '10-K'
+    :param section_names: only these sections (default: all)
+    :return: dict of section name -> dict of RESULT_FIELDS
+    """
+    runtime = get_runtime()
+    if not (text_hash and runtime.config.write_sql):
+        return {}
+    rows = runtime.sql_connection.execute("""
+        SELECT section_name, status, sec_accession_number, output_file,
+        section_n_characters, start_line, end_line FROM content_hashes
+        WHERE content_hash = ? AND document_group = ?""",
+                                          (text_hash, document_group))
+    results = {}
+    for row in rows:
+        result = dict(zip(RESULT_FIELDS, row))
+        if section_names is not None and \
+                result['section_name'] not in section_names:
+            continue
+        if result['status'] == 'success' and \
+                not (result['output_file'] and
+                     os.path.exists(result['output_file'])):
+            continue
+        results[result['section_name']] = result
+    return results
+
+
+def record_results(text_hash, document_group, results):
+    """Record the results of sections under a hash of a document. The
+    first result recorded for a text is kept: later copies point to the
+    same original.
+
+    :param results: dict of section name -> dict of RESULT_FIELDS
+    """
+    runtime = get_runtime()
+    if not (text_hash and results and runtime.config.write_sql):
+        return
+    connection = runtime.sql_connection
+    connection.executemany("""
+        INSERT OR IGNORE INTO content_hashes (content_hash, document_group,
+        section_name, status, sec_accession_number, output_file,
+        section_n_characters, start_line, end_line, batch_number,
+        recorded_time) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                           [(text_hash, document_group) +
+                            tuple(result[field] for field in RESULT_FIELDS) +
+                            (runtime.batch_number, time.time())
+                            for result in results.values()])
+    connection.commit()
+
+
+def section_result(metadata, status):
+    """Result of a section extracted from a document, to be recorded
+
+    :param metadata: Metadata of the section, as saved
+    :param status: 'success' or 'not_found'
+    :return: dict of RESULT_FIELDS
+    """
+    endpoints = metadata.endpoints or ['', '']
+    return {'section_name': metadata.section_name, 'status': status,
+            'sec_accession_number': metadata.sec_accession_number,
+            'output_file': metadata.output_file,
+            'section_n_characters': metadata.section_n_characters,
+            'start_line': endpoints[0], 'end_line': endpoints[1]}
+
+
+def duplicate_metadata(metadata_master, result, level):
+    """Metadata of a section saved as a duplicate of a recorded result
+
+    :param metadata_master: Metadata of the document
+    :param result: dict of RESULT_FIELDS, from find_results()
+    :param level: DOCUMENT or PLAINTEXT, the text which was matched
+    """
+    return metadata_master.derive(
+        section_name=result['section_name'],
+        endpoints=[result['start_line'] or '', result['end_line'] or ''],
+        warnings=['Duplicate of %s (same %s)' %
+                  (result['sec_accession_number'], level)],
+        section_n_characters=result['section_n_characters'],
+        output_file=result['output_file'], time_elapsed=0.0)
+
+
+def log_document_dedup(document_group, level, n_sections):
+    """Log the outcome of deduplicating a document, as a record with
+    structured fields, which the MetricsHandler counts for the batch
+
+    :param level: DOCUMENT or PLAINTEXT if sections were found as
+    duplicates of that text, otherwise None
+    :param n_sections: number of sections saved as duplicates
+    """
+    logger.debug('%s document: %s', document_group,
+                 '%i sections duplicate (same %s)' % (n_sections, level)
+                 if level else 'new',
+                 extra={'dedup': level or 'new',
+                        'dedup_sections': n_sections})
@@ -7,13 +7,30 @@
 """
 import time
 from datetime import datetime
-import copy
 import os
 from abc import ABCMeta
 import multiprocessing as mp
 
-from .utils import search_terms as master_search_terms
-from .utils import args, logger
+from .config import load_search_terms
+from .runtime import get_runtime
+from .utils import logger
+from .shards import get_shard_writer
+from .compression import compressed_path, get_background_writer
+from .timing import timed_stage
+from .ledger import completed_sections, record_completion
+from .dedup import DOCUMENT, PLAINTEXT, content_hash, duplicate_metadata, \
+    find_results, log_document_dedup, record_results, section_result
+
+def record_section(metadata, form_type, found):
+    """Record a saved section in the metadata table and completion ledger
+    """
+    if get_runtime().config.write_sql:
+        metadata.save_to_db()
+    record_completion(metadata.sec_accession_number, form_type,
+                      metadata.section_name,
+                      'success' if found else 'not_found',
+                      metadata.output_file)
+
 
 class Document(object):
     __metaclass__ = ABCMeta
@@ -22,7 +39,6 @@ class Document(object):
         self._file_path = file_path
         self.doc_text = doc_text
         self.extraction_method = extraction_method
-        self.log_cache = []
 
     def get_excerpt(self, input_text, form_type, metadata_master,
                     skip_existing_excerpts):
@@ -31,66 +47,201 @@ class Document(object):
         :param input_text:
         :param form_type:
         :param metadata_master:
-        :param skip_existing_excerpts:
+        :param skip_existing_excerpts: skip the sections which the
+        completion ledger records as already saved, or as not found
         :return:
         """
-        start_time = time.process_time()
-        self.prepare_text()
-        prep_time = time.process_time() - start_time
+        config = get_runtime().config
+        section_names = None
+        if skip_existing_excerpts:
+            # only search for the sections not already extracted
+            completed = completed_sections(
+                metadata_master.sec_accession_number, form_type)
+            section_names = [s['itemname'] for s in
+                             load_search_terms()[form_type]
+                             if s['itemname'] not in completed]
+            if not section_names:
+                logger.debug('All sections already extracted: %s %s',
+                             metadata_master.sec_accession_number, form_type)
+                return
         file_name_root = metadata_master.metadata_file_name
-        for section_search_terms in master_search_terms[form_type]:
-            start_time = time.process_time()
-            metadata = copy.copy(metadata_master)
-            warnings = []
-            section_name = section_search_terms['itemname']
-            section_output_path = file_name_root + '_' + section_name
-            txt_output_path = section_output_path + '_excerpt.txt'
-            metadata_path = section_output_path + '_metadata.json'
-            failure_metadata_output_path = section_output_path + '_failure.json'
+        # hashes of the document's text and of its prepared plaintext, and
+        # the text matched by an earlier document's, with --dedup
+        text_hashes = []
+        dedup_level = None
+        n_duplicates = 0
 
-            search_pairs = section_search_terms[self.search_terms_type()]
-            text_extract, extraction_summary, start_text, end_text, warnings = \
-                self.extract_section(search_pairs)
-            time_elapsed = time.process_time() - start_time
+        def save_duplicates(text_hash, level):
+            """Save the sections already recorded for a text as duplicates
+
+            :return: names of the sections saved
+            """
+            nonlocal dedup_level, n_duplicates
+            duplicates = find_results(text_hash, form_type, section_names)
+            # e.g. when the plaintext matches an earlier document's, a
+            # later copy of this document is then found without parsing
+            for earlier_hash in text_hashes:
+                record_results(earlier_hash, form_type, duplicates)
+            text_hashes.append(text_hash)
+            for result in duplicates.values():
+                metadata = duplicate_metadata(metadata_master, result, level)
+                self.save_section(metadata, form_type, None,
+                                  file_name_root, result)
+            if duplicates:
+                dedup_level = dedup_level or level
+                n_duplicates += len(duplicates)
+            return set(duplicates)
+
+        def on_prepared():
+            plaintext = getattr(self, 'plaintext', None)
+            if plaintext is None:
+                return set()
+            return save_duplicates(content_hash(plaintext), PLAINTEXT)
+
+        if config.dedup:
+            if section_names is None:
+                section_names = [s['itemname'] for s in
+                                 load_search_terms()[form_type]]
+            saved = save_duplicates(content_hash(self.doc_text), DOCUMENT)
+            section_names = [s for s in section_names if s not in saved]
+            if not section_names:
+                # the whole document is a copy: it is not parsed
+                log_document_dedup(form_type, DOCUMENT, n_duplicates)
+                return
+        for section in self.extract_sections(
+                form_type, section_names,
+                on_prepared if config.dedup else None):
+            metadata = metadata_master.derive()
+            text_extract = section['excerpt']
             # metadata.extraction_method = self.extraction_method
-            metadata.section_name = section_name
-            if start_text:
-                start_text = start_text.replace('\"', '\'')
-            if end_text:
-                end_text = end_text.replace('\"', '\'')
-            metadata.endpoints = [start_text, end_text]
-            metadata.warnings = warnings
-            metadata.time_elapsed = round(prep_time + time_elapsed, 1)
-            metadata.section_end_time = str(datetime.utcnow())
+            metadata.section_name = section['section_name']
+            metadata.endpoints = section['endpoints']
+            metadata.warnings = section['warnings']
+            metadata.time_elapsed = round(section['time_elapsed'], 1)
             if text_extract:
-                # success: save the excerpt file
                 metadata.section_n_characters = len(text_extract)
-                with open(txt_output_path, 'w', encoding='utf-8',
-                          newline='\n') as txt_output:
-                    txt_output.write(text_extract)
+            self.save_section(metadata, form_type, text_extract,
+                              file_name_root)
+            if config.dedup:
+                result = section_result(
+                    metadata, 'success' if text_extract else 'not_found')
+                for text_hash in text_hashes:
+                    record_results(text_hash, form_type,
+                                   {result['section_name']: result})
+        if config.dedup:
+            log_document_dedup(form_type, dedup_level, n_duplicates)
+
+    def save_section(self, metadata, form_type, text_extract, file_name_root,
+                     original=None):
+        """Save a section's excerpt and metadata, and record its completion
+
+        :param metadata: Metadata of the section
+        :param form_type: document group, e.g. '10-K'
+        :param text_extract: excerpt, or None if the section was not found
+        :param file_name_root: path of the section's output files, less the
+        section name and suffix
+        :param original: for a duplicate section, the result recorded for
+        the original (see dedup.find_results()): the excerpt is not saved
+        again, and the metadata points to the original's output file
+        """
+        config = get_runtime().config
+        section_name = metadata.section_name
+        section_output_path = file_name_root + '_' + section_name
+        txt_output_path = section_output_path + '_excerpt.txt'
+        metadata_path = section_output_path + '_metadata.json'
+        failure_metadata_output_path = section_output_path + '_failure.json'
+        found = bool(text_extract) or \
+            bool(original and original['status'] == 'success')
+        metadata.section_end_time = str(datetime.utcnow())
+        with timed_stage('write', len(text_extract or '')):
+            if config.output_format != 'files':
+                # consolidated output: append the section to a shard file
+                # instead of writing separate excerpt and metadata files
+                shard_writer = get_shard_writer()
+                shard_path = shard_writer.append(metadata, text_extract)
+                if found:
+                    log_str = ': '.join(['SUCCESS Saved excerpt for',
+                                         section_name, shard_path])
+                    logger.debug(log_str)
+                else:
+                    log_str = ': '.join(['No excerpt located for ',
+                                         section_name, metadata.sec_index_url])
+                    logger.warning(log_str)
+            elif found:
+                if text_extract:
+                    # success: save the excerpt file
+                    txt_output_path = compressed_path(txt_output_path)
+                    get_background_writer().write_text(txt_output_path,
+                                                       text_extract)
+                    metadata.output_file = txt_output_path
                 log_str = ': '.join(['SUCCESS Saved file for',
-                                         section_name, txt_output_path])
-                self.log_cache.append(('DEBUG', log_str))
+                                     section_name, metadata.output_file])
+                logger.debug(log_str)
                 try:
                     os.remove(failure_metadata_output_path)
                 except:
                     pass
-                metadata.output_file = txt_output_path
                 metadata.metadata_file_name = metadata_path
                 metadata.save_to_json(metadata_path)
             else:
                 log_str = ': '.join(['No excerpt located for ',
-                                         section_name, metadata.sec_index_url])
-                self.log_cache.append(('WARNING', log_str))
+                                     section_name, metadata.sec_index_url])
+                logger.warning(log_str)
                 try:
                     os.remove(metadata_path)
                 except:
                     pass
                 metadata.metadata_file_name = failure_metadata_output_path
                 metadata.save_to_json(failure_metadata_output_path)
-            if args.write_sql:
-                metadata.save_to_db()
-        return(self.log_cache)
+            # recorded once the section's shard record or excerpt file is
+            # on disk
+            if config.output_format != 'files':
+                shard_writer.when_written(record_section, metadata,
+                                          form_type, found)
+            else:
+                get_background_writer().when_written(record_section, metadata,
+                                                     form_type, found)
+
+    def extract_sections(self, form_type, section_names=None,
+                         on_prepared=None):
+        """Search the document for each of the sections of form_type.
+
+        Nothing is written to files or the database.
+        :param form_type: document group, e.g. '10-K'
+        :param section_names: only search for these sections (default: all)
+        :param on_prepared: function called once the document's text is
+        prepared, returning the names of sections not to search for
+        :return: iterator of dicts, one for each section, with section_name,
+        excerpt (None if the section was not found), endpoints (first and
+        last lines of the excerpt), warnings, extraction_summary and
+        time_elapsed (CPU seconds, including preparing the document)
+        """
+        start_time = time.process_time()
+        self.prepare_text()
+        prep_time = time.process_time() - start_time
+        skip_sections = on_prepared() if on_prepared else set()
+        for section_search_terms in load_search_terms()[form_type]:
+            if section_names is not None and \
+                    section_search_terms['itemname'] not in section_names:
+                continue
+            if section_search_terms['itemname'] in skip_sections:
+                continue
+            start_time = time.process_time()
+            search_pairs = section_search_terms[self.search_terms_type()]
+            with timed_stage('section_regex', len(self.doc_text)):
+                text_extract, extraction_summary, start_text, end_text, \
+                    warnings = self.extract_section(search_pairs)
+            time_elapsed = time.process_time() - start_time
+            if start_text:
+                start_text = start_text.replace('\"', '\'')
+            if end_text:
+                end_text = end_text.replace('\"', '\'')
+            yield {'section_name': section_search_terms['itemname'],
+                   'excerpt': text_extract,
+                   'endpoints': [start_text, end_text],
+                   'warnings': warnings,
+                   'extraction_summary': extraction_summary,
+                   'time_elapsed': prep_time + time_elapsed}
 
     def prepare_text(self):
         # handled in child classes
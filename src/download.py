@@ -6,27 +6,68 @@
     along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 # Originally adapted from "SEC-Edgar" package code
-import multiprocessing as mp
 import os
 import re
-import copy
-from bs4 import BeautifulSoup
+import time
+from datetime import datetime
+from functools import partial
 
-from .utils import args, logger, requests_get
+from .utils import logger, requests_get
+from .decoding import decode_bytes, response_charset, response_text
+from .config import load_search_terms
+from .runtime import get_runtime, init_worker
+from .log_queue import log_context
 from .metadata import Metadata
-from .utils import search_terms as master_search_terms
+from .edgar_pages import parse_listing_page
 from .html_document import HtmlDocument
+from .xbrl_document import XbrlDocument
 from .text_document import TextDocument
+from .compression import compressed_path, get_background_writer
+from .shards import get_shard_writer
+from .storage import accession_number, storage_subdirectory
+from .timing import timed_stage, start_filing_timings, stop_filing_timings, \
+    log_filing_timings
+from .profiling import start_profiler, save_profile, save_slow_filing
+from .ledger import FILING, is_filing_complete, record_completion
+from .shm_transport import SharedMemoryTransport, read_buffer
+from .scheduler import SizeAwareScheduler
+from .worker_pool import TaskTimeoutError, WorkerPool
+from .memory import MB, MemoryModel, log_filing_memory, memory_budget, \
+    start_memory_tracking
+
+
+# output file extension and Document class for each extraction method
+FILE_EXTENSIONS = {'xbrl': '.xbrl', 'html': '.htm', 'txt': '.txt'}
+READER_CLASSES = {'xbrl': XbrlDocument, 'html': HtmlDocument,
+                  'txt': TextDocument}
 
 
 class EdgarCrawler(object):
-    def __init__(self):
-        self.storage_folder = None
+    def __init__(self, runtime=None):
+        """
+        :param runtime: Runtime of the batch run (default: the current
+        process's Runtime)
+        """
+        self.runtime = runtime or get_runtime()
+        # worker pool, started by start_pool() on first use
+        self.pool = None
+        self.oversized_pool = None
+        self.scheduler = None
+        self.transport = None
+        self.memory_model = None
+
+    def __getstate__(self):
+        # a crawler sent to a pool worker uses the worker's own Runtime,
+        # set up by init_worker()
+        return {}
+
+    def __setstate__(self, state):
+        self.__init__()
 
     def download_filings(self, company_description, edgar_search_string,
                          filing_search_string, date_search_string,
                          start_date, end_date,
-                         do_save_full_document, count=100):
+                         do_save_full_document, count=100, wait=True):
         """Build a list of all filings of a certain type, within a date range.
 
         Then download them and extract the text of interest
@@ -35,6 +76,7 @@ class EdgarCrawler(object):
             Search Results query page. 9999=show all
         :param: type_serach_string
         :param: start_date, end_date
+        :param wait: see download_index_links()
         :return: text_extract: str , warnings: [str]
         """
 
@@ -44,61 +86,240 @@ class EdgarCrawler(object):
                                                     date_search_string,
                                                     start_date, end_date, count)
 
-        filings_list = []
-
         logger.info("Identified " + str(len(filings_links)) +
                     " filings, gathering SEC metadata and document links...")
+        self.download_index_links([(index_url, company_description)
+                                   for index_url in filings_links],
+                                  date_search_string, do_save_full_document,
+                                  wait=wait)
+        logger.debug("Finished attempting to download all the %s forms for %s",
+                     filing_search_string, company_description)
+
+    def download_index_links(self, filings_links, date_search_string,
+                             do_save_full_document, wait=True):
+        """Download filings and extract the text of interest
 
-        is_multiprocessing = args.multiprocessing_cores > 0
+        :param filings_links: list of (filing index page URL, company
+        description) pairs
+        :param date_search_string: pattern for the report period of the
+        filings to download
+        :param wait: wait until the filings have been processed. Otherwise,
+        with multiprocessing, they may still be in progress on return: the
+        next call adds its filings to the same pool, and wait() or close()
+        waits for them all.
+        :return: index page URLs of the filings processed, or skipped as
+        already completed (those not of the report period are left out)
+        """
+        config = self.runtime.config
+        processed_urls = []
+        is_multiprocessing = config.multiprocessing_cores > 0
         if is_multiprocessing:
-            pool = mp.Pool(processes = args.multiprocessing_cores)
+            self.start_pool()
 
-        for i, index_url in enumerate(filings_links):
+        for index_url, company_description in filings_links:
             # Get the URL for the (text-format) document which packages all
             # of the parts of the filing
             base_url = re.sub('-index.htm.?','',index_url) + ".txt"
-            filings_list.append([index_url, base_url, company_description])
-            filing_metadata = Metadata(index_url)
+            if config.resume and \
+                    is_filing_complete(accession_number(index_url)):
+                logger.debug('Already completed, skipping: %s', index_url)
+                processed_urls.append(index_url)
+                continue
+            filing_metadata = Metadata(index_url, self.runtime)
 
             if re.search(date_search_string,
                          str(filing_metadata.sec_period_of_report)):
                 filing_metadata.sec_index_url = index_url
                 filing_metadata.sec_url = base_url
+                filing_metadata.sec_accession_number = \
+                    accession_number(index_url)
                 filing_metadata.company_description = company_description
+                processed_urls.append(index_url)
                 if is_multiprocessing:
-                    # multi-core processing. Add jobs to pool.
-                    pool.apply_async(self.download_filing,
-                                     args=(filing_metadata, do_save_full_document),
-                                     callback=self.process_log_cache)
+                    filing_metadata.memory_estimate = \
+                        self.memory_model.estimate(
+                            filing_metadata.submission_size,
+                            filing_metadata.index_documents,
+                            self.document_groups())
+                if self.transport:
+                    submission = self.share_submission(filing_metadata,
+                                                       self.transport)
+                    if submission:
+                        self.scheduler.submit(
+                            submission.length, self.download_filing,
+                            args=(filing_metadata, do_save_full_document,
+                                  submission),
+                            callback=partial(release_submission,
+                                             self.transport, submission),
+                            error_callback=partial(
+                                self.log_filing_error, filing_metadata,
+                                release=partial(release_submission,
+                                                self.transport, submission),
+                                submission=submission),
+                            footprint=filing_metadata.memory_estimate)
+                elif is_multiprocessing:
+                    # multi-core processing. Add jobs to pool, largest
+                    # submission first (size as given on the index page)
+                    self.scheduler.submit(
+                        filing_metadata.submission_size,
+                        self.download_filing,
+                        args=(filing_metadata, do_save_full_document),
+                        error_callback=partial(self.log_filing_error,
+                                               filing_metadata),
+                        footprint=filing_metadata.memory_estimate)
                 else:
                     # single core processing
-                    log_cache = self.download_filing(filing_metadata, do_save_full_document)
-                    self.process_log_cache(log_cache)
-        if is_multiprocessing:
-            pool.close()
-            pool.join()
-        logger.debug("Finished attempting to download all the %s forms for %s",
-                     filing_search_string, company_description)
+                    self.download_filing(filing_metadata, do_save_full_document)
+        if wait:
+            self.wait()
+        return processed_urls
+
+    def start_pool(self):
+        """Start the worker pool (or pools) for the run, if not yet started.
+
+        The pool is kept until close(), so that the filings of one company
+        can start while the last, large filings of the previous one are
+        still in progress.
+        """
+        if self.scheduler:
+            return
+        config = self.runtime.config
+        processes = config.multiprocessing_cores
+        # workers send their log records straight to the main
+        # process's log queue, so they are written out in real time
+        pool_args = dict(
+            initializer=init_worker,
+            initargs=(self.runtime, self.runtime.log_queue),
+            task_timeout=config.task_timeout,
+            max_tasks_per_child=config.max_tasks_per_child,
+            max_worker_rss=config.max_worker_rss_mb and
+            int(config.max_worker_rss_mb * MB))
+        if config.oversized_mb:
+            # oversized submissions take one of the cores, one at a time
+            processes = max(1, processes - 1)
+            self.oversized_pool = WorkerPool(1, **pool_args)
+        self.pool = WorkerPool(processes, **pool_args)
+        # filings' memory estimates, calibrated by the peak RSS of earlier
+        # filings, and the budget they share
+        self.memory_model = MemoryModel.from_db(self.runtime.db_location) \
+            if config.write_sql else MemoryModel()
+        budget = memory_budget(config.memory_budget_mb,
+                               config.multiprocessing_cores)
+        logger.info('Memory budget for filings in progress: %s; estimate '
+                    'per byte of document: %s',
+                    '%.0f MB' % (budget / MB) if budget else 'none',
+                    ', '.join('%s %.1f' % (method, factor) for method, factor
+                              in sorted(self.memory_model.factors.items())))
+        self.scheduler = SizeAwareScheduler(
+            self.pool, processes, config.schedule_window,
+            oversized_bytes=config.oversized_mb and
+            int(config.oversized_mb * MB),
+            oversized_pool=self.oversized_pool, memory_budget=budget)
+        if config.transport == 'shm':
+            # submissions are downloaded here, and handed to the workers
+            # in shared memory: one for each task running or waiting
+            self.transport = SharedMemoryTransport(
+                max_buffers=config.multiprocessing_cores +
+                config.schedule_window)
+
+    def wait(self):
+        """Wait until all the filings sent to the pool have been processed
+        """
+        if self.scheduler:
+            self.scheduler.wait()
+
+    def close(self):
+        """Wait for the filings in progress, then stop the pool
+        """
+        if not self.scheduler:
+            return
+        self.scheduler.wait()
+        for pool in [self.pool, self.oversized_pool]:
+            if pool:
+                pool.close()
+                pool.join()
+        if self.transport:
+            self.transport.close()
+        self.pool = self.oversized_pool = None
+        self.scheduler = self.transport = None
+
+    def document_groups(self):
+        """Document groups to extract from each filing, e.g. ['10-K']
+        """
+        search_terms = load_search_terms()
+        return [doc_type for doc_type in self.runtime.config.documents
+                if doc_type in search_terms]
+
+    def share_submission(self, filing_metadata, transport):
+        """Download a filing's submission in the main process, into shared
+        memory for a pool worker (see shm_transport)
+
+        :return: BufferHandle, or None if the download failed
+        """
+        try:
+            filing_bytes, charset = fetch_submission(filing_metadata.sec_url)
+        except Exception as e:
+            self.log_filing_error(filing_metadata, e)
+            return None
+        return transport.put(filing_bytes, charset)
+
 
+    def log_filing_error(self, filing_metadata, exception, release=None,
+                         submission=None):
+        """Pool error callback: log and record a filing whose processing
+        failed, whether it raised an exception, timed out or lost its worker
 
-    def process_log_cache(self, log_cache):
-        """Output log_cache messages via logger
+        :param release: function to call to release the filing's
+        resources, if any
+        :param submission: shm_transport.BufferHandle of the submission,
+        if it was downloaded by the main process
         """
-        for msg in log_cache:
-            msg_type = msg[0]
-            msg_text = msg[1]
-            if msg_type=='process_name':
-                id = '(' + msg_text + ') '
-            elif msg_type=='INFO':
-                logger.info(id + msg_text)
-            elif msg_type=='DEBUG':
-                logger.debug(id + msg_text)
-            elif msg_type=='WARNING':
-                logger.warning(id + msg_text)
-            elif msg_type=='ERROR':
-                logger.error(id + msg_text)
+        if isinstance(exception, TaskTimeoutError):
+            # the worker was killed, with the filing's timings
+            self.save_failed_slow_filing(filing_metadata,
+                                         self.runtime.config.task_timeout,
+                                         None, exception, submission)
+        if release:
+            release()
+        logger.error("Failed to process filing %s: %s",
+                     filing_metadata.sec_index_url, repr(exception),
+                     exc_info=exception,
+                     extra={'cik': filing_metadata.sec_cik,
+                            'accession': filing_metadata.sec_accession_number})
+        # a filing whose worker was killed could not record this itself
+        record_completion(filing_metadata.sec_accession_number,
+                          FILING, FILING, 'failed')
+        try:
+            save_filing_failure(filing_metadata, exception)
+        except Exception:
+            logger.exception('Could not record the failure of filing %s',
+                             filing_metadata.sec_index_url)
 
 
+    def save_failed_slow_filing(self, filing_metadata, wall_time, timings,
+                                exception, submission=None):
+        """Save a filing which failed, or was killed, after running for
+        longer than --slow_filing_seconds to the slow corpus: the slowest
+        filings are often the ones which fail. The submission is read again
+        from shared memory, or downloaded again.
+        """
+        slow_filing_seconds = self.runtime.config.slow_filing_seconds
+        if not (slow_filing_seconds and wall_time and
+                wall_time > slow_filing_seconds):
+            return
+        # the download below is not part of the filing's timings
+        timings = list(timings) if timings is not None else None
+        try:
+            if submission:
+                filing_bytes = read_buffer(submission)
+            else:
+                filing_bytes, _ = fetch_submission(filing_metadata.sec_url)
+            save_slow_filing(filing_metadata, filing_bytes, wall_time,
+                             timings, exception)
+        except Exception:
+            logger.exception('Could not save failed filing %s to the slow '
+                             'corpus', filing_metadata.sec_index_url)
+
 
     def download_filings_links(self, edgar_search_string, company_description,
                                filing_search_string, date_search_string,
@@ -114,7 +335,7 @@ class EdgarCrawler(object):
         example of a typical base_url: http://www.sec.gov/cgi-bin/browse-secedgartext?action=getcompany&CIK=0000051143&type=10-K&datea=20011231&dateb=20131231&owner=exclude&output=xml&count=9999
         """
 
-        sec_website = "https://www.sec.gov/"
+        sec_website = self.runtime.config.edgar_url
         browse_url = sec_website + "cgi-bin/browse-edgar"
         requests_params = {'action': 'getcompany',
                            'CIK': str(edgar_search_string),
@@ -133,24 +354,78 @@ class EdgarCrawler(object):
         continuation_tag = 'first pass'
 
         while continuation_tag:
-            r = requests_get(browse_url, params=requests_params)
+            with timed_stage('listing_fetch') as stage_info:
+                r = requests_get(browse_url, params=requests_params)
+                data = response_text(r)
+                stage_info['n_bytes'] = len(r.content)
             if continuation_tag == 'first pass':
                 logger.debug("EDGAR search URL: " + r.url)
                 logger.info('-' * 100)
-            data = r.text
-            soup = BeautifulSoup(data, "html.parser")
-            for link in soup.find_all('a', {'id': 'documentsbutton'}):
-                URL = sec_website + link['href']
+            with timed_stage('listing_parse', len(data)):
+                index_paths, next_path = parse_listing_page(data, count)
+            for index_path in index_paths:
+                URL = sec_website + index_path
                 linkList.append(URL)
-            continuation_tag = soup.find('input', {'value': 'Next ' + str(count)}) # a button labelled 'Next 100' for example
+            continuation_tag = next_path
             if continuation_tag:
-                continuation_string = continuation_tag['onclick']
-                browse_url = sec_website + re.findall('cgi-bin.*count=\d*', continuation_string)[0]
+                browse_url = sec_website + next_path
                 requests_params = None
         return linkList
 
 
-    def download_filing(self, filing_metadata, do_save_full_document):
+    def download_filing(self, filing_metadata, do_save_full_document,
+                        submission=None):
+        """
+        Download filing and extract relevant sections, with optional
+        profiling and capture of slow filings.
+
+        :param: filing_metadata: contains URL for the full filing submission,
+        and other EDGAR index metadata
+        :param submission: shm_transport.BufferHandle of the submission,
+        if it has already been downloaded
+        """
+        log_context(cik=filing_metadata.sec_cik,
+                    accession=filing_metadata.sec_accession_number)
+        timings = start_filing_timings()
+        profiler = start_profiler()
+        base_rss = start_memory_tracking()
+        wall_start = time.perf_counter()
+        try:
+            try:
+                filing_bytes = self._download_filing(filing_metadata,
+                                                     do_save_full_document,
+                                                     submission)
+            except Exception as e:
+                record_completion(filing_metadata.sec_accession_number,
+                                  FILING, FILING, 'failed')
+                self.save_failed_slow_filing(
+                    filing_metadata, time.perf_counter() - wall_start,
+                    timings, e, submission)
+                raise
+            if self.runtime.config.output_format != 'files':
+                # not complete until its sections' shard records are on disk
+                get_shard_writer().when_written(
+                    record_completion, filing_metadata.sec_accession_number,
+                    FILING, FILING, 'success')
+            else:
+                record_completion(filing_metadata.sec_accession_number,
+                                  FILING, FILING, 'success')
+            wall_time = time.perf_counter() - wall_start
+            log_filing_memory(filing_metadata, self.document_groups(),
+                              base_rss)
+            if profiler:
+                save_profile(profiler, filing_metadata)
+            slow_filing_seconds = self.runtime.config.slow_filing_seconds
+            if slow_filing_seconds and wall_time > slow_filing_seconds:
+                save_slow_filing(filing_metadata, filing_bytes, wall_time,
+                                 timings)
+        finally:
+            log_filing_timings(timings, time.perf_counter() - wall_start)
+            stop_filing_timings()
+            log_context(cik=None, accession=None)
+
+    def _download_filing(self, filing_metadata, do_save_full_document,
+                         submission=None):
         """
         Download filing, extract relevant sections.
 
@@ -158,8 +433,8 @@ class EdgarCrawler(object):
         portions of the filing, and send the raw text for text extraction
         :param: doc_info: contains URL for the full filing submission, and
         other EDGAR index metadata
+        :return: the filing submission, as the bytes downloaded
         """
-        log_cache = [('process_name', str(os.getpid()))]
         filing_url = filing_metadata.sec_url
         company_description = filing_metadata.company_description
         log_str = "Retrieving: %s, %s, period: %s, index page: %s" \
@@ -167,11 +442,29 @@ class EdgarCrawler(object):
                     filing_metadata.sec_form_header,
                     filing_metadata.sec_period_of_report,
                     filing_metadata.sec_index_url)
-        log_cache.append(('DEBUG', log_str))
+        logger.debug(log_str)
+
+        # each filing's files go in a sub-directory chosen by hashing its
+        # accession number, so no directory listing or shared counter is
+        # needed to spread files evenly across the storage folders
+        storage_folder = storage_subdirectory(
+            self.runtime.storage_toplevel_directory,
+            filing_metadata.sec_accession_number or filing_url,
+            self.runtime.config.storage_levels)
+        # with --output_format jsonl or parquet, excerpts go to shard files:
+        # only create the sub-directory if files are saved in it
+        if self.runtime.config.output_format == 'files' or \
+                do_save_full_document:
+            os.makedirs(storage_folder, exist_ok=True)
 
-        r = requests_get(filing_url)
-        filing_text = r.text
-        filing_metadata.add_data_from_filing_text(filing_text[0:10000])
+        if submission:
+            with timed_stage('submission_read', submission.length):
+                filing_bytes = read_buffer(submission)
+            charset = submission.charset
+        else:
+            filing_bytes, charset = fetch_submission(filing_url)
+        filing_metadata.add_data_from_filing_text(
+            decode_bytes(filing_bytes[0:10000], charset))
 
         # Iterate through the DOCUMENT types that we are seeking,
         # checking for each in turn whether they are included in the current
@@ -181,88 +474,176 @@ class EdgarCrawler(object):
         # whether the current filing came from a '10-K' or '10-Q' web query
         # originally. Also note that we process DOCUMENT types in no
         # fixed order.
-        filtered_search_terms = {doc_type: master_search_terms[doc_type]
-                                 for doc_type in args.documents}
-        for document_group in filtered_search_terms:
-            doc_search = re.search("<DOCUMENT>.{,20}<TYPE>" + document_group +
-                                   ".*?</DOCUMENT>", filing_text,
-                                   flags=re.DOTALL | re.IGNORECASE)
-            if doc_search:
-                doc_text = doc_search.group()
-                doc_metadata = copy.copy(filing_metadata)
-                # look for form type near the start of the document.
-                type_search = re.search("<TYPE>.*",
-                                        doc_text[0:10000], re.IGNORECASE)
-                if type_search:
-                    document_type = re.sub("^<TYPE>", "", type_search.group(), re.IGNORECASE)
-                    document_type = re.sub(r"(-|/|\.)", "",
-                                         document_type)  # remove hyphens etc
-                else:
-                    document_type = "document_TYPE_not_tagged"
-                    log_cache.append(('ERROR',
-                                      "form <TYPE> not given in form?: " +
-                                      filing_url))
-                local_path = os.path.join(self.storage_folder,
-                        company_description + '_' + \
-                        filing_metadata.sec_cik + "_" + document_type + "_" + \
-                        filing_metadata.sec_period_of_report)
-                doc_metadata.document_type = document_type
-                # doc_metadata.form_type_internal = form_string
-                doc_metadata.document_group = document_group
-                doc_metadata.metadata_file_name = local_path
-
-                # search for a <html>...</html> block in the DOCUMENT
-                html_search = re.search(r"<html>.*?</html>",
-                                        doc_text, re.DOTALL | re.IGNORECASE)
-                xbrl_search = re.search(r"<xbrl>.*?</xbrl>",
-                                        doc_text, re.DOTALL | re.IGNORECASE)
-                # occasionally a (somewhat corrupted) filing includes a mixture
-                # of HTML-format documents, but some of them are enclosed in
-                # <TEXT>...</TEXT> tags and others in <HTML>...</HTML> tags.
-                # If the first <TEXT>-enclosed document is before the first
-                # <HTML> enclosed one, then we take that one instead of
-                # the block identified in html_search.
-                text_search = re.search(r"<text>.*?</text>",
-                                        doc_text, re.DOTALL | re.IGNORECASE)
-                if text_search and html_search \
-                        and text_search.start() < html_search.start() \
-                        and html_search.start() > 5000:
-                    html_search = text_search
-                if xbrl_search:
-                    doc_metadata.extraction_method = 'xbrl'
-                    doc_text = xbrl_search.group()
-                    main_path = local_path + ".xbrl"
-                    reader_class = HtmlDocument
-                elif html_search:
-                    # if there's an html block inside the DOCUMENT then just
-                    # take this instead of the full DOCUMENT text
-                    doc_metadata.extraction_method = 'html'
-                    doc_text = html_search.group()
-                    main_path = local_path + ".htm"
-                    reader_class = HtmlDocument
-                else:
-                    doc_metadata.extraction_method = 'txt'
-                    main_path = local_path + ".txt"
-                    reader_class = TextDocument
-                doc_metadata.original_file_size = str(len(doc_text)) + ' chars'
-                sections_log_items = reader_class(
-                    doc_metadata.original_file_name,
-                    doc_text, doc_metadata.extraction_method).\
-                    get_excerpt(doc_text, document_group,
-                                doc_metadata,
-                                skip_existing_excerpts=False)
-                log_cache = log_cache + sections_log_items
-                if do_save_full_document:
-                    with open(main_path, "w") as filename:
-                        filename.write(doc_text)
-                    log_str = "Saved file: " + main_path + ', ' + \
-                        str(round(os.path.getsize(main_path) / 1024)) + ' KB'
-                    log_cache.append(('DEBUG', log_str))
-                    filing_metadata.original_file_name = main_path
-                else:
-                    filing_metadata.original_file_name = \
-                        "file was not saved locally"
-        return(log_cache)
+        document_groups = self.document_groups()
+        for document_group, document_type, extraction_method, doc_text in \
+                split_filing(filing_bytes, document_groups, charset):
+            if document_type == "document_TYPE_not_tagged":
+                logger.error("form <TYPE> not given in form?: " +
+                             filing_url)
+            doc_metadata = filing_metadata.derive()
+            local_path = os.path.join(storage_folder,
+                    company_description + '_' + \
+                    filing_metadata.sec_cik + "_" + document_type + "_" + \
+                    filing_metadata.sec_period_of_report)
+            doc_metadata.document_type = document_type
+            # doc_metadata.form_type_internal = form_string
+            doc_metadata.document_group = document_group
+            doc_metadata.metadata_file_name = local_path
+            doc_metadata.extraction_method = extraction_method
+            main_path = local_path + FILE_EXTENSIONS[extraction_method]
+            reader_class = READER_CLASSES[extraction_method]
+            doc_metadata.original_file_size = str(len(doc_text)) + ' chars'
+            reader_class(
+                doc_metadata.original_file_name,
+                doc_text, doc_metadata.extraction_method).\
+                get_excerpt(doc_text, document_group,
+                            doc_metadata,
+                            skip_existing_excerpts=
+                            self.runtime.config.resume)
+            if do_save_full_document:
+                main_path = compressed_path(main_path)
+                get_background_writer().write_text(main_path, doc_text)
+                log_str = "Saved file: " + main_path + ', ' + \
+                    str(round(len(doc_text) / 1024)) + ' K characters'
+                logger.debug(log_str)
+                filing_metadata.original_file_name = main_path
+            else:
+                filing_metadata.original_file_name = \
+                    "file was not saved locally"
+        # make sure that all the excerpts and documents for this filing
+        # have been compressed and written before reporting back
+        get_background_writer().wait()
+        return filing_bytes
 
 
+def save_filing_failure(filing_metadata, exception):
+    """Record a failed filing as a _failure.json metadata record (or a
+    shard record, with --output_format jsonl or parquet, and a row of the
+    metadata table), as for a section which was not found. Its warnings
+    are the exception and, for an exception raised in a pool worker, its
+    traceback.
+    """
+    runtime = get_runtime()
+    warnings = [repr(exception)]
+    if exception.__cause__ is not None:
+        warnings.append(str(exception.__cause__))
+    metadata = filing_metadata.derive(
+        endpoints=['', ''], warnings=warnings,
+        section_end_time=str(datetime.utcnow()))
+    if runtime.config.output_format != 'files':
+        shard_writer = get_shard_writer()
+        shard_writer.append(metadata, None)
+        if runtime.config.write_sql:
+            shard_writer.when_written(metadata.save_to_db)
+    else:
+        storage_folder = storage_subdirectory(
+            runtime.storage_toplevel_directory,
+            filing_metadata.sec_accession_number or filing_metadata.sec_url,
+            runtime.config.storage_levels)
+        os.makedirs(storage_folder, exist_ok=True)
+        metadata.metadata_file_name = os.path.join(
+            storage_folder, '_'.join([
+                str(filing_metadata.company_description),
+                str(filing_metadata.sec_cik),
+                str(filing_metadata.sec_accession_number)]) + '_failure.json')
+        metadata.save_to_json(metadata.metadata_file_name)
+        if runtime.config.write_sql:
+            metadata.save_to_db()
+
+
+def fetch_submission(url):
+    """Download a filing's full submission text file
+
+    :return: (the submission, as the bytes downloaded, the charset declared
+    by the server or None). Only the documents extracted from it are
+    decoded, see split_filing()
+    """
+    with timed_stage('submission_fetch') as stage_info:
+        r = requests_get(url)
+        filing_bytes = r.content
+        stage_info['n_bytes'] = len(filing_bytes)
+    return filing_bytes, response_charset(r)
+
+
+def release_submission(transport, submission, result=None):
+    """Pool callback: the task using submission has finished
+    """
+    transport.release(submission)
+
+
+def split_filing(filing_text, document_groups, charset=None):
+    """Find the <DOCUMENT> portions of a filing submission.
+
+    Searching for document_group '10-K' will also deliberately find
+    DOCUMENT type variants such as 10-K/A, 10-K405 etc. Only the first
+    DOCUMENT of each group is returned.
+    :param filing_text: full text of the filing submission, as str or as
+    the bytes downloaded. Bytes are searched as they are, and only the
+    documents returned are decoded (see decoding.decode_bytes)
+    :param document_groups: document groups to look for, e.g. ['10-K']
+    :param charset: charset declared by the server for bytes, if any
+    :return: iterator of (document_group, document_type, extraction_method,
+    doc_text) tuples. extraction_method is 'xbrl', 'html' or 'txt'; doc_text
+    is the <xbrl> or <html> block inside the DOCUMENT, if there is one,
+    otherwise the full DOCUMENT text
+    """
+    is_bytes = isinstance(filing_text, bytes)
+
+    def pattern(regex):
+        # the same (ASCII) patterns search either bytes or text
+        return regex.encode('ascii') if is_bytes else regex
+
+    def decode(doc_span):
+        if not is_bytes:
+            return doc_span
+        with timed_stage('decode', len(doc_span)):
+            return decode_bytes(doc_span, charset)
+
+    for document_group in document_groups:
+        with timed_stage('sgml_split', len(filing_text)):
+            doc_search = re.search(pattern("<DOCUMENT>.{,20}<TYPE>" +
+                                           document_group + ".*?</DOCUMENT>"),
+                                   filing_text,
+                                   flags=re.DOTALL | re.IGNORECASE)
+        if not doc_search:
+            continue
+        doc_text = doc_search.group()
+        # look for form type near the start of the document.
+        type_search = re.search(pattern("<TYPE>.*"),
+                                doc_text[0:10000], re.IGNORECASE)
+        if type_search:
+            document_type = decode_bytes(type_search.group())
+            document_type = re.sub("^<TYPE>", "", document_type, re.IGNORECASE)
+            document_type = re.sub(r"(-|/|\.)", "",
+                                 document_type)  # remove hyphens etc
+        else:
+            document_type = "document_TYPE_not_tagged"
 
+        with timed_stage('sgml_split', len(doc_text)):
+            # search for a <html>...</html> block in the DOCUMENT
+            html_search = re.search(pattern(r"<html>.*?</html>"), doc_text,
+                                    re.DOTALL | re.IGNORECASE)
+            xbrl_search = re.search(pattern(r"<xbrl>.*?</xbrl>"), doc_text,
+                                    re.DOTALL | re.IGNORECASE)
+            # occasionally a (somewhat corrupted) filing includes a mixture
+            # of HTML-format documents, but some of them are enclosed in
+            # <TEXT>...</TEXT> tags and others in <HTML>...</HTML> tags.
+            # If the first <TEXT>-enclosed document is before the first
+            # <HTML> enclosed one, then we take that one instead of
+            # the block identified in html_search.
+            text_search = re.search(pattern(r"<text>.*?</text>"), doc_text,
+                                    re.DOTALL | re.IGNORECASE)
+        if text_search and html_search \
+                and text_search.start() < html_search.start() \
+                and html_search.start() > 5000:
+            html_search = text_search
+        if xbrl_search:
+            yield document_group, document_type, 'xbrl', \
+                decode(xbrl_search.group())
+        elif html_search:
+            # if there's an html block inside the DOCUMENT then just
+            # take this instead of the full DOCUMENT text
+            yield document_group, document_type, 'html', \
+                decode(html_search.group())
+        else:
+            yield document_group, document_type, 'txt', decode(doc_text)
@@ -0,0 +1,190 @@
+"""
+    secedgartext: extract text from SEC corporate filings
+    Copyright (C) 2017  Alexander Ions
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Parsers for the EDGAR company listing (browse-edgar) and filing index
+(-index.htm) pages. The pages are generated from fixed templates, so the
+few fields needed are found with compiled regular expressions, without
+building a document tree. Each result is checked against the page; if the
+page does not look as expected, it is parsed with BeautifulSoup instead.
+"""
+import re
+from html import unescape
+
+from bs4 import BeautifulSoup, Tag, NavigableString
+
+from .utils import logger
+
+DOCUMENTS_BUTTON = re.compile(
+    r'<a\s[^>]*\bid\s*=\s*["\']?documentsbutton\b[^>]*>', re.IGNORECASE)
+HREF = re.compile(r'\bhref\s*=\s*["\']([^"\']*)["\']', re.IGNORECASE)
+INPUT_TAG = re.compile(r'<input\s[^>]*>', re.IGNORECASE)
+ONCLICK = re.compile(r'\bonclick\s*=\s*"([^"]*)"', re.IGNORECASE)
+FORM_HEADER = re.compile(
+    r'id\s*=\s*["\']formHeader["\'].*?<strong>([^<]*)</strong>',
+    re.IGNORECASE | re.DOTALL)
+INFO_PAIR = re.compile(
+    r'<div class="infoHead">([^<]*)</div>\s*<div class="info">([^<]*)</div>',
+    re.IGNORECASE)
+COMPANY_NAME = re.compile(r'<span class="companyName">([^<]*)<',
+                          re.IGNORECASE)
+SUBMISSION_ROW = re.compile(r'Complete submission text file</td>(.*?)</tr>',
+                            re.IGNORECASE | re.DOTALL)
+CELL_NUMBER = re.compile(r'<td[^>]*>\s*(\d+)\s*</td>', re.IGNORECASE)
+DOCUMENT_TABLE = re.compile(
+    r'<table[^>]*summary="Document Format Files"[^>]*>(.*?)</table>',
+    re.IGNORECASE | re.DOTALL)
+TABLE_ROW = re.compile(r'<tr[^>]*>(.*?)</tr>', re.IGNORECASE | re.DOTALL)
+TABLE_CELL = re.compile(r'<td[^>]*>(.*?)</td>', re.IGNORECASE | re.DOTALL)
+TAG = re.compile(r'<[^>]*>')
+CIK = re.compile(r'>CIK</acronym>.*?(\d{10,})', re.IGNORECASE | re.DOTALL)
+
+
+def continuation_path(onclick):
+    """Path of the next listing page, from the onclick script of a 'Next'
+    button
+    """
+    return re.findall(r'cgi-bin.*count=\d*', onclick)[0]
+
+
+def document_entry(cells):
+    """(type, file name, size) of a row of the Document Format Files table,
+    from its cell texts (Seq, Description, Document, Type, Size), or None
+    for the complete submission text file
+    """
+    if len(cells) < 5 or cells[1] == 'Complete submission text file':
+        return None
+    size = cells[4]
+    return cells[3], cells[2], int(size) if size.isdigit() else None
+
+
+def parse_listing_page(page, count):
+    """Find the filings listed on a browse-edgar results page
+
+    :param page: HTML of the page
+    :param count: number of results per page, as requested
+    :return: (index_paths, next_path): the paths of the filing index
+    pages, and the path of the next page of results (None if this is the
+    last page)
+    """
+    index_paths = []
+    for tag in DOCUMENTS_BUTTON.findall(page):
+        srch = HREF.search(tag)
+        if srch:
+            index_paths.append(unescape(srch.group(1)))
+    next_value = 'value="Next %s"' % count
+    next_path = None
+    for tag in INPUT_TAG.findall(page):
+        if next_value in tag:
+            srch = ONCLICK.search(tag)
+            if srch:
+                next_path = continuation_path(unescape(srch.group(1)))
+            break
+    # every button found? (the page may have changed its layout)
+    if len(index_paths) != page.count('documentsbutton') or \
+            (next_path is None and next_value in page):
+        logger.debug('Listing page not in the expected layout: parsing '
+                     'with BeautifulSoup')
+        return parse_listing_page_soup(page, count)
+    return index_paths, next_path
+
+
+def parse_listing_page_soup(page, count):
+    """parse_listing_page(), with BeautifulSoup
+    """
+    soup = BeautifulSoup(page, "html.parser")
+    index_paths = [link['href'] for link in
+                   soup.find_all('a', {'id': 'documentsbutton'})]
+    # a button labelled 'Next 100' for example
+    continuation_tag = soup.find('input', {'value': 'Next ' + str(count)})
+    next_path = continuation_path(continuation_tag['onclick']) \
+        if continuation_tag else None
+    return index_paths, next_path
+
+
+def parse_index_page(page):
+    """Find the details of a filing on its index page
+
+    :param page: HTML of the page
+    :return: dict of the page's fields: 'formHeader' (e.g. 'Form 10-K'),
+    'companyName', 'CIK', 'submissionSize' (bytes, int, if given),
+    'documents' (list of (type, file name, size in bytes or None), from the
+    Document Format Files table) and each 'infoHead' label, e.g. 'Filing Date' or 'Period of Report', with
+    colons, spaces and hyphens removed from its value
+    :raises AttributeError: if the page is not a filing index page
+    """
+    form_header = FORM_HEADER.search(page)
+    company_name = COMPANY_NAME.search(page)
+    cik = CIK.search(page)
+    info_pairs = INFO_PAIR.findall(page)
+    if not (form_header and company_name and cik and info_pairs):
+        logger.debug('Index page not in the expected layout: parsing with '
+                     'BeautifulSoup')
+        return parse_index_page_soup(page)
+    index_metadata = {'formHeader': unescape(form_header.group(1)).strip()}
+    for info_head, info in info_pairs:
+        index_metadata[unescape(info_head)] = \
+            re.sub('[: -]', '', unescape(info)).strip()
+    index_metadata['companyName'] = unescape(company_name.group(1)).strip()
+    index_metadata['CIK'] = cik.group(1)
+    submission_row = SUBMISSION_ROW.search(page)
+    if submission_row:
+        sizes = CELL_NUMBER.findall(submission_row.group(1))
+        if sizes:
+            index_metadata['submissionSize'] = int(sizes[-1])
+    documents = []
+    document_table = DOCUMENT_TABLE.search(page)
+    for row in TABLE_ROW.findall(document_table.group(1)
+                                 if document_table else ''):
+        entry = document_entry([unescape(TAG.sub('', cell)).strip()
+                                for cell in TABLE_CELL.findall(row)])
+        if entry:
+            documents.append(entry)
+    index_metadata['documents'] = documents
+    return index_metadata
+
+
+def parse_index_page_soup(page):
+    """parse_index_page(), with BeautifulSoup
+    """
+    index_metadata = {}
+    soup = BeautifulSoup(page, 'html.parser')
+    # Parse the page to find metadata
+    index_metadata['formHeader'] = soup.find('div', {'id': 'formHeader'}). \
+        find_next('strong').string.strip()
+    infoheads = soup.find_all('div', class_='infoHead')
+    for i in infoheads:
+        j = i.next_element
+        while not (isinstance(j, Tag)) or not ('info') in \
+                j.attrs['class']:
+            j = j.next_element
+        # remove colons, spaces, hyphens from dates/times
+        if type(j.string) is NavigableString:
+            index_metadata[i.string] = re.sub('[: -]', '',
+                                              j.string).strip()
+    i = soup.find('span', class_='companyName')
+    while not (isinstance(i, NavigableString)):
+        i = i.next_element
+    index_metadata['companyName'] = i.strip()
+    i = soup.find(string='CIK')
+    while not (isinstance(i, NavigableString)) or \
+            not (re.search(r'\d{10}', i.string)):
+        i = i.next_element
+    index_metadata['CIK'] = re.search(r'\d{5,}', i).group()
+    i = soup.find('td', string='Complete submission text file')
+    if i:
+        sizes = [td.get_text().strip() for td in i.find_next_siblings('td')]
+        if sizes and sizes[-1].isdigit():
+            index_metadata['submissionSize'] = int(sizes[-1])
+    documents = []
+    document_table = soup.find('table', summary='Document Format Files')
+    for row in document_table.find_all('tr') if document_table else []:
+        entry = document_entry([td.get_text().strip()
+                                for td in row.find_all('td')])
+        if entry:
+            documents.append(entry)
+    index_metadata['documents'] = documents
+    return index_metadata
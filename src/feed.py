@@ -0,0 +1,276 @@
+"""
+    secedgartext: extract text from SEC corporate filings
+    Copyright (C) 2017  Alexander Ions
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Feed mode finds new filings in the EDGAR index files instead of querying
+EDGAR once for each company. An index file lists every filing of a day
+(daily-index) or of a quarter so far (full-index), one per line, so a
+single pass over it picks out the filings of all the companies of interest.
+
+Two index formats are read: master.idx (CIK|Company Name|Form Type|Date
+Filed|Filename) and form.idx (fixed-width columns, sorted by form type).
+The feed's watermark, the last filing date it has read in full, is kept in
+the feed_watermark table of the metadata database, so that each run only
+reads the index files and filings that are new since the last one. The
+watermark is not moved past a filing which did not complete, so the next
+run tries it again.
+"""
+import datetime
+import gzip
+import re
+import time
+from os import path
+
+from .config import project_dir
+from .ledger import is_filing_complete
+from .runtime import get_runtime
+from .storage import accession_number
+from .timing import timed_stage
+from .utils import logger, requests_get
+
+DAILY = 'daily'
+
+
+def index_date(date_text):
+    """Filing date of an index record as an int, ccyymmdd (index files give
+    either ccyy-mm-dd or ccyymmdd)
+    """
+    return int(date_text.replace('-', ''))
+
+
+def parse_index(text):
+    """Read the filing records of a master.idx or form.idx file
+
+    :param text: content of the index file
+    :return: iterator of dicts with cik (10 digits), company_name,
+    form_type, date_filed (int, ccyymmdd) and file_name (path of the
+    submission text file, relative to the Archives folder)
+    """
+    lines = iter(text.splitlines())
+    header = ''
+    for line in lines:
+        if line.startswith('-----'):
+            break
+        if line.strip():
+            header = line
+    if '|' in header:
+        for line in lines:
+            fields = line.split('|')
+            if len(fields) != 5:
+                continue
+            cik, company_name, form_type, date_filed, file_name = fields
+            yield {'cik': cik.strip().zfill(10),
+                   'company_name': company_name.strip(),
+                   'form_type': form_type.strip(),
+                   'date_filed': index_date(date_filed.strip()),
+                   'file_name': file_name.strip()}
+    else:
+        # form.idx: the form type and company name are fixed-width columns
+        # (either may contain spaces), followed by CIK, date and file name
+        name_column = header.find('Company Name')
+        for line in lines:
+            srch = re.search(r'\s(\d+)\s+(\d{4}-?\d{2}-?\d{2})\s+(\S+)\s*$',
+                             line)
+            if not srch or name_column < 0:
+                continue
+            yield {'cik': srch.group(1).zfill(10),
+                   'company_name': line[name_column:srch.start()].strip(),
+                   'form_type': line[:name_column].strip(),
+                   'date_filed': index_date(srch.group(2)),
+                   'file_name': srch.group(3)}
+
+
+def index_url(edgar_url, file_name):
+    """URL of the filing index page for an index record's file name,
+    e.g. edgar/data/1000045/0001000045-24-000001.txt
+    """
+    srch = re.search(r'data/(\d+)/(\d{10}-\d{2}-\d{6})\.txt$', file_name)
+    if not srch:
+        return None
+    cik, accession = srch.groups()
+    return edgar_url + 'Archives/edgar/data/%i/%s/%s-index.htm' % (
+        int(cik), accession.replace('-', ''), accession)
+
+
+def daily_index_url(edgar_url, date):
+    """URL of the daily master index file for date (a datetime.date)
+    """
+    return edgar_url + 'Archives/edgar/daily-index/%i/QTR%i/master.%s.idx' \
+        % (date.year, (date.month - 1) // 3 + 1, date.strftime('%Y%m%d'))
+
+
+def read_index_file(location):
+    """Text of an index file, given as a URL or a local path (.gz files
+    are decompressed)
+
+    :return: the text, or None if the file does not exist
+    """
+    with timed_stage('feed_index_fetch') as stage_info:
+        if re.match(r'https?://', location):
+            r = requests_get(location)
+            if r.status_code == 404:
+                return None
+            r.raise_for_status()
+            content = r.content
+        else:
+            if not path.isabs(location):
+                location = path.join(project_dir, location)
+            if not path.exists(location):
+                return None
+            with open(location, 'rb') as f:
+                content = f.read()
+        stage_info['n_bytes'] = len(content)
+    if location.endswith('.gz'):
+        content = gzip.decompress(content)
+    # index files are plain ASCII, apart from the odd company name
+    return content.decode('latin-1')
+
+
+def get_watermark(feed_name):
+    """Last filing date (int, ccyymmdd) read in full from the feed, or None
+    """
+    row = get_runtime().sql_connection.execute(
+        'SELECT last_date FROM feed_watermark WHERE feed_name = ?',
+        (feed_name,)).fetchone()
+    return row[0] if row else None
+
+
+def set_watermark(feed_name, last_date):
+    runtime = get_runtime()
+    connection = runtime.sql_connection
+    connection.execute("""
+        INSERT OR REPLACE INTO feed_watermark (feed_name, last_date,
+        batch_number, updated_time) VALUES (?, ?, ?, ?)""",
+                       (feed_name, last_date, runtime.batch_number,
+                        time.time()))
+    connection.commit()
+
+
+class Feed(object):
+    """New filings of the companies of interest, from an EDGAR index feed.
+
+    The feed is either 'daily', for the daily-index master files on the
+    EDGAR website from the watermark date up to today, or the URL or path
+    of one master.idx or form.idx file (e.g. a full-index quarterly file).
+    Records filed on or after the watermark date are read, and filings
+    already completed (see the completion ledger) are skipped, so a day
+    read in part by an earlier run is finished off without duplicates.
+    Call commit() once the filings have been processed, to move the
+    watermark on.
+    """
+
+    def __init__(self, runtime, source):
+        """
+        :param runtime: the started Runtime of the batch run
+        :param source: 'daily', or the URL or path of an index file
+        """
+        self.runtime = runtime
+        self.source = source
+        self.watermark = get_watermark(source)
+        self.new_watermark = self.watermark
+        self.n_records = 0
+        # filing date of each filing found, by index page URL
+        self.filing_dates = {}
+
+    def index_texts(self):
+        """Text of each index file to read, in date order
+        """
+        config = self.runtime.config
+        if self.source != DAILY:
+            text = read_index_file(self.source)
+            if text is None:
+                logger.warning('Feed index file not found: %s', self.source)
+            else:
+                yield text
+            return
+        today = datetime.date.today()
+        date = datetime.datetime.strptime(
+            str(self.watermark or config.start), '%Y%m%d').date()
+        end_date = min(today, datetime.datetime.strptime(
+            str(config.end), '%Y%m%d').date())
+        while date <= end_date:
+            text = None
+            if date.weekday() < 5:
+                text = read_index_file(daily_index_url(config.edgar_url,
+                                                       date))
+            if text is None and date >= today:
+                # today's index is published in the evening: read it on
+                # the next run
+                break
+            # a weekday before today with no index file is a holiday
+            self.new_watermark = int(date.strftime('%Y%m%d'))
+            if text is not None:
+                yield text
+            date += datetime.timedelta(days=1)
+
+    def filings(self, companies, filings):
+        """Find the new filings of companies in the feed
+
+        :param companies: list of [CIK, company description]
+        :param filings: form types of interest, e.g. ['10-K', '10-Q'];
+        as in EDGAR's search, '10-K' also matches 10-K/A, 10-K405 etc.
+        :return: list of (index page URL, company description) pairs
+        """
+        config = self.runtime.config
+        descriptions = {}
+        for company_keys in companies:
+            if str(company_keys[0]).isdigit():
+                descriptions[str(company_keys[0]).zfill(10)] = \
+                    company_keys[1]
+            else:
+                logger.warning('Feed mode needs CIK codes: skipping %s',
+                               company_keys[0])
+        form_types = tuple(f.upper() for f in filings)
+        since = self.watermark or config.start
+        filings_links = []
+        seen = set()
+        for text in self.index_texts():
+            for record in parse_index(text):
+                self.n_records += 1
+                if self.source != DAILY and \
+                        record['date_filed'] <= config.end:
+                    self.new_watermark = max(self.new_watermark or 0,
+                                             record['date_filed'])
+                if record['cik'] not in descriptions or \
+                        not record['form_type'].upper().startswith(
+                            form_types) or \
+                        not since <= record['date_filed'] <= config.end:
+                    continue
+                url = index_url(config.edgar_url, record['file_name'])
+                if not url or url in seen:
+                    continue
+                seen.add(url)
+                if is_filing_complete(accession_number(url)):
+                    continue
+                filings_links.append((url, descriptions[record['cik']]))
+                self.filing_dates[url] = record['date_filed']
+        logger.info('Feed %s: %i index records read since %s, %i new '
+                    'filings', self.source, self.n_records, since,
+                    len(filings_links))
+        return filings_links
+
+    def commit(self, processed_urls):
+        """Move the watermark on to the last date read, or to the filing
+        date of the earliest filing which did not complete, if any
+
+        :param processed_urls: index page URLs of the filings processed
+        (filings not of the report period are not)
+        """
+        incomplete = [self.filing_dates[url] for url in processed_urls
+                      if url in self.filing_dates and
+                      not is_filing_complete(accession_number(url))]
+        if incomplete and self.new_watermark:
+            logger.warning('Feed %s: %i filings did not complete, to be '
+                           'tried again from %i', self.source,
+                           len(incomplete), min(incomplete))
+            self.new_watermark = min(self.new_watermark, min(incomplete))
+        if self.new_watermark and self.watermark and \
+                self.new_watermark < self.watermark:
+            self.new_watermark = self.watermark
+        if self.new_watermark and self.new_watermark != self.watermark:
+            set_watermark(self.source, self.new_watermark)
+            logger.info('Feed %s: watermark moved to %i', self.source,
+                        self.new_watermark)
@@ -0,0 +1,221 @@
+"""
+    secedgartext: extract text from SEC corporate filings
+    Copyright (C) 2017  Alexander Ions
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Full-text index of the extracted sections, in an SQLite FTS5 table,
+excerpt_index, in the metadata database. Each successful section in the
+metadata table is indexed under its metadata id (the rowid of the index),
+so searches are joined to the metadata table to filter by section, CIK or
+period and to find the excerpt files.
+
+The index is contentless: it holds the words of each excerpt, but not the
+text itself, which stays in the excerpt files (or shards). Sections are
+added in batches, at the end of each batch run with --fulltext_index, or
+for all the batches not yet indexed with:
+
+    python -m src.fulltext index --storage /path/to/storage
+
+and searched (FTS5 query syntax) with:
+
+    python -m src.fulltext search "supply chain" --section Item1A --period 2019
+"""
+import argparse
+import os
+import sqlite3
+import sys
+
+from .compression import read_text
+from .config import project_dir
+from .shards import read_shard_record
+
+FTS_TABLE = """
+    CREATE VIRTUAL TABLE IF NOT EXISTS excerpt_index USING fts5(
+    excerpt, content='', tokenize='porter unicode61')
+    """
+
+SHARD_EXTENSIONS = ('.jsonl.gz', '.jsonl.zst', '.parquet')
+
+
+def create_index(connection):
+    connection.execute(FTS_TABLE)
+    connection.commit()
+
+
+def read_excerpt(connection, row, parquet_cache=None):
+    """Text of a section's excerpt, from its excerpt file or shard
+
+    :param row: dict of the section's metadata columns
+    :param parquet_cache: dict in which the excerpts of the last parquet
+    shard read are kept, as a shard is read whole
+    :return: text, or None if the excerpt cannot be found
+    """
+    output_file = row['output_file']
+    if not output_file.endswith(SHARD_EXTENSIONS):
+        try:
+            return read_text(output_file)
+        except OSError:
+            return None
+    location = connection.execute("""
+        SELECT shard_row, byte_offset, byte_length FROM shard_index
+        WHERE shard_file = ? AND sec_cik = ? AND sec_period_of_report = ?
+        AND document_group = ? AND section_name = ?""",
+                                  (output_file, row['sec_cik'],
+                                   row['sec_period_of_report'],
+                                   row['document_group'],
+                                   row['section_name'])).fetchone()
+    if not location:
+        return None
+    try:
+        if output_file.endswith('.parquet') and parquet_cache is not None:
+            if output_file not in parquet_cache:
+                import pyarrow.parquet
+                parquet_cache.clear()
+                parquet_cache[output_file] = pyarrow.parquet.read_table(
+                    output_file, columns=['excerpt']).column(0).to_pylist()
+            return parquet_cache[output_file][location[0]]
+        return read_shard_record(output_file, *location).get('excerpt')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def index_sections(connection, batch_number=None, batch_size=500):
+    """Add the successful sections not yet in the full-text index
+
+    :param connection: connection to the metadata database
+    :param batch_number: only the sections of this batch (default: all)
+    :param batch_size: number of sections inserted per transaction
+    :return: (number of sections indexed, number whose excerpt could not
+    be read)
+    """
+    create_index(connection)
+    sql = """
+        SELECT id, output_file, sec_cik, sec_period_of_report,
+        document_group, section_name FROM metadata AS m
+        WHERE output_file IS NOT NULL
+        AND NOT EXISTS (SELECT 1 FROM excerpt_index WHERE rowid = m.id)"""
+    parameters = ()
+    if batch_number is not None:
+        sql += ' AND batch_number = ?'
+        parameters = (batch_number,)
+    columns = ('id', 'output_file', 'sec_cik', 'sec_period_of_report',
+               'document_group', 'section_name')
+    rows = [dict(zip(columns, r)) for r in
+            connection.execute(sql + ' ORDER BY id', parameters).fetchall()]
+    n_indexed = n_missing = 0
+    parquet_cache = {}
+    for start in range(0, len(rows), batch_size):
+        batch = []
+        for row in rows[start:start + batch_size]:
+            text = read_excerpt(connection, row, parquet_cache)
+            if text is None:
+                n_missing += 1
+            else:
+                batch.append((row['id'], text))
+        connection.executemany(
+            'INSERT INTO excerpt_index (rowid, excerpt) VALUES (?, ?)', batch)
+        connection.commit()
+        n_indexed += len(batch)
+    return n_indexed, n_missing
+
+
+def period_range(period):
+    """Range of periods of report (YYYYMMDD integers) matching a period
+    given as YYYY, YYYYMM or YYYYMMDD
+    """
+    period = str(period)
+    return int(period.ljust(8, '0')), int(period.ljust(8, '9'))
+
+
+def search(connection, query, section_name=None, cik=None, period=None,
+           document_group=None, limit=100):
+    """Sections whose excerpt matches a full-text query, best match first
+
+    :param query: FTS5 query, e.g. 'cyber*' or '"supply chain" NOT china'
+    :param section_name: e.g. 'Item1A'
+    :param cik: CIK code (leading zeros optional)
+    :param period: period of report, as YYYY, YYYYMM or YYYYMMDD
+    :param document_group: e.g. '10-K'
+    :param limit: maximum number of sections returned
+    :return: list of dicts of metadata columns, with the BM25 'rank'
+    (lower is better)
+    """
+    columns = ('id', 'sec_cik', 'sec_company_name', 'sec_period_of_report',
+               'document_group', 'section_name', 'output_file')
+    sql = ('SELECT ' + ', '.join('m.' + c for c in columns) +
+           ', bm25(excerpt_index) AS rank FROM excerpt_index '
+           'JOIN metadata AS m ON m.id = excerpt_index.rowid '
+           'WHERE excerpt_index MATCH ?')
+    parameters = [query]
+    if section_name:
+        sql += ' AND m.section_name = ?'
+        parameters.append(section_name)
+    if cik:
+        sql += ' AND m.sec_cik = ?'
+        parameters.append(str(cik).zfill(10))
+    if period:
+        sql += ' AND m.sec_period_of_report BETWEEN ? AND ?'
+        parameters += period_range(period)
+    if document_group:
+        sql += ' AND m.document_group = ?'
+        parameters.append(document_group)
+    sql += ' ORDER BY rank LIMIT ?'
+    parameters.append(limit)
+    return [dict(zip(columns + ('rank',), r))
+            for r in connection.execute(sql, parameters).fetchall()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Full-text index of the extracted sections')
+    parser.add_argument('--storage',
+                        default=os.path.join(project_dir,
+                                             'output_files_examples'),
+                        help='storage location holding metadata.sqlite3')
+    commands = parser.add_subparsers(dest='command', required=True)
+    index_parser = commands.add_parser(
+        'index', help='add the sections not yet indexed')
+    index_parser.add_argument('--batch', type=int,
+                              help='only the sections of this batch')
+    search_parser = commands.add_parser(
+        'search', help='find the sections matching a query')
+    search_parser.add_argument('query', help='FTS5 query, e.g. "cyber*" or '
+                                             '\'"supply chain" NOT china\'')
+    search_parser.add_argument('--section', help='e.g. Item1A')
+    search_parser.add_argument('--cik')
+    search_parser.add_argument('--period',
+                               help='period of report: YYYY, YYYYMM or '
+                                    'YYYYMMDD')
+    search_parser.add_argument('--document_group', help='e.g. 10-K')
+    search_parser.add_argument('--limit', type=int, default=100)
+    options = parser.parse_args(argv)
+
+    db_location = os.path.join(options.storage, 'metadata.sqlite3')
+    if not os.path.exists(db_location):
+        sys.exit('No metadata database: %s' % db_location)
+    connection = sqlite3.connect(db_location, timeout=60)
+    try:
+        if options.command == 'index':
+            n_indexed, n_missing = index_sections(connection, options.batch)
+            print('Indexed %i sections; %i excerpts not found' %
+                  (n_indexed, n_missing))
+            return
+        create_index(connection)
+        try:
+            results = search(connection, options.query, options.section,
+                             options.cik, options.period,
+                             options.document_group, options.limit)
+        except sqlite3.OperationalError as e:
+            sys.exit('Invalid query: %s' % e)
+        for r in results:
+            print('\t'.join(str(r[c]) for c in (
+                'sec_cik', 'sec_company_name', 'sec_period_of_report',
+                'document_group', 'section_name', 'output_file')))
+    finally:
+        connection.close()
+
+
+if __name__ == '__main__':
+    main()
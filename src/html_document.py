@@ -6,12 +6,12 @@
     along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 import re
-import time
 from statistics import median
 from bs4 import BeautifulSoup, NavigableString, Tag, Comment
 
 from .utils import logger
 from .document import Document
+from .timing import timed_stage
 
 USE_HTML2TEXT = False
 
@@ -47,85 +47,83 @@ class HtmlDocument(Document):
         # installation. Straightforward on Linux, somewhat tricky on Windows.
         # http://stackoverflow.com/questions/29440482/how-to-install-lxml-on-windows
         # ...note install the 32-bit version for Intel 64-bit?
-        start_time = time.process_time()
-        try:
-            soup = BeautifulSoup(html_text, 'lxml')
-        except:
-            soup = BeautifulSoup(html_text, 'html.parser')      # default parser
-        parsing_time_elapsed = time.process_time() - start_time
-        log_str = 'parsing time: ' + '% 3.2f' % \
-                     (parsing_time_elapsed) + 's; ' + "{:,}". \
-                     format(len(html_text)) + ' characters; ' + "{:,}". \
-                     format(len(soup.find_all())) + ' HTML elements'
-        self.log_cache.append(('DEBUG', log_str))
-
-        # for some old, simplistic documents lacking a proper HTML tree,
-        # put in <br> tags artificially to help with parsing paragraphs, ensures
-        # that section headers get properly identified
-        if len(html_text) / len(soup.find_all()) > 500:
-            html_text = re.sub(r'\n\n', r'<br>', html_text,
-                               flags=re.IGNORECASE)
-            soup = BeautifulSoup(html_text, 'html.parser')
+        with timed_stage('html_parse', len(html_text)):
+            try:
+                soup = BeautifulSoup(html_text, 'lxml')
+            except:
+                soup = BeautifulSoup(html_text, 'html.parser')      # default parser
+            n_elements = len(soup.find_all())
+            # for some old, simplistic documents lacking a proper HTML tree,
+            # put in <br> tags artificially to help with parsing paragraphs,
+            # ensures that section headers get properly identified
+            if len(html_text) / max(n_elements, 1) > 500:
+                html_text = re.sub(r'\n\n', r'<br>', html_text,
+                                   flags=re.IGNORECASE)
+                soup = BeautifulSoup(html_text, 'html.parser')
+        logger.debug("{:,}".format(len(html_text)) + ' characters; ' +
+                     "{:,}".format(n_elements) + ' HTML elements')
 
         # Remove numeric tables from soup
-        tables_generator = (s for s in soup.find_all('table') if
-                            self.should_remove_table(s))
-        # debug: save the extracted tables to a text file
-        # tables_debug_file = open(r'tables_deleted.txt', 'wt', encoding='latin1')
-        for s in tables_generator:
-            s.replace_with('[DATA_TABLE_REMOVED]')
-            # tables_debug_file.write('#' * 80 + '\n')
-            # tables_debug_file.write('\n'.join([x for x in s.text.splitlines()
-            # if x.strip()]).encode('latin-1','replace').decode('latin-1'))
-        # tables_debug_file.close()
+        with timed_stage('table_removal', len(html_text)):
+            tables_generator = (s for s in soup.find_all('table') if
+                                self.should_remove_table(s))
+            # debug: save the extracted tables to a text file
+            # tables_debug_file = open(r'tables_deleted.txt', 'wt', encoding='latin1')
+            for s in tables_generator:
+                s.replace_with('[DATA_TABLE_REMOVED]')
+                # tables_debug_file.write('#' * 80 + '\n')
+                # tables_debug_file.write('\n'.join([x for x in s.text.splitlines()
+                # if x.strip()]).encode('latin-1','replace').decode('latin-1'))
+            # tables_debug_file.close()
         self.soup = soup
 
-        if USE_HTML2TEXT:
-            # option: use the HTML2TEXT library for paragraph splitting.
-            # Purpose and performance is generally similar to the
-            # home-made approach below
-            import html2text
-            h = html2text.HTML2Text(bodywidth=0)
-            h.ignore_emphasis = True
-            self.plaintext = h.handle(str(soup)) # use soup instead of the original html: it's faster and it benefits from the tables being excluded
-        else:
-            # paragraphs_analysis = []
-            # p_idx = 0
-            # has_href = False
-            # has_crossreference = False
-            paragraph_string = ''
-            document_string = ''
-            all_paras = []
-            ec = soup.find()
-            is_in_a_paragraph = True
-            while not (ec is None):
-                if is_line_break(ec) or ec.next_element is None:
-                    # end of paragraph tag (does not itself contain
-                    # Navigable String): insert double line-break for readability
-                    if is_in_a_paragraph:
-                        is_in_a_paragraph = False
-                        all_paras.append(paragraph_string)
-                        document_string = document_string + '\n\n' + paragraph_string
-                else:
-                    # continuation of the current paragraph
-                    if isinstance(ec, NavigableString) and not \
-                            isinstance(ec, Comment):
-                        # # remove redundant line breaks and other whitespace at the
-                        # # ends, and in the middle, of the string
-                        # ecs = re.sub(r'\s+', ' ', ec.string.strip())
-                        ecs = re.sub(r'\s+', ' ', ec.string)
-                        if len(ecs) > 0:
-                            if not (is_in_a_paragraph):
-                                # set up for the start of a new paragraph
-                                is_in_a_paragraph = True
-                                paragraph_string = ''
-                            # paragraph_string = paragraph_string + ' ' + ecs
-                            paragraph_string = paragraph_string + ecs
-                ec = ec.next_element
-            # clean up multiple line-breaks
-            document_string = re.sub('\n\s+\n', '\n\n', document_string)
-            document_string = re.sub('\n{3,}', '\n\n', document_string)
-            self.plaintext = document_string
+        with timed_stage('text_walk', len(html_text)):
+            if USE_HTML2TEXT:
+                # option: use the HTML2TEXT library for paragraph splitting.
+                # Purpose and performance is generally similar to the
+                # home-made approach below
+                import html2text
+                h = html2text.HTML2Text(bodywidth=0)
+                h.ignore_emphasis = True
+                self.plaintext = h.handle(str(soup)) # use soup instead of the original html: it's faster and it benefits from the tables being excluded
+            else:
+                # paragraphs_analysis = []
+                # p_idx = 0
+                # has_href = False
+                # has_crossreference = False
+                paragraph_string = ''
+                document_string = ''
+                all_paras = []
+                ec = soup.find()
+                is_in_a_paragraph = True
+                while not (ec is None):
+                    if is_line_break(ec) or ec.next_element is None:
+                        # end of paragraph tag (does not itself contain
+                        # Navigable String): insert double line-break for readability
+                        if is_in_a_paragraph:
+                            is_in_a_paragraph = False
+                            all_paras.append(paragraph_string)
+                            document_string = document_string + '\n\n' + paragraph_string
+                    else:
+                        # continuation of the current paragraph
+                        if isinstance(ec, NavigableString) and not \
+                                isinstance(ec, Comment):
+                            # # remove redundant line breaks and other whitespace at the
+                            # # ends, and in the middle, of the string
+                            # ecs = re.sub(r'\s+', ' ', ec.string.strip())
+                            ecs = re.sub(r'\s+', ' ', ec.string)
+                            if len(ecs) > 0:
+                                if not (is_in_a_paragraph):
+                                    # set up for the start of a new paragraph
+                                    is_in_a_paragraph = True
+                                    paragraph_string = ''
+                                # paragraph_string = paragraph_string + ' ' + ecs
+                                paragraph_string = paragraph_string + ecs
+                    ec = ec.next_element
+                # clean up multiple line-breaks
+                document_string = re.sub('\n\s+\n', '\n\n', document_string)
+                document_string = re.sub('\n{3,}', '\n\n', document_string)
+                self.plaintext = document_string
 
 
     def extract_section(self, search_pairs):
@@ -157,8 +155,7 @@ class HtmlDocument(Document):
                     if isinstance(s, tuple):
                         # If incorrect use of multiple regex groups has caused
                         # more than one match, then s is returned as a tuple
-                        self.log_cache.append(('ERROR',
-                                   "Groups found in Regex, please correct"))
+                        logger.error("Groups found in Regex, please correct")
                     if len(s) > longest_text_length:
                         text_extract = s.strip()
                         longest_text_length = len(s)
@@ -194,8 +191,7 @@ class HtmlDocument(Document):
                     char_counts.append(len(t))
             return len(char_counts) > 5 and median(char_counts) < 30
         else:
-            self.log_cache.append(('ERROR',
-                                   "the should_remove_table function is broken"))
+            logger.error("the should_remove_table function is broken")
 
 
 
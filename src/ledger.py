@@ -0,0 +1,72 @@
+"""
+    secedgartext: extract text from SEC corporate filings
+    Copyright (C) 2017  Alexander Ions
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+The completion ledger records what has been done, across all batches, in
+the completion_ledger table of the metadata database. Each row is keyed by
+accession number, document group and section name. A row with blank
+document group and section name records the outcome of the whole filing.
+
+Status of a section: 'success' (excerpt saved) or 'not_found' (extraction
+ran, but the section was not located). Status of a filing: 'success' (all
+of its documents were processed) or 'failed' (an error stopped it).
+In --resume mode, filings with status 'success' are skipped before anything
+is downloaded, and in retried filings, sections already saved, or searched
+for but not found, are skipped.
+"""
+import time
+
+from .runtime import get_runtime
+
+FILING = ''
+
+
+def record_completion(accession, document_group, section_name, status,
+                      output_file=None):
+    """Record the outcome of a section, or (with document_group and
+    section_name FILING) of a whole filing
+    """
+    runtime = get_runtime()
+    if not (accession and runtime.config.write_sql):
+        return
+    connection = runtime.sql_connection
+    connection.execute("""
+        INSERT OR REPLACE INTO completion_ledger (sec_accession_number,
+        document_group, section_name, status, batch_number, output_file,
+        completed_time) VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                       (accession, document_group, section_name, status,
+                        runtime.batch_number, output_file, time.time()))
+    connection.commit()
+
+
+def is_filing_complete(accession):
+    """Has the filing with this accession number been processed in full?
+    """
+    runtime = get_runtime()
+    if not (accession and runtime.config.write_sql):
+        return False
+    row = runtime.sql_connection.execute("""
+        SELECT status FROM completion_ledger WHERE sec_accession_number = ?
+        AND document_group = ? AND section_name = ?""",
+                                         (accession, FILING, FILING)).\
+        fetchone()
+    return bool(row) and row[0] == 'success'
+
+
+def completed_sections(accession, document_group):
+    """Names of the sections of a document already extracted: saved
+    successfully, or searched for but not found
+    """
+    runtime = get_runtime()
+    if not (accession and runtime.config.write_sql):
+        return set()
+    rows = runtime.sql_connection.execute("""
+        SELECT section_name FROM completion_ledger
+        WHERE sec_accession_number = ? AND document_group = ?
+        AND status IN ('success', 'not_found')""",
+                                          (accession, document_group)).\
+        fetchall()
+    return set(row[0] for row in rows)
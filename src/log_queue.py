@@ -0,0 +1,78 @@
+"""
+    secedgartext: extract text from SEC corporate filings
+    Copyright (C) 2017  Alexander Ions
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import contextvars
+import json
+import logging
+import logging.handlers
+
+# structured fields attached to every log record. Workers set the cik and
+# accession number of the filing they are working on with log_context();
+# stage and duration are set on each filing's timing summary (stage
+# 'filing', see timing.log_filing_timings)
+STRUCTURED_FIELDS = ('cik', 'accession', 'stage', 'duration')
+
+_log_context = contextvars.ContextVar('log_context', default={})
+
+
+def log_context(**fields):
+    """Set structured fields (e.g. cik, accession) for subsequent log
+    records from the current process. Fields given as None are removed.
+    """
+    context = dict(_log_context.get())
+    for key, value in fields.items():
+        if value is None:
+            context.pop(key, None)
+        else:
+            context[key] = value
+    _log_context.set(context)
+
+
+class ContextFilter(logging.Filter):
+    """Add the structured fields to each record, before it is queued.
+
+    Fields passed explicitly with logger.info(..., extra={...}) take
+    precedence over the current log_context().
+    """
+    def filter(self, record):
+        context = _log_context.get()
+        for field in STRUCTURED_FIELDS:
+            if not hasattr(record, field):
+                setattr(record, field, context.get(field, ''))
+        return True
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """Format each record as one JSON object per line
+    """
+    def format(self, record):
+        entry = {'time': self.formatTime(record, self.datefmt),
+                 'level': record.levelname,
+                 'pid': record.process}
+        for field in STRUCTURED_FIELDS:
+            entry[field] = getattr(record, field, '')
+        entry['message'] = record.getMessage()
+        return json.dumps(entry)
+
+
+def queue_handler(log_queue):
+    """Handler which passes records (with structured fields) to log_queue
+    """
+    handler = logging.handlers.QueueHandler(log_queue)
+    handler.addFilter(ContextFilter())
+    return handler
+
+
+def init_worker_logging(logger_name, log_queue, level=logging.DEBUG):
+    """Pool worker initializer: send all the worker's log records to the
+    log queue, which is read by the QueueListener in the main process
+    """
+    worker_logger = logging.getLogger(logger_name)
+    for handler in list(worker_logger.handlers):
+        worker_logger.removeHandler(handler)
+    worker_logger.setLevel(level)
+    worker_logger.addHandler(queue_handler(log_queue))
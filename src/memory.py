@@ -0,0 +1,249 @@
+"""
+    secedgartext: extract text from SEC corporate filings
+    Copyright (C) 2017  Alexander Ions
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Memory footprint of filings: estimates for admission control on the worker
+pool (see scheduler.SizeAwareScheduler), and measurement of the actual
+peak RSS of each filing, to calibrate the estimates.
+
+A filing's footprint is estimated as its submission (held as bytes) plus a
+multiple of the size of each document extracted from it: a BeautifulSoup
+tree, with the document's text, takes many times the size of the HTML.
+The multiples, one for each extraction method, are calibrated from the
+peak RSS recorded for earlier filings in the filing_memory table.
+"""
+import logging
+import re
+import resource
+import sqlite3
+import sys
+
+from .timing import percentile
+
+# the program's logger (as in timing.py, this module does not import utils)
+logger = logging.getLogger('text_analysis')
+
+MB = 1024 * 1024
+
+# footprint of a document, as a multiple of its size, for each extraction
+# method (see download.FILE_EXTENSIONS), until calibrated
+DEFAULT_FACTORS = {'html': 20.0, 'txt': 4.0}
+
+# calibration: the percentile of the observed multiples used, the number
+# of filings needed for a method, and the smallest document counted (the
+# footprint of smaller ones is mostly fixed overhead)
+CALIBRATION_PERCENTILE = 90
+CALIBRATION_MIN_FILINGS = 10
+CALIBRATION_MIN_BYTES = 100 * 1024
+
+# share of the available memory used as the default budget
+DEFAULT_BUDGET_SHARE = 0.75
+
+
+def _proc_status_kb(field):
+    """Value (KB) of a field of /proc/self/status, or None
+    """
+    try:
+        with open('/proc/self/status') as f:
+            srch = re.search(field + r':\s*(\d+)', f.read())
+    except OSError:
+        return None
+    return int(srch.group(1)) if srch else None
+
+
+def current_rss():
+    """Resident set size of this process, in bytes (None if unknown)
+    """
+    rss_kb = _proc_status_kb('VmRSS')
+    return rss_kb * 1024 if rss_kb is not None else None
+
+
+def reset_peak_rss():
+    """Reset this process's peak RSS to its current RSS (Linux only)
+
+    :return: True if it was reset
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss():
+    """Peak resident set size of this process, in bytes, since it started
+    or since reset_peak_rss()
+    """
+    peak_kb = _proc_status_kb('VmHWM')
+    if peak_kb is not None:
+        return peak_kb * 1024
+    # ru_maxrss is in KB on Linux, bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+def available_memory():
+    """Memory available for new processes, in bytes (None if unknown)
+    """
+    try:
+        with open('/proc/meminfo') as f:
+            srch = re.search(r'MemAvailable:\s*(\d+)', f.read())
+        return int(srch.group(1)) * 1024 if srch else None
+    except OSError:
+        return None
+
+
+def memory_budget(budget_mb, processes):
+    """Memory budget for the filings in progress on the worker pool
+
+    :param budget_mb: --memory_budget_mb: 0 for no budget, or None for the
+    default, DEFAULT_BUDGET_SHARE of the available memory less the resting
+    memory of the workers
+    :param processes: number of worker processes
+    :return: bytes, or None for no budget
+    """
+    if budget_mb is not None:
+        return int(budget_mb * MB) or None
+    available = available_memory()
+    if not available:
+        return None
+    # forked workers start at about the size of this process
+    return max(1, int(DEFAULT_BUDGET_SHARE * available) -
+               processes * (current_rss() or 0))
+
+
+def extraction_method(file_name):
+    """Extraction method for a document, from its file name on the index
+    page: HTML documents are parsed with BeautifulSoup. Inline XBRL
+    documents, which are streamed (see xbrl_document.py), cannot be told
+    apart from HTML by their file name, and are counted as HTML.
+    """
+    return 'html' if re.search(r'\.(html?|xml)$', file_name or '',
+                               re.IGNORECASE) else 'txt'
+
+
+def document_bytes(submission_size, documents, document_groups):
+    """Size of the documents to be extracted from a filing, for each
+    extraction method
+
+    :param submission_size: size of the submission, in bytes, or None
+    :param documents: list of (type, file name, size) of the documents in
+    the filing, from its index page
+    :param document_groups: document groups extracted, e.g. ['10-K']
+    :return: dict of bytes for each extraction method
+    """
+    method_bytes = dict.fromkeys(DEFAULT_FACTORS, 0)
+    for document_group in document_groups:
+        # as in download.split_filing(), the first document of each group
+        for document_type, file_name, size in documents or []:
+            if document_type.upper().startswith(document_group.upper()):
+                # a document of unknown size is taken to be the whole
+                # submission
+                method_bytes[extraction_method(file_name)] += \
+                    size or submission_size or 0
+                break
+    return method_bytes
+
+
+class MemoryModel(object):
+    """Estimates of the peak memory used to process a filing
+    """
+
+    def __init__(self, factors=None):
+        """
+        :param factors: dict of the footprint of a document as a multiple
+        of its size, for each extraction method (default: DEFAULT_FACTORS)
+        """
+        self.factors = dict(DEFAULT_FACTORS, **(factors or {}))
+
+    @classmethod
+    def from_db(cls, db_location, n_filings=1000):
+        """Model calibrated from the peak RSS of the most recent filings
+        in the filing_memory table. A method's default factor is kept
+        until CALIBRATION_MIN_FILINGS filings with documents of that method
+        alone have been recorded.
+        """
+        try:
+            connection = sqlite3.connect(db_location, timeout=60)
+            try:
+                rows = connection.execute("""
+                    SELECT submission_size, html_bytes, txt_bytes, base_rss,
+                    peak_rss FROM filing_memory ORDER BY rowid DESC LIMIT ?
+                    """, (n_filings,)).fetchall()
+            finally:
+                connection.close()
+        except sqlite3.Error:
+            return cls()
+        multiples = {'html': [], 'txt': []}
+        for submission_size, html_bytes, txt_bytes, base_rss, peak_rss \
+                in rows:
+            for method, method_bytes, other_bytes in [
+                    ('html', html_bytes, txt_bytes),
+                    ('txt', txt_bytes, html_bytes)]:
+                if method_bytes >= CALIBRATION_MIN_BYTES and not other_bytes:
+                    multiples[method].append(
+                        max(0, peak_rss - base_rss - (submission_size or 0))
+                        / method_bytes)
+        factors = {}
+        for method, method_multiples in multiples.items():
+            if len(method_multiples) >= CALIBRATION_MIN_FILINGS:
+                factors[method] = percentile(sorted(method_multiples),
+                                             CALIBRATION_PERCENTILE)
+        return cls(factors)
+
+    def estimate(self, submission_size, documents, document_groups):
+        """Estimated peak memory to process a filing, in bytes, over the
+        worker's resting memory
+
+        :param submission_size: size of the submission, in bytes, or None
+        if unknown
+        :param documents: see document_bytes()
+        :param document_groups: see document_bytes()
+        :return: bytes, or None if the size of the filing is not known
+        """
+        method_bytes = document_bytes(submission_size, documents,
+                                      document_groups)
+        if not submission_size and not any(method_bytes.values()):
+            return None
+        return int((submission_size or 0) +
+                   sum(self.factors[method] * n_bytes
+                       for method, n_bytes in method_bytes.items()))
+
+
+def start_memory_tracking():
+    """Start measuring the peak RSS of the current filing
+
+    :return: the current RSS (bytes), or None if the peak cannot be
+    measured for a single filing on this system
+    """
+    if not reset_peak_rss():
+        return None
+    return current_rss()
+
+
+def log_filing_memory(filing_metadata, document_groups, base_rss):
+    """Log the peak RSS of a filing, as a record with structured fields,
+    which the MetricsHandler saves in the filing_memory table
+
+    :param base_rss: RSS before the filing, from start_memory_tracking()
+    """
+    if base_rss is None:
+        return
+    filing_peak_rss = peak_rss()
+    method_bytes = document_bytes(filing_metadata.submission_size,
+                                  filing_metadata.index_documents,
+                                  document_groups)
+    logger.debug('Peak RSS %.1f MB (%.1f MB over %.1f MB), estimate %s MB',
+                 filing_peak_rss / MB, (filing_peak_rss - base_rss) / MB,
+                 base_rss / MB,
+                 '%.1f' % (filing_metadata.memory_estimate / MB)
+                 if filing_metadata.memory_estimate else 'none',
+                 extra={'peak_rss': filing_peak_rss, 'base_rss': base_rss,
+                        'submission_size': filing_metadata.submission_size,
+                        'html_bytes': method_bytes['html'],
+                        'txt_bytes': method_bytes['txt'],
+                        'memory_estimate': filing_metadata.memory_estimate})
@@ -6,19 +6,53 @@
     along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 import json
+import os
 import re
-from bs4 import BeautifulSoup, Tag, NavigableString
 import time
 import random
 
-from .utils import logger
-from .utils import args, requests_get
-from .utils import batch_number, batch_start_time, batch_machine_id
-from .utils import sql_cursor, sql_connection
+from .utils import logger, requests_get
+from .decoding import response_text
+from .edgar_pages import parse_index_page
+from .runtime import get_runtime
+from .compression import read_text
+from .timing import timed_stage
+
+try:
+    # orjson is optional: several times faster than json for serializing
+    # and parsing large numbers of metadata records
+    import orjson
+except ImportError:
+    orjson = None
+
+# all the fields of a Metadata record, in the order they are written to JSON
+METADATA_FIELDS = ('sec_cik', 'sec_company_name', 'document_type',
+                   'sec_form_header', 'sec_period_of_report',
+                   'sec_filing_date', 'sec_changed_date', 'sec_accepted_date',
+                   'sec_index_url', 'sec_url', 'sec_accession_number',
+                   'metadata_file_name', 'original_file_name',
+                   'original_file_size', 'document_group', 'section_name',
+                   'section_n_characters', 'endpoints', 'extraction_method',
+                   'warnings', 'company_description', 'output_file',
+                   'time_elapsed', 'batch_number', 'batch_signature',
+                   'batch_start_time', 'batch_machine_id', 'section_end_time')
 
 
 class Metadata(object):
-    def __init__(self, index_url=None):
+    # submission_size (bytes) and index_documents (type, file name, size),
+    # from the index page, and memory_estimate (bytes) are only used to
+    # schedule the filing: they are not saved
+    __slots__ = METADATA_FIELDS + ('submission_size', 'index_documents',
+                                   'memory_estimate')
+
+    def __init__(self, index_url=None, runtime=None):
+        """
+        :param index_url: EDGAR filing index page, from which to fill in
+        the filing's details
+        :param runtime: Runtime of the batch run, for the batch details
+        (default: the current process's Runtime, if any)
+        """
+        runtime = runtime or get_runtime(required=False)
         self.sec_cik = ''
         self.sec_company_name = ''
         self.document_type = ''
@@ -29,6 +63,7 @@ class Metadata(object):
         self.sec_accepted_date = ''
         self.sec_index_url = ''
         self.sec_url = ''
+        self.sec_accession_number = ''
         self.metadata_file_name = ''
         self.original_file_name = ''
         self.original_file_size = ''
@@ -41,50 +76,41 @@ class Metadata(object):
         self.company_description = ''
         self.output_file = None
         self.time_elapsed = None
-        self.batch_number = batch_number
-        self.batch_signature = args.batch_signature or ''
-        self.batch_start_time = str(batch_start_time)
-        self.batch_machine_id = batch_machine_id
+        if runtime:
+            self.batch_number = runtime.batch_number
+            self.batch_signature = runtime.config.batch_signature or ''
+            self.batch_start_time = str(runtime.batch_start_time)
+            self.batch_machine_id = runtime.batch_machine_id
+        else:
+            self.batch_number = 0
+            self.batch_signature = ''
+            self.batch_start_time = ''
+            self.batch_machine_id = ''
         self.section_end_time = None
+        self.submission_size = None
+        self.index_documents = None
+        self.memory_estimate = None
 
         if index_url:
-            index_metadata = {}
             attempts = 0
-            while attempts < 5:
+            while True:
                 try:
-                    ri = requests_get(index_url)
+                    with timed_stage('index_fetch') as stage_info:
+                        ri = requests_get(index_url)
+                        index_text = response_text(ri)
+                        stage_info['n_bytes'] = len(ri.content)
                     logger.info('Status Code: ' + str(ri.status_code))
-                    soup = BeautifulSoup(ri.text, 'html.parser')
-                    # Parse the page to find metadata
-                    form_type = soup.find('div', {'id': 'formHeader'}). \
-                        find_next('strong').string.strip()
+                    with timed_stage('index_parse', len(index_text)):
+                        index_metadata = parse_index_page(index_text)
                     break
-                except:
+                except Exception:
                     attempts += 1
                     logger.warning('No valid index page, attempt %i: %s'
                                    % (attempts, index_url))
+                    if attempts >= 5:
+                        raise
                     time.sleep(attempts*10 + random.randint(1,5))
 
-            index_metadata['formHeader'] = form_type
-            infoheads = soup.find_all('div', class_='infoHead')
-            for i in infoheads:
-                j = i.next_element
-                while not (isinstance(j, Tag)) or not ('info') in \
-                        j.attrs['class']:
-                    j = j.next_element
-                # remove colons, spaces, hyphens from dates/times
-                if type(j.string) is NavigableString:
-                    index_metadata[i.string] = re.sub('[: -]', '',
-                                                      j.string).strip()
-            i = soup.find('span', class_='companyName')
-            while not (isinstance(i, NavigableString)):
-                i = i.next_element
-            index_metadata['companyName'] = i.strip()
-            i = soup.find(string='CIK')
-            while not (isinstance(i, NavigableString)) or not (re.search('\d{10}', i.string)):
-                i = i.next_element
-            index_metadata['CIK'] = re.search('\d{5,}', i).group()
-
             for pair in [['Period of Report', 'sec_period_of_report'],
                          ['Filing Date', 'sec_filing_date'],
                          ['Filing Date Changed', 'sec_changed_date'],
@@ -94,6 +120,41 @@ class Metadata(object):
                          ['CIK', 'sec_cik']]:
                 if pair[0] in index_metadata:
                     setattr(self, pair[1], index_metadata[pair[0]])
+            self.submission_size = index_metadata.get('submissionSize')
+            self.index_documents = index_metadata.get('documents')
+
+    def __getstate__(self):
+        # the values alone, in field order: records are pickled for every
+        # task sent to a pool worker
+        return tuple(getattr(self, field) for field in self.__slots__)
+
+    def __setstate__(self, state):
+        for field, value in zip(self.__slots__, state):
+            setattr(self, field, value)
+
+    def __copy__(self):
+        # much faster than the default copy protocol for a __slots__ class
+        metadata = Metadata.__new__(Metadata)
+        for field in self.__slots__:
+            setattr(metadata, field, getattr(self, field))
+        return metadata
+
+    def derive(self, **changes):
+        """Shallow copy of the record, with some fields changed.
+
+        List fields (endpoints, warnings) are shared with the original
+        record until they are replaced, so they should be reassigned
+        rather than modified in place.
+        :param changes: new values for fields of the derived record
+        :return: new Metadata object
+        """
+        metadata = self.__copy__()
+        for field, value in changes.items():
+            setattr(metadata, field, value)
+        return metadata
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in METADATA_FIELDS}
 
     def add_data_from_filing_text(self, text):
         """Scrape metadata from the filing document
@@ -113,22 +174,13 @@ class Metadata(object):
                 setattr(self, pair[1], srch.group().strip())
 
     def save_to_json(self, file_path):
-        """
-        we effectively convert the Metadata object's data into a dict
-        when we do json.dumps on it
+        """Write the metadata fields to file_path as a JSON object
+
         :param file_path:
         :return:
         """
-        with open(file_path, 'w', encoding='utf-8') as json_output:
-            # to write the backslashes in the JSON file legibly
-            # (without duplicate backslashes), we have to
-            # encode/decode using the 'unicode_escape' codec. This then
-            # allows us to open the JSON file and click on the file link,
-            # for immediate viewing in a browser.
-            excerpt_as_json = json.dumps(self, default=lambda o: o.__dict__,
-                                         sort_keys=False, indent=4)
-            json_output.write(bytes(excerpt_as_json, "utf-8").
-                              decode("unicode_escape"))
+        with open(file_path, 'wb') as json_output:
+            json_output.write(dumps(self.to_dict()))
 
 
     def save_to_db(self):
@@ -136,8 +188,6 @@ class Metadata(object):
 
         """
 
-        # conn = sqlite3.connect(path.join(args.storage, 'metadata.sqlite3'))
-        # c = conn.cursor()
         sql_insert = """INSERT INTO metadata (
             batch_number,
             batch_signature,
@@ -180,46 +230,93 @@ class Metadata(object):
                        re.sub("[\'\"]","", self.endpoints[1]).strip()[0:200],
                        str(self.time_elapsed)]) + "')"
         sql_insert = sql_insert.replace("'None'","NULL")
-        sql_cursor.execute(sql_insert)
+        sql_connection = get_runtime().sql_connection
+        sql_connection.execute(sql_insert)
         sql_connection.commit()
 
 
+def dumps(data):
+    """Serialize a dict of metadata fields to UTF-8 JSON bytes.
+
+    Without orjson, the JSON is indented by 4 spaces, as always. With
+    orjson it is written on one line (orjson can only indent by 2 spaces,
+    and compact output is fastest); both are read back the same way.
+    """
+    if orjson:
+        return orjson.dumps(data)
+    return json.dumps(data, ensure_ascii=False, indent=4).encode('utf-8')
+
+
+def loads(json_bytes):
+    """Parse metadata JSON bytes into a dict of fields
+
+    Metadata files written by earlier versions of this program may contain
+    unescaped backslashes (in the 'endpoints' regex text), which are
+    escaped before trying again.
+    """
+    try:
+        return orjson.loads(json_bytes) if orjson else json.loads(json_bytes)
+    except ValueError:
+        return json.loads(json_bytes.decode('utf-8').replace('\\', '\\\\'),
+                          strict=False)
+
+
+def read_json(file_path):
+    """Read the dict of fields from a metadata JSON file
+
+    :return: dict, or None if the file is missing or corrupted
+    """
+    try:
+        with open(file_path, 'rb') as json_file:
+            data = loads(json_file.read())
+    except (OSError, ValueError):
+        logger.info('Could not load corrupted JSON file: ' + file_path)
+        return None
+    # older metadata files used 'form_group' for the document group
+    if 'form_group' in data and 'document_group' not in data:
+        data['document_group'] = data['form_group']
+    return data
+
+
 def load_from_json(file_path):
     metadata = Metadata()
-    with open(file_path, 'r') as json_file:
-        try:
-            # data = json.loads(data_file.read().replace('\\', '\\\\'), strict=False)
-            data = json.loads(json_file.read())
-            metadata.sec_cik = data['sec_cik']
-            metadata.sec_company_name = data['sec_company_name']
-            metadata.company_description = data['company_description']
-            metadata.document_type = data['document_type']
-            metadata.sec_form_header = data['sec_form_header']
-            metadata.sec_period_of_report = data['sec_period_of_report']
-            metadata.sec_filing_date = data['sec_filing_date']
-            metadata.sec_changed_date = data['sec_changed_date']
-            metadata.sec_accepted_date = data['sec_accepted_date']
-            metadata.sec_accepted_date = data['sec_accepted_date']
-            metadata.sec_url = data['sec_url']
-            metadata.metadata_file_name = data['metadata_file_name']
-            metadata.original_file_name = data['original_file_name']
-            metadata.original_file_size = data['original_file_size']
-            metadata.document_group = data['form_group']
-            metadata.section_name = data['section_name']
-            metadata.section_n_characters = data['section_n_characters']
-            metadata.endpoints = data['endpoints']
-            metadata.extraction_method = data['extraction_method']
-            metadata.warnings = data['warnings']
-            metadata.output_file = data['output_file']
-            metadata.time_elapsed = data['time_elapsed']
-            metadata.batch_number = data['batch_number']
-            metadata.batch_signature = data['batch_signature']
-            metadata.batch_start_time = data['batch_start_time']
-            metadata.batch_machine_id = data['batch_machine_id']
-            metadata.section_end_time = data['section_end_time']
-
-        except:
-            logger.info('Could not load corrupted JSON file: ' + file_path)
-
+    data = read_json(file_path) or {}
+    for field in METADATA_FIELDS:
+        if field in data:
+            setattr(metadata, field, data[field])
     return metadata
 
+
+def load_table(file_paths):
+    """Bulk load many metadata JSON files into an in-memory table.
+
+    :param file_paths: list of metadata file paths, or a directory which is
+    searched (recursively) for _metadata.json and _failure.json files
+    :return: dict of columns: each of METADATA_FIELDS, plus 'file_path',
+    maps to a list of values with one entry per file. This can be passed
+    straight to pandas.DataFrame, for example.
+    """
+    if isinstance(file_paths, str):
+        directory = file_paths
+        file_paths = [os.path.join(root, f)
+                      for root, dirs, files in os.walk(directory)
+                      for f in files
+                      if f.endswith(('_metadata.json', '_failure.json'))]
+    table = {field: [] for field in METADATA_FIELDS + ('file_path',)}
+    for file_path in file_paths:
+        data = read_json(file_path)
+        if data is None:
+            continue
+        for field in METADATA_FIELDS:
+            table[field].append(data.get(field))
+        table['file_path'].append(file_path)
+    return table
+
+
+def load_excerpt(file_path):
+    """Read an excerpt (or saved source document), compressed or not
+
+    :param file_path: path as recorded in the metadata output_file field
+    :return: text of the excerpt
+    """
+    return read_text(file_path)
@@ -0,0 +1,90 @@
+"""
+    secedgartext: extract text from SEC corporate filings
+    Copyright (C) 2017  Alexander Ions
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import cProfile
+import json
+import os
+import random
+import re
+
+from .runtime import get_runtime
+from .utils import logger
+
+PROFILES_FOLDER = 'profiles'
+SLOW_CORPUS_FOLDER = 'slow_corpus'
+
+
+def filing_file_name(filing_metadata):
+    """File name stem for profiles and slow corpus files of a filing
+    """
+    name = filing_metadata.sec_accession_number or \
+        '_'.join([filing_metadata.sec_cik,
+                  filing_metadata.sec_period_of_report])
+    return re.sub(r'[^\w.-]', '_', name)
+
+
+def start_profiler():
+    """Start a cProfile profiler for the current filing, if --profile is
+    set and the filing is picked by the --profile_sample rate
+
+    :return: the running profiler, or None
+    """
+    config = get_runtime().config
+    if config.profile and random.random() < config.profile_sample:
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+    return None
+
+
+def save_profile(profiler, filing_metadata):
+    """Stop profiler and save its statistics as a .prof file, which can be
+    examined with pstats or snakeviz
+    """
+    profiler.disable()
+    profiles_folder = os.path.join(get_runtime().config.storage,
+                                   PROFILES_FOLDER)
+    os.makedirs(profiles_folder, exist_ok=True)
+    profile_path = os.path.join(profiles_folder,
+                                filing_file_name(filing_metadata) + '.prof')
+    profiler.dump_stats(profile_path)
+    logger.debug('Saved profile: %s', profile_path)
+
+
+def save_slow_filing(filing_metadata, filing_bytes, wall_time, timings,
+                     exception=None):
+    """Save the source submission and timing breakdown of a slow filing.
+
+    The slow corpus accumulates across batches, in the storage folder.
+    It is used as input for the benchmarks.
+    :param filing_metadata: Metadata of the filing
+    :param filing_bytes: the submission, as the bytes downloaded
+    :param wall_time: wall-clock seconds taken by the whole filing
+    :param timings: the filing's stage timings, see
+    timing.start_filing_timings() (None if they were lost with the
+    filing's worker)
+    :param exception: the exception which stopped the filing, if it failed
+    """
+    config = get_runtime().config
+    slow_corpus_folder = os.path.join(config.storage, SLOW_CORPUS_FOLDER)
+    os.makedirs(slow_corpus_folder, exist_ok=True)
+    file_stem = os.path.join(slow_corpus_folder,
+                             filing_file_name(filing_metadata))
+    with open(file_stem + '.txt', 'wb') as f:
+        f.write(filing_bytes)
+    breakdown = {'wall_time': wall_time,
+                 'threshold': config.slow_filing_seconds,
+                 'n_bytes': len(filing_bytes),
+                 'metadata': filing_metadata.to_dict(),
+                 'timings': timings}
+    if exception is not None:
+        breakdown['failure'] = repr(exception)
+    with open(file_stem + '_timings.json', 'w', encoding='utf-8') as f:
+        json.dump(breakdown, f, indent=4)
+    logger.warning('Slow %sfiling (%.1fs), saved to slow corpus: %s',
+                   'failed ' if exception is not None else '', wall_time,
+                   file_stem + '.txt')
@@ -0,0 +1,102 @@
+"""
+    secedgartext: extract text from SEC corporate filings
+    Copyright (C) 2017  Alexander Ions
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Queries on the metadata table of the metadata database, for reporting and
+downstream use. Each function takes an sqlite3 connection, e.g.
+
+    connection = sqlite3.connect('/path/to/storage/metadata.sqlite3')
+    latest_excerpts(connection, section_name='Item1A')
+
+and returns a list of dicts, one per row. A section with no output file
+(output_file NULL) is one whose extraction failed. The rows reserving
+batch numbers (see Runtime.reserve_batch_number()) are left out.
+"""
+
+# rows reserving batch numbers have a dummy CIK code
+NOT_RESERVED = "sec_cik NOT GLOB 'dummy*'"
+
+
+def _dicts(cursor):
+    columns = [d[0] for d in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def _filters(cik=None, section_name=None, document_group=None,
+             batch_number=None):
+    """WHERE clause and parameters for the given column values
+    """
+    conditions = [NOT_RESERVED]
+    parameters = []
+    for column, value in [('sec_cik', cik and str(cik).zfill(10)),
+                          ('section_name', section_name),
+                          ('document_group', document_group),
+                          ('batch_number', batch_number)]:
+        if value is not None:
+            conditions.append(column + ' = ?')
+            parameters.append(value)
+    return ' WHERE ' + ' AND '.join(conditions), parameters
+
+
+def latest_excerpts(connection, cik=None, section_name=None,
+                    document_group=None):
+    """The latest successful excerpt of each company, document group and
+    section: the one with the latest period of report (and of those, the
+    one saved last)
+
+    :param cik: only this company (leading zeros optional)
+    :param section_name: only this section, e.g. 'Item1A'
+    :param document_group: only this document group, e.g. '10-K'
+    :return: list of dicts of the metadata columns
+    """
+    where, parameters = _filters(cik, section_name, document_group)
+    rows = _dicts(connection.execute("""
+        SELECT * FROM (
+            SELECT *, row_number() OVER (
+                PARTITION BY sec_cik, document_group, section_name
+                ORDER BY sec_period_of_report DESC, id DESC) AS recency
+            FROM metadata""" + where + """ AND output_file IS NOT NULL)
+        WHERE recency = 1 ORDER BY sec_cik, document_group, section_name
+        """, parameters))
+    for row in rows:
+        del row['recency']
+    return rows
+
+
+def failure_rates(connection, batch_number=None, by_method=False):
+    """Share of sections whose extraction failed, for each document group
+    and section (i.e. each set of search patterns), worst first
+
+    :param batch_number: only this batch (default: all)
+    :param by_method: also break down by extraction method (html, txt,
+    xbrl)
+    :return: list of dicts: document_group, section_name, (extraction_
+    method,) n_sections, n_failed and failure_rate
+    """
+    where, parameters = _filters(batch_number=batch_number)
+    group = 'document_group, section_name' + \
+        (', extraction_method' if by_method else '')
+    return _dicts(connection.execute(
+        'SELECT ' + group + """, count(*) AS n_sections,
+        sum(output_file IS NULL) AS n_failed,
+        avg(output_file IS NULL) AS failure_rate
+        FROM metadata""" + where + """ AND section_name != ''
+        GROUP BY """ + group + """
+        ORDER BY failure_rate DESC, n_sections DESC""", parameters))
+
+
+def batch_summary(connection):
+    """Sections saved and failed in each batch, with its start time
+
+    :return: list of dicts: batch_number, batch_start_time, n_companies,
+    n_sections, n_failed
+    """
+    return _dicts(connection.execute("""
+        SELECT batch_number, min(batch_start_time) AS batch_start_time,
+        count(DISTINCT sec_cik) AS n_companies, count(*) AS n_sections,
+        sum(output_file IS NULL) AS n_failed
+        FROM metadata WHERE """ + NOT_RESERVED + """
+        GROUP BY batch_number ORDER BY batch_number"""))
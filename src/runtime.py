@@ -0,0 +1,429 @@
+"""
+    secedgartext: extract text from SEC corporate filings
+    Copyright (C) 2017  Alexander Ions
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import atexit
+import datetime
+import logging
+import os
+import shutil
+import socket
+import sqlite3
+import sys
+import threading
+import time
+import multiprocessing as mp
+from logging.handlers import QueueListener
+from os import path
+
+from .log_queue import JsonLinesFormatter, queue_handler, init_worker_logging
+from .schema import migrate
+from .timing import MetricsHandler
+
+logger = logging.getLogger('text_analysis')
+
+# the Runtime of the current process: set by Runtime.start() in the main
+# process, and by init_worker() in each pool worker
+_current_runtime = None
+
+TABLES = ["""
+    CREATE TABLE IF NOT EXISTS metadata (
+    id integer PRIMARY KEY,
+    batch_number integer NOT NULL,
+    batch_signature text NOT NULL,
+    batch_start_time datetime NOT NULL,
+    batch_machine_id text,
+    sec_cik text NOT NULL,
+    company_description text,
+    sec_company_name text,
+    sec_form_header text,
+    sec_period_of_report integer,
+    sec_filing_date integer,
+    sec_index_url text,
+    sec_url text,
+    metadata_file_name text,
+    document_group text,
+    section_name text,
+    section_n_characters integer,
+    section_end_time datetime,
+    extraction_method text,
+    output_file text,
+    start_line text,
+    end_line text,
+    time_elapsed real)
+    """, """
+    CREATE TABLE IF NOT EXISTS shard_index (
+    id integer PRIMARY KEY,
+    batch_number integer NOT NULL,
+    sec_cik text NOT NULL,
+    sec_period_of_report integer,
+    document_group text,
+    section_name text,
+    shard_file text NOT NULL,
+    shard_row integer NOT NULL,
+    byte_offset integer,
+    byte_length integer)
+    """, """
+    CREATE TABLE IF NOT EXISTS stage_timings (
+    id integer PRIMARY KEY,
+    batch_number integer NOT NULL,
+    sec_cik text,
+    sec_accession_number text,
+    stage text NOT NULL,
+    wall_time real,
+    cpu_time real,
+    n_bytes integer,
+    process_id integer,
+    end_time real)
+    """, """
+    CREATE TABLE IF NOT EXISTS filing_memory (
+    id integer PRIMARY KEY,
+    batch_number integer NOT NULL,
+    sec_cik text,
+    sec_accession_number text,
+    submission_size integer,
+    html_bytes integer,
+    txt_bytes integer,
+    memory_estimate integer,
+    base_rss integer,
+    peak_rss integer,
+    process_id integer,
+    end_time real)
+    """, """
+    CREATE TABLE IF NOT EXISTS completion_ledger (
+    sec_accession_number text NOT NULL,
+    document_group text NOT NULL,
+    section_name text NOT NULL,
+    status text NOT NULL,
+    batch_number integer,
+    output_file text,
+    completed_time real,
+    PRIMARY KEY (sec_accession_number, document_group, section_name))
+    """, """
+    CREATE TABLE IF NOT EXISTS content_hashes (
+    content_hash text NOT NULL,
+    document_group text NOT NULL,
+    section_name text NOT NULL,
+    status text NOT NULL,
+    sec_accession_number text,
+    output_file text,
+    section_n_characters integer,
+    start_line text,
+    end_line text,
+    batch_number integer,
+    recorded_time real,
+    PRIMARY KEY (content_hash, document_group, section_name))
+    """, """
+    CREATE TABLE IF NOT EXISTS feed_watermark (
+    feed_name text PRIMARY KEY,
+    last_date integer NOT NULL,
+    batch_number integer,
+    updated_time real)
+    """]
+
+
+class Runtime(object):
+    """State of a batch run: the metadata database, the batch number and
+    storage folder, and logging.
+
+    Nothing is set up until start() is called, in the main process. Pool
+    workers are given a copy of the Runtime by init_worker(); each process
+    opens its own connection to the database when it first needs one.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.batch_number = 0
+        self.batch_start_time = datetime.datetime.utcnow()
+        self.batch_machine_id = socket.gethostname()
+        self.db_location = path.join(config.storage, 'metadata.sqlite3') \
+            if config.write_sql else None
+        self.schema_versions = None
+        self.storage_toplevel_directory = None
+        self.log_path = None
+        self.log_queue = None
+        self.log_listener = None
+        self.metrics_handler = None
+        # this process's connections, by thread
+        self._sql_connections = None
+        self._sql_connection_pid = None
+
+    def __getstate__(self):
+        # the connection, log queue and listener belong to the main process
+        state = self.__dict__.copy()
+        for key in ['log_queue', 'log_listener', 'metrics_handler',
+                    '_sql_connections', '_sql_connection_pid']:
+            state[key] = None
+        return state
+
+    @property
+    def sql_connection(self):
+        """Connection to the metadata database, opened on first use in
+        each process and thread. A connection cannot be shared with forked
+        workers, nor with the worker pool's callbacks, which run in the
+        pool's own thread to record failed filings: their transactions
+        would interleave with the main thread's.
+        """
+        if self._sql_connection_pid != os.getpid():
+            self._sql_connections = {}
+            self._sql_connection_pid = os.getpid()
+        thread_id = threading.get_ident()
+        if thread_id not in self._sql_connections:
+            # closed by close(), in the main thread
+            self._sql_connections[thread_id] = sqlite3.connect(
+                self.db_location, timeout=60, check_same_thread=False)
+        return self._sql_connections[thread_id]
+
+    def start(self):
+        """Set up the batch run: reserve a batch number in the metadata
+        database, (re-)make the batch's storage folder and start logging.
+        With --resume, the batch being resumed and its folder are used
+        instead (see resume_batch_number()).
+        :raises ValueError: if the batch to resume does not exist, or is
+        still running
+        The Runtime becomes the current one, see get_runtime().
+
+        :return: self
+        """
+        global _current_runtime
+        os.makedirs(self.config.storage, exist_ok=True)
+        if self.config.write_sql:
+            connection = self.sql_connection
+            for create_table in TABLES:
+                connection.execute(create_table)
+            connection.commit()
+            self.schema_versions = migrate(connection)
+            if self.config.resume:
+                self.batch_number = self.resume_batch_number()
+            if not self.batch_number:
+                self.batch_number = self.reserve_batch_number()
+
+        self.storage_toplevel_directory = path.join(
+            self.config.storage, 'batch_' + format(self.batch_number, '04d'))
+        if self.config.resume:
+            # keep the output already saved by the batch
+            os.makedirs(self.storage_toplevel_directory, exist_ok=True)
+        else:
+            # (re-)make the storage directory for the current batch. This
+            # will delete any contents that might be left over from earlier
+            # runs, thus avoiding any potential duplication/overlap/confusion
+            if path.exists(self.storage_toplevel_directory):
+                shutil.rmtree(self.storage_toplevel_directory)
+            os.makedirs(self.storage_toplevel_directory)
+
+        self.start_logging()
+        _current_runtime = self
+        self.log_settings()
+        return self
+
+    def reserve_batch_number(self):
+        """Take the next batch number, putting a dummy line into the
+        metadata table to 'reserve' it: prevents other processes running
+        in parallel from taking the same batch_number
+        """
+        connection = self.sql_connection
+        # BEGIN IMMEDIATE takes the database's write lock before reading,
+        # so two batches starting together cannot read the same maximum
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            query_result = connection.execute(
+                'SELECT max(batch_number) FROM metadata').fetchone()
+            batch_number = (query_result[0] or 0) + 1
+            connection.execute("""
+                INSERT INTO metadata (batch_number, batch_signature,
+                batch_start_time, batch_machine_id, sec_cik)
+                VALUES (?, ?, ?, ?, ?)""",
+                               (batch_number,
+                                str(self.config.batch_signature or ''),
+                                # take only 3dp microseconds
+                                str(self.batch_start_time)[:-3],
+                                self.batch_machine_id, 'dummy_cik_code'))
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        return batch_number
+
+    def latest_batch_number(self):
+        """Number of the most recent batch started on this machine, or 0
+        if there is none
+        """
+        query_result = self.sql_connection.execute(
+            'SELECT max(batch_number) FROM metadata '
+            'WHERE batch_machine_id = ?', (self.batch_machine_id,)).fetchone()
+        return query_result[0] or 0
+
+    def resume_batch_number(self):
+        """Number of the batch to resume: the one given with --resume, or
+        this machine's latest batch (0 if there is none, to start a new
+        one). Other machines' batches, which may still be running, are
+        only resumed if given explicitly.
+
+        :raises ValueError: if the given batch does not exist, or if the
+        batch holds unexpired work queue leases, i.e. is still running
+        """
+        connection = self.sql_connection
+        if self.config.resume == 'latest':
+            batch_number = self.latest_batch_number()
+        else:
+            batch_number = self.config.resume
+            if not connection.execute(
+                    'SELECT 1 FROM metadata WHERE batch_number = ? LIMIT 1',
+                    (batch_number,)).fetchone():
+                raise ValueError('No batch %i to resume' % batch_number)
+        has_work_queue = connection.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' "
+            "AND name = 'work_queue'").fetchone()
+        if batch_number and has_work_queue:
+            n_leases = connection.execute(
+                "SELECT count(*) FROM work_queue WHERE batch_number = ? "
+                "AND status = 'leased' AND lease_expires >= ?",
+                (batch_number, time.time())).fetchone()[0]
+            if n_leases:
+                raise ValueError(
+                    'Batch %i is still running: it holds %i work queue '
+                    'leases. Resume it once they have expired.' %
+                    (batch_number, n_leases))
+        return batch_number
+
+    def start_logging(self):
+        """Set up the log file, console, structured (.jsonl) and metrics
+        handlers, fed by a listener thread from the log queue
+        """
+        log_file_name = 'secedgartext_batch_%s.log' % \
+            format(self.batch_number, '04d')
+        self.log_path = path.join(self.config.storage, log_file_name)
+
+        # we have to initialise this top-level setting otherwise everything
+        # defaults to logging.WARN level
+        logger.setLevel(logging.DEBUG)
+        formatter = logging.Formatter(
+            '%(asctime)s %(levelname)s (%(process)d) %(message)s',
+            '%Y%m%d %H:%M:%S')
+
+        file_handler = logging.FileHandler(self.log_path)
+        file_handler.setFormatter(formatter)
+        file_handler.setLevel(logging.DEBUG)
+        file_handler.set_name('my_file_handler')
+
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(formatter)
+        console_handler.setLevel(logging.DEBUG)
+        console_handler.set_name('my_console_handler')
+
+        # structured log: one JSON object per line, with cik and accession
+        # fields for each message, and stage and duration fields for each
+        # filing's timing summary (see timing.log_filing_timings)
+        structured_handler = logging.FileHandler(
+            path.splitext(self.log_path)[0] + '.jsonl')
+        structured_handler.setFormatter(
+            JsonLinesFormatter(datefmt='%Y%m%d %H:%M:%S'))
+        structured_handler.setLevel(logging.DEBUG)
+        structured_handler.set_name('my_structured_handler')
+
+        # every process (including pool workers) puts its log records on
+        # log_queue. A listener thread in the main process writes them out
+        # as they arrive
+        self.log_queue = mp.Queue()
+        logger.addHandler(queue_handler(self.log_queue))
+        # per-stage timings (see timing.timed_stage) arrive with each
+        # filing's timing summary record, for the stage_timings table and
+        # the Prometheus textfile
+        self.metrics_handler = MetricsHandler(self.batch_number,
+                                              self.db_location,
+                                              self.config.metrics_file,
+                                              self.config.metrics_interval)
+        self.log_listener = QueueListener(self.log_queue, file_handler,
+                                          console_handler,
+                                          structured_handler,
+                                          self.metrics_handler,
+                                          respect_handler_level=True)
+        self.log_listener.start()
+        atexit.register(self.metrics_handler.close)
+        atexit.register(self.log_listener.stop)
+
+    def log_settings(self):
+        config = self.config
+        ts = time.time()
+        logger.info('=' * 65)
+        logger.info('Analysis started at {0}'.
+                    format(datetime.datetime.fromtimestamp(ts).
+                           strftime('%Y%m%d %H:%M:%S')))
+        logger.info('Command line:\t{0}'.format(sys.argv[0]))
+        logger.info('Arguments:\t\t{0}'.format(' '.join(sys.argv[:])))
+        logger.info('=' * 65)
+        if config.write_sql:
+            logger.info('Opened SQL connection: %s', self.db_location)
+            if self.schema_versions and \
+                    self.schema_versions[0] != self.schema_versions[1]:
+                logger.info('Upgraded the metadata database from schema '
+                            'version %i to %i' % self.schema_versions)
+        logger.info('Traffic Limit Pause (ms): %s' %
+                    str(config.traffic_limit_pause_ms))
+        logger.info('Output format: %s' % config.output_format)
+        if config.profile:
+            logger.info('Profiling %i%% of filings; slow filing threshold: '
+                        '%ss' % (round(100 * config.profile_sample),
+                                 config.slow_filing_seconds))
+        logger.info('Compression: %s' % config.compression)
+        if config.feed:
+            logger.info('Feed mode: %s', config.feed)
+        if config.multiprocessing_cores:
+            logger.info('Scheduling: largest filing first, window %i%s',
+                        config.schedule_window,
+                        '; oversized lane from %s MB' % config.oversized_mb
+                        if config.oversized_mb else '')
+        if config.dedup:
+            logger.info('Deduplication: documents seen before are saved as '
+                        'duplicates')
+        if config.fulltext_index:
+            logger.info('Full-text index: sections are indexed at the end of '
+                        'the batch')
+        if config.resume:
+            logger.info('Resuming batch %i: skipping completed filings',
+                        self.batch_number)
+
+    def flush_log_queue(self):
+        """Wait until the listener has handled every record already queued
+
+        Stopping the listener processes all the records in the queue; it is
+        then restarted for any further logging.
+        """
+        self.log_listener.stop()
+        self.log_listener.start()
+
+    def close(self):
+        """Close this process's database connections, once its other
+        threads have finished with them
+        """
+        if self._sql_connections and \
+                self._sql_connection_pid == os.getpid():
+            for connection in self._sql_connections.values():
+                connection.close()
+        self._sql_connections = None
+        self._sql_connection_pid = None
+
+
+def get_runtime(required=True):
+    """The Runtime of the current process
+
+    :param required: if no Runtime has been started, raise RuntimeError if
+    True, otherwise return None
+    """
+    if _current_runtime is None and required:
+        raise RuntimeError('No batch run has been started in this process: '
+                           'see Runtime.start()')
+    return _current_runtime
+
+
+def init_worker(runtime, log_queue):
+    """Pool worker initializer: make runtime the worker's current Runtime,
+    and send all the worker's log records to the main process's log queue
+    """
+    global _current_runtime
+    runtime.log_queue = log_queue
+    _current_runtime = runtime
+    init_worker_logging(logger.name, log_queue)
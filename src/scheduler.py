@@ -0,0 +1,158 @@
+"""
+    secedgartext: extract text from SEC corporate filings
+    Copyright (C) 2017  Alexander Ions
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Size-aware scheduling of filings on the worker pool. Filing sizes vary
+from a few KB to hundreds of MB. Sent to the pool in listing order, a few
+very large filings that come late keep one worker busy long after the
+others have finished. Instead, tasks are held in a look-ahead window, and
+each time a worker is free it is given the largest task waiting (longest
+processing time first). Optionally, very large tasks go to a separate lane
+of their own, so they never hold up the ordinary ones.
+
+With a memory budget, a task is only started if its estimated footprint
+(see memory.MemoryModel) fits in the budget left by the tasks in
+progress. Otherwise it is held, and no other task in its lane is started
+before it, until enough tasks have finished. A task is always started if
+none are in progress, however large its estimate.
+"""
+import heapq
+import itertools
+import threading
+
+from .memory import MB
+from .utils import logger
+
+
+class Lane(object):
+    """A pool, its waiting tasks (largest first) and its tasks in progress
+    """
+
+    def __init__(self, pool, processes):
+        self.pool = pool
+        self.processes = processes
+        self.waiting = []
+        self.n_running = 0
+
+
+class SizeAwareScheduler(object):
+    """Sends tasks to a multiprocessing pool, largest first, one per free
+    worker.
+
+    submit() holds up to window tasks at a time; beyond that, it waits
+    until a task can be sent to a worker. Tasks of unknown size are taken
+    to be small.
+    """
+
+    def __init__(self, pool, processes, window=None, oversized_bytes=None,
+                 oversized_pool=None, oversized_processes=1,
+                 memory_budget=None):
+        """
+        :param pool: multiprocessing Pool
+        :param processes: number of worker processes in pool
+        :param window: maximum number of tasks held waiting (default:
+        4 per worker process). The window should be large enough to hold the
+        largest tasks while the smaller ones are in progress.
+        :param oversized_bytes: tasks of at least this size go to
+        oversized_pool (default: no separate lane)
+        :param oversized_pool: Pool for the oversized lane
+        :param oversized_processes: number of worker processes in
+        oversized_pool
+        :param memory_budget: memory (bytes) shared by the tasks in
+        progress, in all lanes (default: no limit)
+        """
+        self.lane = Lane(pool, processes)
+        self.oversized_lane = Lane(oversized_pool, oversized_processes) \
+            if oversized_bytes and oversized_pool else None
+        self.oversized_bytes = oversized_bytes
+        self.window = window or 4 * processes
+        self.memory_budget = memory_budget
+        self.memory_in_use = 0
+        # sequence number of the task last reported as held for memory
+        self.held_sequence = None
+        self.sequence = itertools.count()
+        # callbacks are run by the pools' result handler threads
+        self.condition = threading.Condition()
+
+    def lanes(self):
+        return [lane for lane in [self.lane, self.oversized_lane] if lane]
+
+    def n_waiting(self):
+        return sum(len(lane.waiting) for lane in self.lanes())
+
+    def n_running(self):
+        return sum(lane.n_running for lane in self.lanes())
+
+    def submit(self, size, function, args=(), callback=None,
+               error_callback=None, footprint=None):
+        """Add a task, as for Pool.apply_async
+
+        :param size: size of the task's input (e.g. bytes), or None
+        :param footprint: estimated peak memory of the task (bytes), or
+        None if unknown
+        """
+        lane = self.lane
+        if self.oversized_lane and size and size >= self.oversized_bytes:
+            lane = self.oversized_lane
+        with self.condition:
+            while self.n_waiting() >= self.window:
+                self.condition.wait()
+            # heapq is a min-heap: the largest task comes first, then the
+            # earliest submitted of tasks the same size
+            heapq.heappush(lane.waiting,
+                           (-(size or 0), next(self.sequence), footprint or 0,
+                            function, args, callback, error_callback))
+            self._dispatch(lane)
+
+    def _admit(self, footprint, sequence):
+        # called with self.condition held
+        if not self.memory_budget or not self.n_running() or \
+                self.memory_in_use + footprint <= self.memory_budget:
+            return True
+        if self.held_sequence != sequence:
+            self.held_sequence = sequence
+            logger.debug('Holding a task with an estimated %.0f MB until '
+                         'memory is free: %.0f of %.0f MB in use',
+                         footprint / MB, self.memory_in_use / MB,
+                         self.memory_budget / MB)
+        return False
+
+    def _dispatch(self, lane):
+        # called with self.condition held
+        while lane.waiting and lane.n_running < lane.processes and \
+                self._admit(lane.waiting[0][2], lane.waiting[0][1]):
+            size, sequence, footprint, function, args, callback, \
+                error_callback = heapq.heappop(lane.waiting)
+            lane.n_running += 1
+            self.memory_in_use += footprint
+            lane.pool.apply_async(
+                function, args,
+                callback=self._finished(lane, footprint, callback),
+                error_callback=self._finished(lane, footprint,
+                                              error_callback))
+        self.condition.notify_all()
+
+    def _finished(self, lane, footprint, callback):
+        def finished(result):
+            try:
+                if callback:
+                    callback(result)
+            finally:
+                with self.condition:
+                    lane.n_running -= 1
+                    self.memory_in_use -= footprint
+                    # the memory freed may let a task start in either lane
+                    for each_lane in self.lanes():
+                        self._dispatch(each_lane)
+        return finished
+
+    def wait(self):
+        """Wait until every task submitted has finished
+        """
+        with self.condition:
+            while any(lane.waiting or lane.n_running
+                      for lane in self.lanes()):
+                self.condition.wait()
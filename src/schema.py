@@ -0,0 +1,65 @@
+"""
+    secedgartext: extract text from SEC corporate filings
+    Copyright (C) 2017  Alexander Ions
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Schema versions of the metadata database. The tables themselves are
+created by Runtime.start() (see runtime.TABLES), with CREATE TABLE IF NOT
+EXISTS. Changes to a database made by earlier versions of the program,
+such as indexes on tables which already hold years of batches, are made
+here by migrations. The database's schema version is kept in SQLite's
+user_version pragma: 0 for a database which predates versioning.
+"""
+import sqlite3
+
+# MIGRATIONS[i] takes a database from schema version i to i + 1
+MIGRATIONS = [
+    # indexes for the startup query (max(batch_number)) and for queries by
+    # company, period and section, see queries.py
+    ["""CREATE INDEX IF NOT EXISTS metadata_batch_number
+        ON metadata (batch_number)""",
+     """CREATE INDEX IF NOT EXISTS metadata_cik_section
+        ON metadata (sec_cik, section_name, sec_period_of_report)""",
+     """CREATE INDEX IF NOT EXISTS metadata_section_period
+        ON metadata (section_name, sec_period_of_report)""",
+     """CREATE INDEX IF NOT EXISTS shard_index_shard_file
+        ON shard_index (shard_file)""",
+     """CREATE INDEX IF NOT EXISTS stage_timings_batch_number
+        ON stage_timings (batch_number)"""],
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def schema_version(connection):
+    return connection.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(connection):
+    """Bring the database up to SCHEMA_VERSION, applying the migrations it
+    has not had, in one transaction. Several processes starting together
+    cannot both apply them: the write lock is taken before the version is
+    read.
+
+    :return: (version before, version after)
+    """
+    version = schema_version(connection)
+    if version >= SCHEMA_VERSION:
+        return version, version
+    connection.execute('BEGIN IMMEDIATE')
+    try:
+        version = schema_version(connection)
+        start_version = version
+        for migration in MIGRATIONS[version:]:
+            for statement in migration:
+                connection.execute(statement)
+            version += 1
+        # PRAGMA does not take parameters
+        connection.execute('PRAGMA user_version = %i' % version)
+        connection.commit()
+    except sqlite3.Error:
+        connection.rollback()
+        raise
+    return start_version, version
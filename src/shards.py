@@ -0,0 +1,199 @@
+"""
+    secedgartext: extract text from SEC corporate filings
+    Copyright (C) 2017  Alexander Ions
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import json
+import os
+import socket
+from multiprocessing.util import Finalize
+
+from .runtime import get_runtime
+from .compression import compress_bytes, decompress_bytes
+
+
+# one writer per process: pool workers each append to their own shards, so
+# no locking is needed between processes writing to the same directory
+_writers = {}
+
+
+class ShardWriter(object):
+    """Append excerpts and their metadata to rolling shard files.
+
+    Instead of one _excerpt.txt and one _metadata.json file per section,
+    each section becomes one record in a shard file. A new shard is started
+    after every shard_size records. Every record is also indexed in the
+    shard_index table, mapping (cik, period, document group, section) to the
+    shard file and the position of the record inside it.
+
+    jsonl shards are written as one gzip member (or zstd frame, with
+    --compression=zstd) per record, so that a record can be read back by
+    seeking straight to its byte offset.
+    parquet shards are buffered in memory and written when the shard
+    is complete (or when the process exits). Until then, nothing is recorded
+    in the database for their sections (see when_written()), so a worker
+    which is killed with sections still buffered leaves them to be extracted
+    again with --resume.
+    """
+
+    def __init__(self, directory, output_format='jsonl', shard_size=10000,
+                 compression='gzip', run_id=''):
+        """
+        :param run_id: part of the shard names which is unique to the run,
+        so that a process of a later run (e.g. with --resume) with the same
+        pid cannot overwrite the shards of an earlier one
+        """
+        self.directory = directory
+        self.output_format = output_format
+        if output_format == 'parquet':
+            self.extension = '.parquet'
+        elif compression == 'zstd':
+            self.extension = '.jsonl.zst'
+        else:
+            self.extension = '.jsonl.gz'
+        self.compression = 'zstd' if compression == 'zstd' else 'gzip'
+        self.shard_size = shard_size
+        self.shard_number = 0
+        self.shard_path = None
+        self.n_records = 0
+        self.parquet_rows = []
+        # functions to run once the buffered parquet rows are written
+        self.pending = []
+        self.shard_prefix = '_'.join(['excerpts', socket.gethostname()] +
+                                     ([run_id] if run_id else []) +
+                                     [str(os.getpid())])
+        self._new_shard()
+
+    def _new_shard(self):
+        self.shard_number += 1
+        self.n_records = 0
+        self.shard_path = os.path.join(
+            self.directory, self.shard_prefix + '_' +
+            format(self.shard_number, '05d') + self.extension)
+
+    def append(self, metadata, text_extract):
+        """Append one section record to the current shard.
+
+        The metadata file name (and output file, if successful) of the
+        section are set to the shard path before the record is written
+        :param metadata: Metadata object for the section
+        :param text_extract: excerpt text, or None for a failed extraction
+        :return: path of the shard file holding the record
+        """
+        if self.n_records >= self.shard_size:
+            self.close()
+        metadata.metadata_file_name = self.shard_path
+        if text_extract:
+            metadata.output_file = self.shard_path
+        record = metadata.to_dict()
+        record['excerpt'] = text_extract
+        shard_row = self.n_records
+        if self.output_format == 'parquet':
+            self.parquet_rows.append(record)
+            byte_offset = byte_length = None
+        else:
+            member = compress_bytes(
+                (json.dumps(record, ensure_ascii=False) + '\n').
+                encode('utf-8'), self.compression)
+            with open(self.shard_path, 'ab') as shard_file:
+                byte_offset = shard_file.tell()
+                shard_file.write(member)
+            byte_length = len(member)
+        self.n_records += 1
+        if get_runtime().config.write_sql:
+            self.when_written(save_to_index, metadata, self.shard_path,
+                              shard_row, byte_offset, byte_length)
+        return self.shard_path
+
+    def when_written(self, function, *args):
+        """Run function(*args), which records sections appended to the
+        shard, once they are on disk: at once for jsonl shards, and for
+        parquet shards when the buffered rows are written by close()
+        """
+        if self.parquet_rows:
+            self.pending.append((function, args))
+        else:
+            function(*args)
+
+    def close(self):
+        """Write out any buffered parquet rows for the current shard. The
+        shard is finished: the next record starts a new one.
+        """
+        if self.output_format == 'parquet' and self.parquet_rows:
+            import pyarrow
+            import pyarrow.parquet
+            # warnings and endpoints are lists: store them as JSON text so
+            # that every column has a simple, consistent type
+            columns = {}
+            for key in self.parquet_rows[0]:
+                values = [r.get(key) for r in self.parquet_rows]
+                if any(isinstance(v, (list, dict)) for v in values):
+                    values = [json.dumps(v) for v in values]
+                elif key != 'excerpt':
+                    values = [None if v is None else str(v) for v in values]
+                columns[key] = values
+            # written under a temporary name, so that a process killed
+            # while writing does not leave a truncated shard
+            temporary_path = self.shard_path + '.tmp'
+            pyarrow.parquet.write_table(pyarrow.table(columns),
+                                        temporary_path)
+            os.replace(temporary_path, self.shard_path)
+            self.parquet_rows = []
+        if self.n_records:
+            self._new_shard()
+        pending, self.pending = self.pending, []
+        for function, args in pending:
+            function(*args)
+
+
+def get_shard_writer():
+    """Return the shard writer for the current process, creating it if needed
+    """
+    pid = os.getpid()
+    if pid not in _writers:
+        runtime = get_runtime()
+        writer = ShardWriter(runtime.storage_toplevel_directory,
+                             runtime.config.output_format,
+                             runtime.config.shard_size,
+                             runtime.config.compression,
+                             runtime.batch_start_time.strftime(
+                                 '%Y%m%d%H%M%S'))
+        # make sure buffered rows are written when a pool worker (or the
+        # main process) shuts down
+        Finalize(writer, writer.close, exitpriority=10)
+        _writers[pid] = writer
+    return _writers[pid]
+
+
+def save_to_index(metadata, shard_path, shard_row, byte_offset, byte_length):
+    """Record the position of one section record in the shard_index table
+    """
+    runtime = get_runtime()
+    runtime.sql_connection.execute("""
+        INSERT INTO shard_index (batch_number, sec_cik, sec_period_of_report,
+        document_group, section_name, shard_file, shard_row, byte_offset,
+        byte_length) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                                   (runtime.batch_number, metadata.sec_cik,
+                                    metadata.sec_period_of_report,
+                                    metadata.document_group,
+                                    metadata.section_name, shard_path,
+                                    shard_row, byte_offset, byte_length))
+    runtime.sql_connection.commit()
+
+
+def read_shard_record(shard_file, shard_row, byte_offset=None,
+                      byte_length=None):
+    """Read back one section record, as located by the shard_index table.
+
+    :return: dict of the metadata fields, plus the 'excerpt' text
+    """
+    if shard_file.endswith('.parquet'):
+        import pyarrow.parquet
+        table = pyarrow.parquet.read_table(shard_file)
+        return table.slice(shard_row, 1).to_pylist()[0]
+    with open(shard_file, 'rb') as f:
+        f.seek(byte_offset)
+        member = f.read(byte_length)
+    return json.loads(decompress_bytes(member).decode('utf-8'))
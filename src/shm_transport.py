@@ -0,0 +1,139 @@
+"""
+    secedgartext: extract text from SEC corporate filings
+    Copyright (C) 2017  Alexander Ions
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Hand-off of large buffers (downloaded submissions) from the main process to
+pool workers through shared memory. The main process writes each buffer
+once, into a shared memory block; a task sent to a worker carries only a
+BufferHandle, a few dozen bytes, instead of the pickled buffer. The main
+process counts the references to each block, and frees it when the last
+task using it has finished.
+"""
+import threading
+from multiprocessing import shared_memory
+
+
+class BufferHandle(object):
+    """Reference to a buffer in a shared memory block: this is what is
+    pickled and sent to the worker
+    """
+    __slots__ = ['name', 'offset', 'length', 'charset']
+
+    def __init__(self, name, offset, length, charset=None):
+        """
+        :param name: name of the shared memory block
+        :param offset: start of the buffer in the block
+        :param length: length of the buffer, in bytes
+        :param charset: charset declared for the buffer's content, if any
+        """
+        self.name = name
+        self.offset = offset
+        self.length = length
+        self.charset = charset
+
+    def __getstate__(self):
+        return self.name, self.offset, self.length, self.charset
+
+    def __setstate__(self, state):
+        self.name, self.offset, self.length, self.charset = state
+
+
+def attach(name):
+    """Open an existing shared memory block, created by the main process.
+    The block is not tracked by this process: the main process frees it.
+    """
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        # before Python 3.13, opening a block registers it with the resource
+        # tracker. Pool workers share the main process's tracker, which
+        # already holds the block, so this has no effect
+        return shared_memory.SharedMemory(name)
+
+
+def read_buffer(handle):
+    """Copy of the buffer referenced by handle, in a worker process
+    """
+    block = attach(handle.name)
+    try:
+        return bytes(block.buf[handle.offset:handle.offset + handle.length])
+    finally:
+        block.close()
+
+
+class SharedMemoryTransport(object):
+    """The main process's side: creates a shared memory block for each
+    buffer, and frees it once all its references have been released.
+
+    At most max_buffers blocks are held at a time: put() waits until a
+    block is freed, so that the producer cannot run far ahead of the
+    workers.
+    """
+
+    def __init__(self, max_buffers=None):
+        """
+        :param max_buffers: maximum number of buffers held at a time
+        (default: no limit)
+        """
+        self.max_buffers = max_buffers
+        self.blocks = {}
+        self.ref_counts = {}
+        self.bytes_held = 0
+        # release() is called by the pool's result handler thread
+        self.condition = threading.Condition()
+
+    def put(self, data, charset=None, n_refs=1):
+        """Copy data into a new shared memory block
+
+        :param data: bytes
+        :param charset: charset declared for data, passed on in the handle
+        :param n_refs: number of tasks that will use the buffer, each of
+        which must release() it
+        :return: BufferHandle
+        """
+        with self.condition:
+            while self.max_buffers and len(self.blocks) >= self.max_buffers:
+                self.condition.wait()
+            # a block cannot be empty
+            block = shared_memory.SharedMemory(create=True,
+                                               size=max(1, len(data)))
+            block.buf[:len(data)] = data
+            self.blocks[block.name] = block
+            self.ref_counts[block.name] = n_refs
+            self.bytes_held += len(data)
+        return BufferHandle(block.name, 0, len(data), charset)
+
+    def acquire(self, handle):
+        """Add a reference to the buffer
+        """
+        with self.condition:
+            self.ref_counts[handle.name] += 1
+
+    def release(self, handle):
+        """Drop a reference to the buffer, freeing its block if it was the
+        last one
+        """
+        with self.condition:
+            self.ref_counts[handle.name] -= 1
+            if self.ref_counts[handle.name] <= 0:
+                self._free(handle.name)
+                self.bytes_held -= handle.length
+                self.condition.notify_all()
+
+    def _free(self, name):
+        del self.ref_counts[name]
+        block = self.blocks.pop(name)
+        block.close()
+        block.unlink()
+
+    def close(self):
+        """Free every block still held, whatever its references
+        """
+        with self.condition:
+            for name in list(self.blocks):
+                self._free(name)
+            self.bytes_held = 0
+            self.condition.notify_all()
@@ -0,0 +1,52 @@
+"""
+    secedgartext: extract text from SEC corporate filings
+    Copyright (C) 2017  Alexander Ions
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import hashlib
+import os
+import re
+
+# each level of sub-directories uses 2 hex digits, i.e. 256-way fan-out
+HASH_DIGITS_PER_LEVEL = 2
+
+
+def accession_number(url):
+    """Find the EDGAR accession number (e.g. 0000354950-16-000055) in the
+    URL of a filing index page or submission text file.
+
+    :param url: EDGAR URL
+    :return: accession number string, or '' if none was found
+    """
+    srch = re.search(r'\d{10}-\d{2}-\d{6}', url or '')
+    if srch:
+        return srch.group()
+    # some URLs give the accession number without hyphens
+    srch = re.search(r'/(\d{10})(\d{2})(\d{6})(?:/|$)', url or '')
+    if srch:
+        return '-'.join(srch.groups())
+    return ''
+
+
+def storage_subdirectory(storage_root, key, levels=2):
+    """Deterministic storage sub-directory for a filing.
+
+    The directory is chosen from a hash of key (normally the accession
+    number), giving a fan-out of 256 directories per level. No directory
+    listing is needed, so parallel processes, and separate machines writing
+    to the same storage root, always agree on where a filing belongs.
+
+    :param storage_root: top-level directory of the batch
+    :param key: text identifying the filing
+    :param levels: number of levels of sub-directories
+    :return: path of the sub-directory. It is not created here: only
+    callers which write files in it should create it (with
+    os.makedirs(path, exist_ok=True), as another process may create the
+    same directory concurrently).
+    """
+    digest = hashlib.md5(key.encode('utf-8')).hexdigest()
+    parts = [digest[i * HASH_DIGITS_PER_LEVEL:(i + 1) * HASH_DIGITS_PER_LEVEL]
+             for i in range(levels)]
+    return os.path.join(storage_root, *parts)
@@ -0,0 +1,186 @@
+"""
+    secedgartext: extract text from SEC corporate filings
+    Copyright (C) 2017  Alexander Ions
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Local resolution of tickers and company names to CIK codes, from SEC's
+company_tickers.json file. The companies list can then give tickers: they
+are all resolved before the crawl starts, with no EDGAR query for each one,
+and any that cannot be resolved are reported up front.
+"""
+import json
+import os
+import re
+from os import path
+
+from .config import project_dir
+from .runtime import get_runtime
+from .utils import logger, requests_get
+
+TICKERS_FILE_NAME = 'company_tickers.json'
+
+# words dropped from the end of company names before they are compared
+NAME_SUFFIXES = {'INC', 'INCORPORATED', 'CORP', 'CORPORATION', 'CO',
+                 'COMPANY', 'LTD', 'LIMITED', 'PLC', 'LLC', 'LP', 'NV', 'SA',
+                 'AG', 'HOLDINGS', 'HOLDING', 'GROUP', 'THE', 'DE', 'NEW'}
+
+
+def normalise_ticker(ticker):
+    """Ticker in SEC's form: upper case, with '-' for a share class
+    separator, e.g. brk.b -> BRK-B
+    """
+    return re.sub(r'[./ ]', '-', str(ticker).strip().upper())
+
+
+def normalise_name(name):
+    """Company name reduced for comparison: upper case, punctuation removed
+    and legal-form suffixes dropped, e.g. 'Apple Inc.' -> 'APPLE'
+    """
+    words = re.sub(r'[^A-Z0-9& ]', ' ',
+                   str(name).upper().replace("'", '')).split()
+    while len(words) > 1 and words[-1] in NAME_SUFFIXES:
+        words.pop()
+    return ' '.join(words)
+
+
+def is_cik(key):
+    return str(key).strip().isdigit()
+
+
+class TickerIndex(object):
+    """Lookup of CIK codes (10-digit strings) by ticker and company name
+    """
+
+    def __init__(self, entries=()):
+        """
+        :param entries: iterable of (cik, ticker, company name)
+        """
+        self.ciks_by_ticker = {}
+        self.ciks_by_name = {}
+        self.names_by_cik = {}
+        for cik, ticker, name in entries:
+            cik = str(cik).zfill(10)
+            self.ciks_by_ticker.setdefault(normalise_ticker(ticker), cik)
+            self.ciks_by_name.setdefault(normalise_name(name), cik)
+            self.names_by_cik.setdefault(cik, name)
+
+    def __len__(self):
+        return len(self.ciks_by_ticker)
+
+    @classmethod
+    def from_json(cls, data):
+        """Index from the content of company_tickers.json ({"0": {"cik_str":
+        320193, "ticker": "AAPL", "title": "Apple Inc."}, ...}) or of
+        company_tickers_exchange.json ({"fields": [...], "data": [...]})
+        """
+        if 'fields' in data and 'data' in data:
+            fields = data['fields']
+            return cls((row[fields.index('cik')], row[fields.index('ticker')],
+                        row[fields.index('name')]) for row in data['data'])
+        return cls((entry['cik_str'], entry['ticker'], entry['title'])
+                   for entry in data.values())
+
+    def lookup_ticker(self, ticker):
+        return self.ciks_by_ticker.get(normalise_ticker(ticker))
+
+    def lookup_name(self, name):
+        return self.ciks_by_name.get(normalise_name(name))
+
+    def resolve(self, key):
+        """CIK for a companies list entry: a CIK code, ticker or company
+        name
+
+        :return: 10-digit CIK string, or None if key cannot be resolved
+        """
+        key = str(key).strip()
+        if is_cik(key):
+            return key.zfill(10)
+        return self.lookup_ticker(key) or self.lookup_name(key)
+
+    def resolve_companies(self, companies):
+        """Resolve a whole companies list
+
+        :param companies: list of [EDGAR search string (CIK code, ticker
+        or company name), company description]
+        :return: (resolved, unresolved): the companies list with CIK codes
+        in place of tickers and names, and the entries that could not be
+        resolved
+        """
+        resolved = []
+        unresolved = []
+        for company_keys in companies:
+            cik = self.resolve(company_keys[0])
+            if cik:
+                resolved.append([cik] + list(company_keys[1:]))
+            else:
+                unresolved.append(company_keys)
+        return resolved, unresolved
+
+
+def load_ticker_index(location=None):
+    """Load the ticker index
+
+    :param location: path or URL of company_tickers.json. The default
+    (--tickers_file) is the copy in the storage folder, which is downloaded
+    from the EDGAR website if there is none.
+    """
+    config = get_runtime().config
+    location = location or config.tickers_file
+    if not location:
+        location = path.join(config.storage, TICKERS_FILE_NAME)
+        if not path.exists(location):
+            r = requests_get(config.edgar_url + 'files/' + TICKERS_FILE_NAME)
+            r.raise_for_status()
+            temp_path = location + '.%i.tmp' % os.getpid()
+            with open(temp_path, 'wb') as f:
+                f.write(r.content)
+            os.replace(temp_path, location)
+            logger.info('Downloaded ticker index: %s', location)
+    if re.match(r'https?://', location):
+        r = requests_get(location)
+        r.raise_for_status()
+        data = r.json()
+    else:
+        if not path.isabs(location):
+            location = path.join(project_dir, location)
+        with open(location, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    return TickerIndex.from_json(data)
+
+
+def validate_companies(companies):
+    """Pre-validate a companies list before crawling: resolve any tickers
+    and company names to CIK codes, and report the entries that cannot be
+    resolved. The ticker index is only loaded if it is needed.
+
+    :param companies: list of [EDGAR search string (CIK code, ticker or
+    company name), company description]
+    :return: the companies that were resolved, with CIK codes. If the
+    ticker index cannot be loaded, the entries not giving CIK codes are
+    returned unchanged, for EDGAR's company search to resolve.
+    """
+    if all(is_cik(company_keys[0]) for company_keys in companies):
+        return companies
+    try:
+        ticker_index = load_ticker_index()
+    except Exception as e:
+        unresolved = [company_keys for company_keys in companies
+                      if not is_cik(company_keys[0])]
+        logger.warning('Could not load the ticker index (%r): %i companies '
+                       'list entries are passed to EDGAR unresolved: %s', e,
+                       len(unresolved), ', '.join(str(company_keys[0])
+                                                  for company_keys in
+                                                  unresolved))
+        return companies
+    resolved, unresolved = ticker_index.resolve_companies(companies)
+    logger.info('Resolved the companies list with the ticker index (%i '
+                'tickers): %i of %i entries resolved', len(ticker_index),
+                len(resolved), len(companies))
+    if unresolved:
+        logger.warning('Could not resolve %i companies list entries, which '
+                       'are skipped: %s', len(unresolved),
+                       ', '.join(str(company_keys[0])
+                                 for company_keys in unresolved))
+    return resolved
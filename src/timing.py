@@ -0,0 +1,320 @@
+"""
+    secedgartext: extract text from SEC corporate filings
+    Copyright (C) 2017  Alexander Ions
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import contextvars
+import logging
+import math
+import os
+import random
+import sqlite3
+import time
+from contextlib import contextmanager
+
+# the program's logger, set up by runtime.Runtime (which in turn uses the
+# MetricsHandler below, so this module does not import utils)
+logger = logging.getLogger('text_analysis')
+
+STAGES = ['listing_fetch', 'index_fetch', 'submission_fetch', 'sgml_split',
+          'html_parse', 'table_removal', 'text_walk', 'section_regex',
+          'xbrl_parse', 'write', 'fulltext_index']
+
+# wall-clock times of each stage kept for its percentiles: a uniform
+# sample, once there are more runs than this
+RESERVOIR_SIZE = 10000
+
+# timings of the stages completed for the current filing, see
+# start_filing_timings()
+_filing_timings = contextvars.ContextVar('filing_timings', default=None)
+
+# timings of stages run outside a filing in a process with no
+# MetricsHandler (a pool worker): sent with the next filing's timings
+_unsent_timings = []
+
+# the MetricsHandler of the main process, see MetricsHandler.__init__()
+_metrics_handler = None
+
+
+@contextmanager
+def timed_stage(stage, n_bytes=0):
+    """Time a processing stage, in wall-clock and CPU seconds.
+
+    Within a filing (see start_filing_timings()), the timing is added to
+    the filing's timings, which log_filing_timings() sends to the
+    MetricsHandler in the main process, in one log record for the whole
+    filing. Outside a filing, it is recorded by the main process's
+    MetricsHandler directly.
+    :param stage: stage name, normally one of STAGES
+    :param n_bytes: size of the document (or page) being processed. If this
+    is only known later (e.g. for a download), set the 'n_bytes' item of
+    the dict returned by the context manager.
+    """
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    stage_info = {'n_bytes': n_bytes}
+    try:
+        yield stage_info
+    finally:
+        wall_time = time.perf_counter() - wall_start
+        cpu_time = time.process_time() - cpu_start
+        timing = {'stage': stage, 'wall_time': wall_time,
+                  'cpu_time': cpu_time, 'n_bytes': stage_info['n_bytes'],
+                  'end_time': time.time()}
+        timings = _filing_timings.get()
+        if timings is not None:
+            timings.append(timing)
+        elif _metrics_handler is not None and \
+                _metrics_handler.pid == os.getpid():
+            _metrics_handler.record_timings([timing])
+        else:
+            _unsent_timings.append(timing)
+
+
+def start_filing_timings():
+    """Start collecting the stage timings of the current filing
+
+    :return: list, to which each timed stage appends a dict
+    """
+    timings = []
+    _filing_timings.set(timings)
+    return timings
+
+
+def stop_filing_timings():
+    _filing_timings.set(None)
+
+
+def log_filing_timings(timings, wall_time):
+    """Log the total wall-clock time of each stage of a filing, in one
+    line. The record carries the filing's stage timings to the
+    MetricsHandler, and has the structured fields stage ('filing') and
+    duration (the filing's wall-clock seconds).
+    """
+    timings = _unsent_timings + timings
+    del _unsent_timings[:]
+    totals = {}
+    for timing in timings:
+        totals[timing['stage']] = \
+            totals.get(timing['stage'], 0.0) + timing['wall_time']
+    logger.debug('Stage times: %s', ', '.join(
+        '%s %.3fs' % (stage, totals[stage]) for stage in
+        STAGES + sorted(set(totals) - set(STAGES)) if stage in totals),
+                 extra={'stage': 'filing', 'duration': round(wall_time, 6),
+                        'stage_timings': timings})
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile (p in 0-100) of an already sorted list
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(math.ceil(p / 100 * len(sorted_values))))
+    return sorted_values[rank - 1]
+
+
+class MetricsHandler(logging.Handler):
+    """Collect stage timings (from each filing's timing summary record, see
+    log_filing_timings()), in the main process.
+
+    Each timing is saved to the stage_timings table of the metadata
+    database (in batches), as is the peak RSS of each filing (to the
+    filing_memory table, see memory.log_filing_memory()). Documents are
+    counted by deduplication outcome (see dedup.log_document_dedup()), and
+    the totals and percentiles for each stage are periodically written to a
+    Prometheus textfile (for collection by node_exporter's textfile
+    collector).
+    """
+
+    def __init__(self, batch_number, db_location=None, prometheus_path=None,
+                 interval=15, db_batch_size=500):
+        global _metrics_handler
+        super(MetricsHandler, self).__init__()
+        # stages timed outside a filing in this process are recorded here
+        # directly (not in forked workers, which inherit the reference)
+        self.pid = os.getpid()
+        _metrics_handler = self
+        self.batch_number = batch_number
+        self.db_location = db_location
+        self.prometheus_path = prometheus_path
+        self.interval = interval
+        self.db_batch_size = db_batch_size
+        self.stats = {}
+        self.rng = random.Random()
+        self.pending_rows = []
+        self.pending_memory_rows = []
+        # documents by deduplication outcome (see dedup.log_document_dedup)
+        self.dedup_counts = {}
+        self.dedup_sections = 0
+        self.last_write_time = time.time()
+        self.db_connection = None
+
+    def emit(self, record):
+        if hasattr(record, 'dedup'):
+            self.dedup_counts[record.dedup] = \
+                self.dedup_counts.get(record.dedup, 0) + 1
+            self.dedup_sections += record.dedup_sections
+            return
+        if hasattr(record, 'peak_rss'):
+            self.pending_memory_rows.append((
+                self.batch_number, getattr(record, 'cik', ''),
+                getattr(record, 'accession', ''), record.submission_size,
+                record.html_bytes, record.txt_bytes, record.memory_estimate,
+                record.base_rss, record.peak_rss, record.process,
+                record.created))
+            return
+        if hasattr(record, 'stage_timings'):
+            self.record_timings(record.stage_timings,
+                                getattr(record, 'cik', ''),
+                                getattr(record, 'accession', ''),
+                                record.process)
+
+    def record_timings(self, timings, cik='', accession='', process=None):
+        """Record stage timings (see timed_stage()), from the record of a
+        filing's timings or directly from the main process
+        """
+        self.acquire()
+        try:
+            for timing in timings:
+                self.record_timing(timing, cik, accession,
+                                   process or os.getpid())
+            if len(self.pending_rows) >= self.db_batch_size:
+                self.save_to_db()
+            if time.time() - self.last_write_time > self.interval:
+                self.write_prometheus()
+        finally:
+            self.release()
+
+    def record_timing(self, timing, cik, accession, process):
+        stage = timing['stage']
+        wall_time = round(timing['wall_time'], 6)
+        cpu_time = round(timing['cpu_time'], 6)
+        stats = self.stats.setdefault(stage, {'wall_times': [], 'runs': 0,
+                                              'wall_time': 0.0,
+                                              'cpu_time': 0.0,
+                                              'n_bytes': 0})
+        stats['runs'] += 1
+        stats['wall_time'] += wall_time
+        # reservoir sample of the wall-clock times, for the percentiles
+        if len(stats['wall_times']) < RESERVOIR_SIZE:
+            stats['wall_times'].append(wall_time)
+        else:
+            i = self.rng.randrange(stats['runs'])
+            if i < RESERVOIR_SIZE:
+                stats['wall_times'][i] = wall_time
+        stats['cpu_time'] += cpu_time
+        stats['n_bytes'] += timing['n_bytes']
+        self.pending_rows.append((self.batch_number, cik, accession, stage,
+                                  wall_time, cpu_time, timing['n_bytes'],
+                                  process, timing['end_time']))
+
+    def save_to_db(self):
+        if not (self.db_location and
+                (self.pending_rows or self.pending_memory_rows)):
+            return
+        if self.db_connection is None:
+            # the handler runs in the log listener thread, so it needs a
+            # connection of its own
+            self.db_connection = sqlite3.connect(self.db_location,
+                                                 check_same_thread=False,
+                                                 timeout=60)
+        self.db_connection.executemany("""
+            INSERT INTO stage_timings (batch_number, sec_cik,
+            sec_accession_number, stage, wall_time, cpu_time, n_bytes,
+            process_id, end_time) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                                       self.pending_rows)
+        self.db_connection.executemany("""
+            INSERT INTO filing_memory (batch_number, sec_cik,
+            sec_accession_number, submission_size, html_bytes, txt_bytes,
+            memory_estimate, base_rss, peak_rss, process_id, end_time)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                                       self.pending_memory_rows)
+        self.db_connection.commit()
+        self.pending_rows = []
+        self.pending_memory_rows = []
+
+    def write_prometheus(self):
+        self.last_write_time = time.time()
+        if not self.prometheus_path:
+            return
+        lines = []
+        for metric, metric_type, description in [
+                ('stage_seconds_total', 'counter',
+                 'Wall-clock seconds spent in each processing stage'),
+                ('stage_cpu_seconds_total', 'counter',
+                 'CPU seconds spent in each processing stage'),
+                ('stage_bytes_total', 'counter',
+                 'Bytes of input processed by each stage'),
+                ('stage_runs_total', 'counter',
+                 'Number of times each stage was run'),
+                ('stage_seconds', 'summary',
+                 'Wall-clock seconds per run of each stage')]:
+            lines.append('# HELP secedgartext_%s %s' % (metric, description))
+            lines.append('# TYPE secedgartext_%s %s' % (metric, metric_type))
+            for stage, stats in sorted(self.stats.items()):
+                label = 'batch="%i",stage="%s"' % (self.batch_number, stage)
+                if metric == 'stage_seconds':
+                    sorted_times = sorted(stats['wall_times'])
+                    for q in [50, 95, 99]:
+                        lines.append('secedgartext_%s{%s,quantile="%s"} %f' %
+                                     (metric, label, q / 100,
+                                      percentile(sorted_times, q)))
+                    continue
+                value = {'stage_seconds_total': stats['wall_time'],
+                         'stage_cpu_seconds_total': stats['cpu_time'],
+                         'stage_bytes_total': stats['n_bytes'],
+                         'stage_runs_total': stats['runs']}[metric]
+                lines.append('secedgartext_%s{%s} %s' % (metric, label, value))
+        # write to a temporary file first, so that the collector never
+        # reads a half-written file
+        temp_path = self.prometheus_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(temp_path, self.prometheus_path)
+
+    def flush(self):
+        self.save_to_db()
+        self.write_prometheus()
+
+    def summary(self):
+        """Per-stage summary lines: run count, wall-clock percentiles,
+        CPU share and throughput
+        """
+        lines = ['%-16s %8s %9s %9s %9s %9s %9s' %
+                 ('stage', 'runs', 'p50 s', 'p95 s', 'p99 s', 'CPU %',
+                  'MB/s')]
+        for stage in STAGES + sorted(set(self.stats) - set(STAGES)):
+            if stage not in self.stats:
+                continue
+            stats = self.stats[stage]
+            sorted_times = sorted(stats['wall_times'])
+            total_time = stats['wall_time']
+            lines.append('%-16s %8i %9.3f %9.3f %9.3f %9.1f %9.2f' % (
+                stage, stats['runs'], percentile(sorted_times, 50),
+                percentile(sorted_times, 95), percentile(sorted_times, 99),
+                100 * stats['cpu_time'] / total_time if total_time else 0,
+                stats['n_bytes'] / 1e6 / total_time if total_time else 0))
+        return lines
+
+    def dedup_summary(self):
+        """Share of the batch's documents skipped as duplicates, or None
+        if no documents were deduplicated
+        """
+        n_documents = sum(self.dedup_counts.values())
+        if not n_documents:
+            return None
+        n_duplicates = n_documents - self.dedup_counts.get('new', 0)
+        return ('Duplicates: %i of %i documents (%.1f%%): %i of the same '
+                'document, %i of the same plaintext; %i sections reused' %
+                (n_duplicates, n_documents, 100 * n_duplicates / n_documents,
+                 self.dedup_counts.get('document', 0),
+                 self.dedup_counts.get('plaintext', 0), self.dedup_sections))
+
+    def close(self):
+        self.flush()
+        if self.db_connection is not None:
+            self.db_connection.close()
+            self.db_connection = None
+        super(MetricsHandler, self).close()
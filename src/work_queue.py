@@ -0,0 +1,203 @@
+"""
+    secedgartext: extract text from SEC corporate filings
+    Copyright (C) 2017  Alexander Ions
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from .utils import logger
+
+CREATE_TABLE = """
+    CREATE TABLE IF NOT EXISTS work_queue (
+    id integer PRIMARY KEY,
+    queue_name text NOT NULL,
+    unit_key text NOT NULL,
+    payload text,
+    status text NOT NULL DEFAULT 'pending',
+    lease_owner text,
+    lease_expires real,
+    attempts integer NOT NULL DEFAULT 0,
+    batch_number integer,
+    last_error text,
+    updated_time real,
+    UNIQUE (queue_name, unit_key))
+    """
+
+
+class WorkQueue(object):
+    """Queue of work units shared by any number of crawler nodes, in a
+    SQLite database on storage that they can all reach.
+
+    A node leases one unit at a time. While it works on the unit, it renews
+    the lease (see keep_alive()); if the node crashes, the lease expires and
+    another node takes the unit over. Units that fail max_attempts times
+    are marked as failed.
+    Unit status: pending -> leased -> done (or failed)
+    """
+
+    def __init__(self, db_location, queue_name, node_id, lease_seconds=600,
+                 max_attempts=3, batch_number=None):
+        """
+        :param db_location: path of the SQLite database
+        :param queue_name: name of the queue, so that one database can hold
+        several independent queues
+        :param node_id: identifies this node as the owner of its leases
+        :param lease_seconds: a lease expires if it is not renewed within
+        this time
+        :param max_attempts: number of times a unit is leased before it is
+        given up as failed
+        :param batch_number: batch number of this node's run, recorded
+        against each unit it leases
+        """
+        self.db_location = db_location
+        self.queue_name = queue_name
+        self.node_id = node_id
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.batch_number = batch_number
+        self.connection = sqlite3.connect(db_location, timeout=60)
+        self.connection.execute(CREATE_TABLE)
+        self.connection.commit()
+
+    def add(self, units):
+        """Add work units to the queue. Units already in the queue (in any
+        status) are ignored, so every node can add the same list.
+
+        :param units: iterable of (unit_key, payload) pairs; payload is any
+        JSON-serializable value
+        :return: number of units added
+        """
+        now = time.time()
+        cursor = self.connection.executemany("""
+            INSERT OR IGNORE INTO work_queue (queue_name, unit_key, payload,
+            updated_time) VALUES (?, ?, ?, ?)""",
+                                             [(self.queue_name, key,
+                                               json.dumps(payload), now)
+                                              for key, payload in units])
+        self.connection.commit()
+        return cursor.rowcount
+
+    def lease(self):
+        """Lease the next pending unit, or a unit whose lease has expired
+
+        :return: dict with the unit's id, unit_key, payload and attempts
+        (including this one), or None if no unit is available
+        """
+        now = time.time()
+        connection = self.connection
+        # BEGIN IMMEDIATE takes the database's write lock before reading,
+        # so two nodes cannot lease the same unit
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.execute("""
+                UPDATE work_queue SET status = 'failed', lease_owner = NULL,
+                last_error = 'lease expired after final attempt',
+                updated_time = ?
+                WHERE queue_name = ? AND status = 'leased'
+                AND lease_expires < ? AND attempts >= ?""",
+                               (now, self.queue_name, now, self.max_attempts))
+            row = connection.execute("""
+                SELECT id, unit_key, payload, attempts FROM work_queue
+                WHERE queue_name = ? AND (status = 'pending' OR
+                (status = 'leased' AND lease_expires < ?))
+                ORDER BY id LIMIT 1""", (self.queue_name, now)).fetchone()
+            if row:
+                connection.execute("""
+                    UPDATE work_queue SET status = 'leased', lease_owner = ?,
+                    lease_expires = ?, attempts = attempts + 1,
+                    batch_number = ?, updated_time = ? WHERE id = ?""",
+                                   (self.node_id, now + self.lease_seconds,
+                                    self.batch_number, now, row[0]))
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        if not row:
+            return None
+        return {'id': row[0], 'unit_key': row[1],
+                'payload': json.loads(row[2]), 'attempts': row[3] + 1}
+
+    def renew(self, unit, connection=None):
+        """Extend the lease on unit
+
+        :return: False if the lease has been lost (expired and taken over)
+        """
+        connection = connection or self.connection
+        cursor = connection.execute("""
+            UPDATE work_queue SET lease_expires = ?
+            WHERE id = ? AND lease_owner = ? AND status = 'leased'""",
+                                    (time.time() + self.lease_seconds,
+                                     unit['id'], self.node_id))
+        connection.commit()
+        return cursor.rowcount == 1
+
+    def complete(self, unit):
+        """Mark a leased unit as done
+
+        :return: False if the lease had been lost
+        """
+        cursor = self.connection.execute("""
+            UPDATE work_queue SET status = 'done', lease_owner = NULL,
+            updated_time = ?
+            WHERE id = ? AND lease_owner = ? AND status = 'leased'""",
+                                         (time.time(), unit['id'],
+                                          self.node_id))
+        self.connection.commit()
+        return cursor.rowcount == 1
+
+    def fail(self, unit, error):
+        """Return a leased unit to the queue after an error, or mark it as
+        failed after max_attempts
+        """
+        status = 'failed' if unit['attempts'] >= self.max_attempts \
+            else 'pending'
+        self.connection.execute("""
+            UPDATE work_queue SET status = ?, lease_owner = NULL,
+            last_error = ?, updated_time = ?
+            WHERE id = ? AND lease_owner = ? AND status = 'leased'""",
+                                (status, str(error)[:1000], time.time(),
+                                 unit['id'], self.node_id))
+        self.connection.commit()
+
+    def counts(self):
+        """Number of units in each status
+        """
+        return dict(self.connection.execute("""
+            SELECT status, count(*) FROM work_queue WHERE queue_name = ?
+            GROUP BY status""", (self.queue_name,)).fetchall())
+
+    @contextmanager
+    def keep_alive(self, unit):
+        """Renew the lease on unit from a background thread, until the
+        block exits
+        """
+        stop = threading.Event()
+
+        def heartbeat():
+            # the thread needs a database connection of its own
+            connection = sqlite3.connect(self.db_location, timeout=60)
+            try:
+                while not stop.wait(self.lease_seconds / 3):
+                    if not self.renew(unit, connection):
+                        logger.warning('Lost the lease on work unit %s',
+                                       unit['unit_key'])
+                        break
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=heartbeat, daemon=True)
+        thread.start()
+        try:
+            yield unit
+        finally:
+            stop.set()
+            thread.join()
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,326 @@
+"""
+    secedgartext: extract text from SEC corporate filings
+    Copyright (C) 2017  Alexander Ions
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Worker pool with per-task timeouts, worker recycling and failure
+isolation, with the apply_async() / close() / join() interface of
+multiprocessing.Pool.
+
+multiprocessing.Pool cannot tell which worker is running a task, so a
+task stuck in a regular expression or parser holds its worker (and
+pool.join()) forever, and a worker that dies loses its task without a
+trace. Here each worker has a pipe of its own, and the pool's manager
+thread knows which task each one is running:
+
+- a task running for longer than task_timeout seconds has its worker
+  killed; the task fails with TaskTimeoutError, and a new worker is started
+- a worker which dies (e.g. killed for lack of memory) fails its task with
+  WorkerLostError, and is replaced
+- a worker is replaced after max_tasks_per_child tasks, or once its RSS is
+  over max_worker_rss bytes, which limits the growth of its memory from
+  fragmentation over thousands of filings
+"""
+import collections
+import itertools
+import multiprocessing as mp
+import threading
+import time
+import traceback
+from multiprocessing.connection import wait
+
+from .memory import MB, current_rss
+from .utils import logger
+
+
+class TaskTimeoutError(Exception):
+    """The task ran for longer than the pool's task timeout
+    """
+
+
+class WorkerLostError(Exception):
+    """The worker running the task exited before finishing it
+    """
+
+
+class RemoteTraceback(Exception):
+    """Traceback of an exception raised in a worker, set as the __cause__
+    of the exception passed to the error callback
+    """
+
+    def __init__(self, tb):
+        self.tb = tb
+
+    def __str__(self):
+        return self.tb
+
+
+def _worker_main(connection, initializer, initargs):
+    """Worker process: run the tasks sent on connection until it sends None
+    """
+    if initializer:
+        initializer(*initargs)
+    while True:
+        task = connection.recv()
+        if task is None:
+            break
+        task_id, function, args, kwds = task
+        try:
+            result = (True, function(*args, **kwds))
+        except Exception as e:
+            result = (False, (e, traceback.format_exc()))
+        try:
+            connection.send((task_id, result, current_rss()))
+        except Exception as e:
+            # the result or exception could not be pickled
+            connection.send((task_id, (False, (RuntimeError(
+                'Could not send result: %r' % e), traceback.format_exc())),
+                current_rss()))
+
+
+class Worker(object):
+    def __init__(self, context, initializer, initargs):
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main,
+            args=(child_connection, initializer, initargs), daemon=True)
+        self.process.start()
+        child_connection.close()
+        self.task = None
+        self.task_start = None
+        self.n_tasks = 0
+        self.rss = None
+
+    def stop(self):
+        try:
+            self.connection.send(None)
+        except OSError:
+            pass
+        self.process.join()
+        self.connection.close()
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.connection.close()
+
+
+class Task(object):
+    __slots__ = ['task_id', 'function', 'args', 'kwds', 'callback',
+                 'error_callback']
+
+    def __init__(self, task_id, function, args, kwds, callback,
+                 error_callback):
+        self.task_id = task_id
+        self.function = function
+        self.args = args
+        self.kwds = kwds
+        self.callback = callback
+        self.error_callback = error_callback
+
+
+class WorkerPool(object):
+    """Pool of worker processes, see the module docstring.
+
+    Callbacks are run by the pool's manager thread, as they are by
+    multiprocessing.Pool's result handler thread.
+    """
+
+    def __init__(self, processes, initializer=None, initargs=(),
+                 task_timeout=None, max_tasks_per_child=None,
+                 max_worker_rss=None, context=None):
+        """
+        :param processes: number of worker processes
+        :param initializer: function run by each worker when it starts
+        :param initargs: arguments for initializer
+        :param task_timeout: wall-clock seconds after which a task's worker
+        is killed (default: no limit)
+        :param max_tasks_per_child: number of tasks after which a worker is
+        replaced (default: no limit)
+        :param max_worker_rss: RSS (bytes) over which a worker is replaced,
+        after its task (default: no limit)
+        :param context: multiprocessing context (default: the current one)
+        """
+        self.processes = processes
+        self.initializer = initializer
+        self.initargs = initargs
+        self.task_timeout = task_timeout
+        self.max_tasks_per_child = max_tasks_per_child
+        self.max_worker_rss = max_worker_rss
+        self.context = context or mp.get_context()
+        self.task_ids = itertools.count()
+        self.pending = collections.deque()
+        self.lock = threading.Lock()
+        self.closed = False
+        self.terminated = False
+        self.n_timeouts = 0
+        self.n_lost = 0
+        self.n_recycled = 0
+        # the manager thread waits on the workers' pipes and on this one,
+        # which wakes it when a task is added or the pool is closed
+        self.wakeup_receiver, self.wakeup_sender = self.context.Pipe(
+            duplex=False)
+        self.workers = [self._start_worker() for _ in range(processes)]
+        self.manager = threading.Thread(target=self._manage, daemon=True,
+                                        name='WorkerPool manager')
+        self.manager.start()
+
+    def _start_worker(self):
+        return Worker(self.context, self.initializer, self.initargs)
+
+    def _wakeup(self):
+        with self.lock:
+            self.wakeup_sender.send(None)
+
+    def apply_async(self, function, args=(), kwds=None, callback=None,
+                    error_callback=None):
+        """Run function(*args, **kwds) in a worker, as for
+        multiprocessing.Pool.apply_async(): the result is passed to
+        callback, or the exception to error_callback
+        """
+        if self.closed:
+            raise ValueError('Pool not running')
+        self.pending.append(Task(next(self.task_ids), function, args,
+                                 kwds or {}, callback, error_callback))
+        self._wakeup()
+
+    def close(self):
+        """No more tasks: the workers stop once the tasks added so far are
+        finished
+        """
+        self.closed = True
+        self._wakeup()
+
+    def join(self):
+        """Wait until the pool is closed and all its tasks are finished
+        """
+        self.manager.join()
+
+    def terminate(self):
+        """Stop the workers now, abandoning any tasks in progress
+        """
+        self.closed = True
+        self.terminated = True
+        self.pending.clear()
+        self._wakeup()
+        self.manager.join()
+
+    def _manage(self):
+        while not self.terminated:
+            self._assign_tasks()
+            busy = [worker for worker in self.workers if worker.task]
+            if self.closed and not busy and not self.pending:
+                break
+            timeout = None
+            if self.task_timeout and busy:
+                now = time.monotonic()
+                timeout = max(0, min(worker.task_start + self.task_timeout
+                                     for worker in busy) - now)
+            ready = wait([self.wakeup_receiver] +
+                         [worker.connection for worker in busy] +
+                         [worker.process.sentinel for worker in self.workers],
+                         timeout)
+            if self.wakeup_receiver in ready:
+                while self.wakeup_receiver.poll():
+                    self.wakeup_receiver.recv()
+            for i, worker in enumerate(self.workers):
+                self.workers[i] = self._check_worker(worker, ready)
+        for worker in self.workers:
+            if self.terminated:
+                worker.kill()
+            elif worker.process.is_alive():
+                worker.stop()
+
+    def _assign_tasks(self):
+        for worker in self.workers:
+            if not self.pending:
+                return
+            if worker.task is None:
+                task = self.pending.popleft()
+                worker.task = task
+                worker.task_start = time.monotonic()
+                try:
+                    worker.connection.send((task.task_id, task.function,
+                                            task.args, task.kwds))
+                except Exception as e:
+                    # the task could not be pickled (the worker is
+                    # unaffected), or the worker has gone
+                    worker.task = None
+                    self._run_callback(task.error_callback, e)
+
+    def _check_worker(self, worker, ready):
+        """Handle a worker's result, exit or timeout
+
+        :return: the worker, or the worker started in its place
+        """
+        task = worker.task
+        if task and worker.connection in ready:
+            try:
+                task_id, (success, value), worker.rss = \
+                    worker.connection.recv()
+            except (EOFError, OSError):
+                # the worker died: handled with its sentinel below
+                pass
+            else:
+                worker.task = None
+                worker.n_tasks += 1
+                if success:
+                    self._run_callback(task.callback, value)
+                else:
+                    exception, tb = value
+                    exception.__cause__ = RemoteTraceback(tb)
+                    self._run_callback(task.error_callback, exception)
+                if self._should_recycle(worker):
+                    self.n_recycled += 1
+                    worker.stop()
+                    return self._start_worker()
+                return worker
+        if worker.process.sentinel in ready or not worker.process.is_alive():
+            worker.process.join()
+            exit_code = worker.process.exitcode
+            worker.connection.close()
+            if task:
+                self.n_lost += 1
+                logger.warning('Worker %i exited (code %s) while running a '
+                               'task: replacing it', worker.process.pid,
+                               exit_code)
+                self._run_callback(task.error_callback, WorkerLostError(
+                    'Worker exited with code %s' % exit_code))
+            return self._start_worker()
+        if task and self.task_timeout and \
+                time.monotonic() - worker.task_start >= self.task_timeout:
+            self.n_timeouts += 1
+            logger.warning('Task timed out after %ss: killing worker %i and '
+                           'replacing it', self.task_timeout,
+                           worker.process.pid)
+            worker.kill()
+            self._run_callback(task.error_callback, TaskTimeoutError(
+                'Task timed out after %s seconds' % self.task_timeout))
+            return self._start_worker()
+        return worker
+
+    def _should_recycle(self, worker):
+        if self.closed and not self.pending:
+            # the worker is about to stop anyway
+            return False
+        if self.max_tasks_per_child and \
+                worker.n_tasks >= self.max_tasks_per_child:
+            return True
+        if self.max_worker_rss and worker.rss and \
+                worker.rss > self.max_worker_rss:
+            logger.debug('Worker %i RSS %.0f MB: replacing it',
+                         worker.process.pid, worker.rss / MB)
+            return True
+        return False
+
+    def _run_callback(self, callback, value):
+        if not callback:
+            return
+        try:
+            callback(value)
+        except Exception:
+            # as in multiprocessing.Pool, a failing callback must not stop
+            # the pool
+            logger.exception('Error in worker pool callback')
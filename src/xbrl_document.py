@@ -0,0 +1,312 @@
+"""
+    secedgartext: extract text from SEC corporate filings
+    Copyright (C) 2017  Alexander Ions
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Extraction from XBRL documents (the <XBRL> blocks of a submission): inline
+XBRL (iXBRL) primary documents, which are XHTML with tagged facts, and
+XBRL instance documents.
+
+The document is streamed through lxml's XML parser, fed in chunks, with a
+parser target receiving the start tag, text and end tag events in
+document order. No tree is built, so memory use does not grow with the
+size of the document (beyond the text extracted). The paragraphs of the
+text are found as HtmlDocument finds them from its BeautifulSoup tree, and
+numeric tables are removed by the same test, then sections are extracted
+from the text as for HTML documents. The hidden ix:header (contexts, units
+and hidden facts) is skipped.
+
+Text block facts are kept in text_blocks: for inline XBRL, each
+ix:nonNumeric fact (e.g. a note to the financial statements tagged as a
+...TextBlock); for an instance document, each fact whose concept name ends
+in TextBlock, its escaped HTML converted to text.
+"""
+import re
+from html import unescape
+from statistics import median
+
+from lxml import etree
+
+from .html_document import HtmlDocument
+from .timing import timed_stage
+from .utils import logger
+
+# tags which start a new paragraph (see html_document.is_line_break)
+BLOCK_TAGS = {'p', 'div', 'br', 'hr', 'tr', 'table', 'form', 'h1', 'h2',
+              'h3', 'h4', 'h5', 'h6'}
+BLOCK_STYLE = re.compile(r'margin-(top|bottom)')
+HIDDEN_STYLE = re.compile(r'display\s*:\s*none', re.IGNORECASE)
+XML_DECLARATION = re.compile(r'^\s*(<xbrl>)?\s*(<\?xml[^>]*\?>)?',
+                             re.IGNORECASE)
+XBRL_END = re.compile(r'</xbrl>\s*$', re.IGNORECASE)
+HTML_BLOCK_TAG = re.compile(r'<(?:/?(?:p|div|tr|table|h[1-6]|li)|br|hr)\b'
+                            r'[^>]*>', re.IGNORECASE)
+HTML_TAG = re.compile(r'<[^>]*>')
+
+# characters of the document passed to the parser at a time
+FEED_CHARS = 1 << 20
+
+
+def local_name(tag):
+    """Tag without its namespace, e.g. '{http://...}nonNumeric' -> 'nonNumeric'
+    """
+    return tag.rsplit('}', 1)[-1] if isinstance(tag, str) else ''
+
+
+def html_fragment_text(markup):
+    """Text of an escaped HTML fragment (the value of a text block fact in
+    an instance document), with its paragraphs separated by blank lines
+    """
+    text = HTML_TAG.sub('', HTML_BLOCK_TAG.sub('\n\n', markup))
+    paragraphs = (re.sub(r'\s+', ' ', unescape(p)).strip()
+                  for p in text.split('\n\n'))
+    return '\n\n'.join(p for p in paragraphs if p)
+
+
+def is_numeric_table(string_lengths):
+    """HtmlDocument.should_remove_table(), from the lengths of the table's
+    (non-blank, stripped) strings
+    """
+    return len(string_lengths) > 5 and median(string_lengths) < 30
+
+
+class XbrlTextTarget(object):
+    """lxml parser target: collects the paragraphs of the document and its
+    text blocks from the parser's events, see the module docstring.
+
+    Paragraphs are built as in HtmlDocument's walk of its BeautifulSoup tree:
+    the start of a block element ends a paragraph, and text up to the start
+    of the next block element (including text after the block's end tag)
+    continues it. The events inside a table are held until the end of the
+    table, when the table is either replayed or, if it is numeric, replaced
+    by '[DATA_TABLE_REMOVED]'.
+    """
+
+    def __init__(self):
+        self.paragraphs = []
+        self.text_blocks = []
+        self.is_instance = None
+        self.n_elements = 0
+        # text since the last tag, and the current paragraph
+        self.string = []
+        self.paragraph = []
+        self.is_in_a_paragraph = True
+        # names of the open elements, and the depth inside a hidden element
+        self.stack = []
+        self.hidden_depth = 0
+        # for each open table, its events (strings, or None for a paragraph
+        # break) and the lengths of its stripped strings
+        self.tables = []
+        # for each open table cell (of an open table), its depth, the number
+        # of its descendants of each name, and the paragraph breaks made by
+        # its block children
+        self.cells = []
+        # open ix:nonNumeric facts (inline XBRL) or text block facts
+        # (instance document)
+        self.facts = []
+
+    def start(self, tag, attrib):
+        self.end_string()
+        self.n_elements += 1
+        if self.hidden_depth:
+            self.hidden_depth += 1
+            return
+        name = local_name(tag)
+        if self.is_instance is None:
+            self.is_instance = name == 'xbrl'
+        if self.is_instance:
+            if name.endswith('TextBlock'):
+                self.start_fact(name, attrib)
+            return
+        style = attrib.get('style', '')
+        if name == 'header' or HIDDEN_STYLE.search(style):
+            self.hidden_depth = 1
+            return
+        name = name.lower()
+        parent = self.stack[-1] if self.stack else None
+        self.stack.append(name)
+        for cell in self.cells:
+            cell['counts'][name] = cell['counts'].get(name, 0) + 1
+        if name == 'nonnumeric':
+            self.start_fact(attrib.get('name'), attrib)
+        elif name == 'table':
+            self.tables.append({'events': [], 'lengths': []})
+        if BLOCK_STYLE.search(style):
+            self.add_break()
+            self.break_facts()
+        elif name in BLOCK_TAGS:
+            self.add_break()
+            self.break_facts()
+            if parent == 'td' and self.tables and self.cells and \
+                    self.cells[-1]['depth'] == len(self.stack) - 1:
+                # a block element alone in its table cell may not start a
+                # new line: decided at the end of the cell
+                events = self.tables[-1]['events']
+                self.cells[-1]['breaks'].append((events, len(events) - 1,
+                                                 name))
+        if name == 'td' and self.tables:
+            # (a td outside any table, as in some sloppy inline XBRL, is
+            # just an inline element)
+            self.cells.append({'depth': len(self.stack), 'counts': {},
+                               'breaks': []})
+
+    def end(self, tag):
+        self.end_string()
+        if self.hidden_depth:
+            self.hidden_depth -= 1
+            return
+        name = local_name(tag)
+        if self.is_instance:
+            if name.endswith('TextBlock') and self.facts:
+                fact = self.end_fact()
+                if fact['text']:
+                    for paragraph in [fact['name']] + \
+                            fact['text'].split('\n\n'):
+                        self.add_break()
+                        self.add_string(paragraph)
+            return
+        if not self.stack:
+            return
+        depth = len(self.stack)
+        name = self.stack.pop()
+        if name == 'td' and self.cells and self.cells[-1]['depth'] == depth:
+            cell = self.cells.pop()
+            for events, i, break_name in cell['breaks']:
+                if cell['counts'][break_name] == 1:
+                    events[i] = False
+        elif name == 'table' and self.tables:
+            self.end_table()
+        elif name == 'nonnumeric' and self.facts:
+            self.end_fact()
+
+    def data(self, text):
+        if not self.hidden_depth:
+            self.string.append(text)
+
+    def close(self):
+        self.end_string()
+        while self.tables:
+            self.end_table()
+        self.add_break()
+        return self
+
+    def start_fact(self, name, attrib):
+        self.facts.append({'name': name,
+                           'context_ref': attrib.get('contextRef'),
+                           'parts': []})
+
+    def end_fact(self):
+        fact = self.facts.pop()
+        text = ''.join(fact.pop('parts'))
+        if self.is_instance:
+            fact['text'] = html_fragment_text(text)
+        else:
+            fact['text'] = re.sub(r'\n\s*\n', '\n\n', text).strip()
+        self.text_blocks.append(fact)
+        return fact
+
+    def end_string(self):
+        """Add the text since the last tag to the current paragraph (as a
+        NavigableString is added in HtmlDocument's text walk)
+        """
+        if not self.string:
+            return
+        string = ''.join(self.string)
+        self.string = []
+        if self.is_instance:
+            for fact in self.facts:
+                fact['parts'].append(string)
+            return
+        for table in self.tables:
+            if string.strip():
+                table['lengths'].append(len(string.strip()))
+        collapsed = re.sub(r'\s+', ' ', string)
+        if collapsed:
+            self.add_string(collapsed)
+            for fact in self.facts:
+                fact['parts'].append(collapsed)
+
+    def add_string(self, string):
+        if self.tables:
+            self.tables[-1]['events'].append(string)
+            return
+        if not self.is_in_a_paragraph:
+            self.is_in_a_paragraph = True
+            self.paragraph = []
+        self.paragraph.append(string)
+
+    def break_facts(self):
+        for fact in self.facts:
+            fact['parts'].append('\n\n')
+
+    def add_break(self):
+        if self.tables:
+            self.tables[-1]['events'].append(None)
+            return
+        if self.is_in_a_paragraph:
+            self.is_in_a_paragraph = False
+            self.paragraphs.append(''.join(self.paragraph))
+
+    def end_table(self):
+        """Replay the events of the table just ended, or replace it"""
+        table = self.tables.pop()
+        if self.tables:
+            # the enclosing table is tested with this table's strings
+            self.tables[-1]['lengths'] += table['lengths']
+        if is_numeric_table(table['lengths']):
+            self.add_string('[DATA_TABLE_REMOVED]')
+            return
+        for event in table['events']:
+            if event is None:
+                self.add_break()
+            elif event is not False:
+                self.add_string(event)
+
+
+class XbrlDocument(HtmlDocument):
+    """Inline XBRL or XBRL instance document, see the module docstring.
+    Sections are found with the HTML search terms.
+    """
+    text_blocks = None
+
+    def __init__(self, *args, **kwargs):
+        super(XbrlDocument, self).__init__(*args, **kwargs)
+
+    def prepare_text(self):
+        """Stream the document through the XML parser, initialising the
+        'plaintext' and 'text_blocks' attributes. A document which is not
+        XML after all is parsed as HTML instead.
+        """
+        xml_text = XBRL_END.sub('', XML_DECLARATION.sub('', self.doc_text,
+                                                        count=1))
+        with timed_stage('xbrl_parse', len(xml_text)):
+            target = XbrlTextTarget()
+            # recover from the odd error, such as an HTML entity which is
+            # not defined in XML
+            parser = etree.XMLParser(target=target, recover=True,
+                                     huge_tree=True, resolve_entities=False)
+            try:
+                for start in range(0, len(xml_text), FEED_CHARS):
+                    parser.feed(xml_text[start:start + FEED_CHARS])
+                parser.close()
+            except Exception as e:
+                # an error in the XML, or in the target on markup it does
+                # not expect
+                logger.debug('XBRL document could not be parsed as XML (%r): '
+                             'parsing it as HTML', e)
+                target = None
+        if target is None or not (any(p.strip() for p in target.paragraphs)
+                                  or target.text_blocks):
+            self.text_blocks = []
+            return super(XbrlDocument, self).prepare_text()
+        logger.debug('{:,} characters; {:,} XML elements; {:,} text '
+                     'blocks'.format(len(xml_text), target.n_elements,
+                                     len(target.text_blocks)))
+        self.text_blocks = target.text_blocks
+        document_string = '\n\n' + '\n\n'.join(target.paragraphs)
+        # clean up multiple line-breaks, as for HTML documents
+        document_string = re.sub(r'\n\s+\n', '\n\n', document_string)
+        document_string = re.sub(r'\n{3,}', '\n\n', document_string)
+        self.plaintext = document_string
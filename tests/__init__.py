@@ -0,0 +1,13 @@
+"""
+    secedgartext: extract text from SEC corporate filings
+    Copyright (C) 2017  Alexander Ions
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Tests of the metadata database's bookkeeping: work queue leases, batch
+numbers, the completion ledger, feed watermarks and schema migrations.
+Each test uses a temporary SQLite database. Run from the project folder:
+
+    python -m pytest tests
+"""
@@ -0,0 +1,38 @@
+"""
+    secedgartext: extract text from SEC corporate filings
+    Copyright (C) 2017  Alexander Ions
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import pytest
+
+from src import runtime as runtime_module
+from src.config import Config
+from src.runtime import Runtime, TABLES
+from src.schema import migrate
+
+
+def make_runtime(storage, **options):
+    """Runtime with its metadata database set up as by Runtime.start(), but
+    without a batch number, storage folder or logging
+    """
+    runtime = Runtime(Config(storage=str(storage), filings='10-K',
+                             start='20200101', end='20201231', **options))
+    connection = runtime.sql_connection
+    for create_table in TABLES:
+        connection.execute(create_table)
+    connection.commit()
+    migrate(connection)
+    return runtime
+
+
+@pytest.fixture
+def runtime(tmp_path, monkeypatch):
+    """The current Runtime (see get_runtime()), with batch number 1
+    """
+    runtime = make_runtime(tmp_path)
+    runtime.batch_number = 1
+    monkeypatch.setattr(runtime_module, '_current_runtime', runtime)
+    yield runtime
+    runtime.close()
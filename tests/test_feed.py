@@ -0,0 +1,82 @@
+"""
+    secedgartext: extract text from SEC corporate filings
+    Copyright (C) 2017  Alexander Ions
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import pytest
+
+from src.feed import Feed, get_watermark
+from src.ledger import FILING, record_completion
+from src.storage import accession_number
+
+COMPANIES = [['1', 'ONE'], ['2', 'TWO']]
+
+MASTER_INDEX = """Description:           Master Index of EDGAR Dissemination Feed
+
+CIK|Company Name|Form Type|Date Filed|Filename
+--------------------------------------------------------------------------------
+1|ONE INC|10-K|2020-03-02|edgar/data/1/0000000001-20-000001.txt
+2|TWO INC|10-K|2020-03-03|edgar/data/2/0000000002-20-000001.txt
+2|TWO INC|8-K|2020-03-04|edgar/data/2/0000000002-20-000002.txt
+3|THREE INC|10-K|2020-03-05|edgar/data/3/0000000003-20-000001.txt
+"""
+
+
+@pytest.fixture
+def index_file(tmp_path):
+    location = tmp_path / 'master.idx'
+    location.write_text(MASTER_INDEX)
+    return str(location)
+
+
+def complete(url):
+    record_completion(accession_number(url), FILING, FILING, 'success')
+
+
+def test_feed_finds_new_filings_of_the_companies(runtime, index_file):
+    feed = Feed(runtime, index_file)
+    urls = [url for url, description in feed.filings(COMPANIES, ['10-K'])]
+    assert [accession_number(url) for url in urls] == \
+        ['0000000001-20-000001', '0000000002-20-000001']
+
+
+def test_watermark_moves_to_last_date_read(runtime, index_file):
+    feed = Feed(runtime, index_file)
+    urls = [url for url, description in feed.filings(COMPANIES, ['10-K'])]
+    for url in urls:
+        complete(url)
+    feed.commit(urls)
+    assert get_watermark(index_file) == 20200305
+
+
+def test_watermark_held_at_earliest_incomplete_filing(runtime, index_file):
+    feed = Feed(runtime, index_file)
+    urls = [url for url, description in feed.filings(COMPANIES, ['10-K'])]
+    complete(urls[1])
+    feed.commit(urls)
+    assert get_watermark(index_file) == 20200302
+
+    # the next run only finds the incomplete filing
+    feed = Feed(runtime, index_file)
+    retry_urls = [url for url, description in
+                  feed.filings(COMPANIES, ['10-K'])]
+    assert retry_urls == urls[:1]
+    complete(urls[0])
+    feed.commit(retry_urls)
+    assert get_watermark(index_file) == 20200305
+
+
+def test_watermark_never_moves_back(runtime, index_file):
+    feed = Feed(runtime, index_file)
+    urls = [url for url, description in feed.filings(COMPANIES, ['10-K'])]
+    for url in urls:
+        complete(url)
+    feed.commit(urls)
+    # a later run whose filings all fail does not move the watermark back
+    feed = Feed(runtime, index_file)
+    feed.filing_dates = {'https://www.sec.gov/x/0000000009-20-000001':
+                         20200101}
+    feed.commit(list(feed.filing_dates))
+    assert get_watermark(index_file) == 20200305
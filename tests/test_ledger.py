@@ -0,0 +1,36 @@
+"""
+    secedgartext: extract text from SEC corporate filings
+    Copyright (C) 2017  Alexander Ions
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+from src.ledger import FILING, completed_sections, is_filing_complete, \
+    record_completion
+
+ACCESSION = '0000000001-20-000001'
+
+
+def test_filing_completion(runtime):
+    assert not is_filing_complete(ACCESSION)
+    record_completion(ACCESSION, FILING, FILING, 'failed')
+    assert not is_filing_complete(ACCESSION)
+    # a retry replaces the filing's outcome
+    record_completion(ACCESSION, FILING, FILING, 'success')
+    assert is_filing_complete(ACCESSION)
+    assert not is_filing_complete('0000000001-20-000002')
+
+
+def test_completed_sections_include_sections_not_found(runtime):
+    record_completion(ACCESSION, '10-K', 'Item1', 'success', 'item1.txt')
+    record_completion(ACCESSION, '10-K', 'Item7', 'not_found')
+    record_completion(ACCESSION, '10-Q', 'Item2', 'success')
+    assert completed_sections(ACCESSION, '10-K') == {'Item1', 'Item7'}
+    assert completed_sections(ACCESSION, '10-Q') == {'Item2'}
+    assert completed_sections('0000000001-20-000002', '10-K') == set()
+
+
+def test_completions_are_recorded_against_the_batch(runtime):
+    record_completion(ACCESSION, FILING, FILING, 'success')
+    assert runtime.sql_connection.execute(
+        'SELECT batch_number FROM completion_ledger').fetchall() == [(1,)]
@@ -0,0 +1,95 @@
+"""
+    secedgartext: extract text from SEC corporate filings
+    Copyright (C) 2017  Alexander Ions
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import threading
+import time
+
+import pytest
+
+from src.work_queue import WorkQueue
+
+from .conftest import make_runtime
+
+
+def add_batch(runtime, batch_number, machine_id):
+    connection = runtime.sql_connection
+    connection.execute('INSERT INTO metadata (batch_number, batch_signature,'
+                       ' batch_start_time, batch_machine_id, sec_cik) '
+                       'VALUES (?, ?, ?, ?, ?)',
+                       (batch_number, '', '2020-01-01 00:00:00.000',
+                        machine_id, 'dummy_cik_code'))
+    connection.commit()
+
+
+def test_batch_numbers_are_reserved_in_turn(tmp_path):
+    runtime = make_runtime(tmp_path)
+    assert runtime.reserve_batch_number() == 1
+    assert runtime.reserve_batch_number() == 2
+    runtime.close()
+
+
+def test_concurrent_batches_reserve_distinct_numbers(tmp_path):
+    runtimes = [make_runtime(tmp_path) for _ in range(8)]
+    barrier = threading.Barrier(len(runtimes))
+    batch_numbers = []
+
+    def reserve(runtime):
+        barrier.wait()
+        batch_numbers.append(runtime.reserve_batch_number())
+        runtime.close()
+
+    threads = [threading.Thread(target=reserve, args=(runtime,))
+               for runtime in runtimes]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(batch_numbers) == list(range(1, len(runtimes) + 1))
+
+
+def test_reserved_batch_records_the_machine(tmp_path):
+    runtime = make_runtime(tmp_path)
+    batch_number = runtime.reserve_batch_number()
+    assert runtime.latest_batch_number() == batch_number
+    runtime.close()
+
+
+def test_resume_takes_this_machines_latest_batch(tmp_path):
+    runtime = make_runtime(tmp_path, resume='latest')
+    assert runtime.resume_batch_number() == 0
+    add_batch(runtime, 1, runtime.batch_machine_id)
+    add_batch(runtime, 2, runtime.batch_machine_id)
+    add_batch(runtime, 3, 'another-machine')
+    assert runtime.resume_batch_number() == 2
+    runtime.close()
+
+
+def test_resume_given_batch(tmp_path):
+    runtime = make_runtime(tmp_path, resume='3')
+    add_batch(runtime, 3, 'another-machine')
+    assert runtime.resume_batch_number() == 3
+    runtime.close()
+    runtime = make_runtime(tmp_path, resume='4')
+    with pytest.raises(ValueError):
+        runtime.resume_batch_number()
+    runtime.close()
+
+
+def test_resume_rejects_batch_with_live_leases(tmp_path):
+    runtime = make_runtime(tmp_path, resume='latest')
+    add_batch(runtime, 1, runtime.batch_machine_id)
+    queue = WorkQueue(runtime.db_location, 'test', 'node', lease_seconds=0.2,
+                      batch_number=1)
+    queue.add([('1:10-K', None)])
+    queue.lease()
+    with pytest.raises(ValueError):
+        runtime.resume_batch_number()
+    # once the lease has expired, the batch is no longer running
+    time.sleep(0.3)
+    assert runtime.resume_batch_number() == 1
+    queue.close()
+    runtime.close()
@@ -0,0 +1,67 @@
+"""
+    secedgartext: extract text from SEC corporate filings
+    Copyright (C) 2017  Alexander Ions
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import sqlite3
+
+from src.runtime import TABLES
+from src.schema import SCHEMA_VERSION, migrate, schema_version
+
+
+def index_names(connection):
+    return set(row[0] for row in connection.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'index' "
+        "AND name NOT LIKE 'sqlite_autoindex%'"))
+
+
+def legacy_database(tmp_path):
+    """Database made by a version of the program before schema versions
+    """
+    connection = sqlite3.connect(str(tmp_path / 'metadata.sqlite3'))
+    for create_table in TABLES:
+        connection.execute(create_table)
+    connection.execute("INSERT INTO metadata (batch_number, batch_signature, "
+                       "batch_start_time, sec_cik) "
+                       "VALUES (1, '', '2020-01-01', '0000000001')")
+    connection.commit()
+    return connection
+
+
+def test_new_database_is_at_the_current_version(runtime):
+    assert schema_version(runtime.sql_connection) == SCHEMA_VERSION
+
+
+def test_legacy_database_is_migrated(tmp_path):
+    connection = legacy_database(tmp_path)
+    assert schema_version(connection) == 0
+    assert not index_names(connection)
+    assert migrate(connection) == (0, SCHEMA_VERSION)
+    assert schema_version(connection) == SCHEMA_VERSION
+    assert 'metadata_batch_number' in index_names(connection)
+    # the data is untouched
+    assert connection.execute('SELECT batch_number, sec_cik FROM metadata'
+                              ).fetchall() == [(1, '0000000001')]
+    connection.close()
+
+
+def test_migrate_is_idempotent(tmp_path):
+    connection = legacy_database(tmp_path)
+    migrate(connection)
+    indexes = index_names(connection)
+    assert migrate(connection) == (SCHEMA_VERSION, SCHEMA_VERSION)
+    assert index_names(connection) == indexes
+    connection.close()
+
+
+def test_concurrent_processes_migrate_once(tmp_path):
+    legacy_database(tmp_path).close()
+    first = sqlite3.connect(str(tmp_path / 'metadata.sqlite3'))
+    second = sqlite3.connect(str(tmp_path / 'metadata.sqlite3'))
+    assert migrate(first) == (0, SCHEMA_VERSION)
+    # the second process finds the database already migrated
+    assert migrate(second) == (SCHEMA_VERSION, SCHEMA_VERSION)
+    first.close()
+    second.close()
@@ -0,0 +1,126 @@
+"""
+    secedgartext: extract text from SEC corporate filings
+    Copyright (C) 2017  Alexander Ions
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import sqlite3
+import time
+
+import pytest
+
+from src.work_queue import WorkQueue
+
+
+@pytest.fixture
+def db_location(tmp_path):
+    return str(tmp_path / 'metadata.sqlite3')
+
+
+def make_queue(db_location, node_id, **options):
+    return WorkQueue(db_location, 'test', node_id, **options)
+
+
+def unit_row(db_location, unit):
+    connection = sqlite3.connect(db_location)
+    try:
+        return connection.execute(
+            'SELECT status, lease_owner, lease_expires, attempts '
+            'FROM work_queue WHERE id = ?', (unit['id'],)).fetchone()
+    finally:
+        connection.close()
+
+
+def test_add_ignores_units_already_queued(db_location):
+    queue = make_queue(db_location, 'a')
+    assert queue.add([('1:10-K', {'cik': 1}), ('2:10-K', {'cik': 2})]) == 2
+    assert queue.add([('1:10-K', {'cik': 1}), ('3:10-K', {'cik': 3})]) == 1
+    assert queue.counts() == {'pending': 3}
+
+
+def test_lease_and_complete(db_location):
+    queue = make_queue(db_location, 'a')
+    queue.add([('1:10-K', {'cik': 1})])
+    unit = queue.lease()
+    assert unit['unit_key'] == '1:10-K'
+    assert unit['payload'] == {'cik': 1}
+    assert unit['attempts'] == 1
+    assert queue.lease() is None
+    assert queue.complete(unit)
+    assert queue.counts() == {'done': 1}
+    assert queue.lease() is None
+
+
+def test_live_lease_is_not_taken_over(db_location):
+    node_a = make_queue(db_location, 'a', lease_seconds=60)
+    node_b = make_queue(db_location, 'b', lease_seconds=60)
+    node_a.add([('1:10-K', None)])
+    assert node_a.lease() is not None
+    assert node_b.lease() is None
+
+
+def test_expired_lease_is_taken_over(db_location):
+    node_a = make_queue(db_location, 'a', lease_seconds=0.1)
+    node_b = make_queue(db_location, 'b', lease_seconds=60)
+    node_a.add([('1:10-K', None)])
+    unit_a = node_a.lease()
+    time.sleep(0.2)
+    unit_b = node_b.lease()
+    assert unit_b['id'] == unit_a['id']
+    assert unit_b['attempts'] == 2
+    # node a has lost the unit: it can neither renew nor complete it
+    assert not node_a.renew(unit_a)
+    assert not node_a.complete(unit_a)
+    assert node_b.complete(unit_b)
+    assert node_b.counts() == {'done': 1}
+
+
+def test_unit_fails_after_max_attempts_of_expired_leases(db_location):
+    queue = make_queue(db_location, 'a', lease_seconds=0.05, max_attempts=2)
+    queue.add([('1:10-K', None)])
+    assert queue.lease()['attempts'] == 1
+    time.sleep(0.1)
+    assert queue.lease()['attempts'] == 2
+    time.sleep(0.1)
+    assert queue.lease() is None
+    assert queue.counts() == {'failed': 1}
+
+
+def test_fail_returns_unit_until_max_attempts(db_location):
+    queue = make_queue(db_location, 'a', max_attempts=2)
+    queue.add([('1:10-K', None)])
+    queue.fail(queue.lease(), ValueError('first'))
+    assert queue.counts() == {'pending': 1}
+    queue.fail(queue.lease(), ValueError('second'))
+    assert queue.counts() == {'failed': 1}
+    assert queue.lease() is None
+
+
+def test_keep_alive_renews_the_lease(db_location):
+    node_a = make_queue(db_location, 'a', lease_seconds=0.3)
+    node_b = make_queue(db_location, 'b')
+    node_a.add([('1:10-K', None)])
+    unit = node_a.lease()
+    with node_a.keep_alive(unit):
+        time.sleep(0.8)
+        assert node_b.lease() is None
+    assert node_a.complete(unit)
+
+
+def test_keep_alive_stops_when_the_lease_is_lost(db_location, caplog):
+    node_a = make_queue(db_location, 'a', lease_seconds=0.3)
+    node_a.add([('1:10-K', None)])
+    unit = node_a.lease()
+    with node_a.keep_alive(unit):
+        # another node takes the unit over
+        connection = sqlite3.connect(db_location)
+        connection.execute("UPDATE work_queue SET lease_owner = 'b', "
+                           "lease_expires = 0 WHERE id = ?", (unit['id'],))
+        connection.commit()
+        connection.close()
+        time.sleep(0.5)
+        # the heartbeat has given up, without renewing b's lease
+        assert 'Lost the lease on work unit 1:10-K' in caplog.text
+        assert unit_row(db_location, unit)[1:3] == ('b', 0)
+    assert not node_a.complete(unit)